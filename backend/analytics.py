@@ -0,0 +1,175 @@
+"""
+Execução da query flexível (/api/v1/analytics/query) fora do endpoint.
+
+Usado pelo endpoint e por quem precisa rodar ou identificar a mesma consulta
+sem passar pelo HTTP (cache, aquecimento).
+"""
+import json
+from typing import Any, Dict
+
+from psycopg2.extras import RealDictCursor
+
+from cache import make_key
+from columnar import plan_columnar_query, columnar_cache
+from dimensions import dimension_cache
+from duckdb_engine import duckdb_engine
+from fanout import fanout_executor
+from querybuilder import QueryBuilder
+from rollups import plan_timing_sketch_query, query_timing_percentiles
+from tracing import span
+
+ANALYTICS_CACHE_NAMESPACE = "analytics"
+REFERENCE_CACHE_NAMESPACE = "reference"
+# Mesmos padrões de QueryRequest em main.py.
+DEFAULT_ORDER_BY = "metric_result DESC"
+DEFAULT_LIMIT = 100
+
+# Snapshots servidos em /api/v1/reference/<nome>.
+REFERENCE_QUERIES = {
+    "brands": "SELECT * FROM brands;",
+    "sub_brands": "SELECT * FROM sub_brands;",
+    "stores": "SELECT * FROM stores;",
+    "channels": "SELECT * FROM channels;",
+    "products": "SELECT id, name FROM products;",
+    "customers": "SELECT id, customer_name FROM customers;"
+}
+
+
+def flexible_query_key(request: Dict[str, Any]) -> str:
+    """
+    Chave da requisição normalizada: a mesma consulta escrita de formas
+    diferentes (ordem dos filtros, func em minúsculas) gera a mesma chave.
+    """
+    builder = QueryBuilder()
+    metric, group_by, filters = builder.normalize(
+        request.get("metric"), request.get("group_by") or [], request.get("filters") or []
+    )
+    metric = dict(metric)
+    if isinstance(metric.get("func"), str):
+        metric["func"] = metric["func"].strip().upper()
+
+    normalized = {
+        "metric": metric,
+        "group_by": group_by,
+        "filters": sorted(filters, key=lambda item: json.dumps(item, sort_keys=True, default=str)),
+        "order_by": (request.get("order_by", DEFAULT_ORDER_BY) or "").strip(),
+        "limit": request.get("limit", DEFAULT_LIMIT),
+        "compare_to": request.get("compare_to"),
+        "grouping": request.get("grouping"),
+        "grouping_sets": request.get("grouping_sets"),
+        "enrich": bool(request.get("enrich"))
+    }
+    return make_key(ANALYTICS_CACHE_NAMESPACE, normalized)
+
+
+def flexible_query_shape(request: Dict[str, Any]) -> str:
+    """
+    Chave da requisição sem os valores dos filtros de created_at: reconhece a
+    consulta de um widget qualquer que seja o período selecionado.
+    """
+    builder = QueryBuilder()
+    filters = []
+    for item in builder.normalize(request.get("metric"), [], request.get("filters") or [])[2]:
+        if builder.resolve_column(item["column"]) == ("sales", "created_at"):
+            item = {**item, "value": "$period"}
+        filters.append(item)
+    return flexible_query_key({**request, "filters": filters})
+
+
+def execute_flexible_query(conn, request: Dict[str, Any], fresh: bool = False,
+                           fanout: bool = True) -> Dict[str, Any]:
+    """
+    Roda a consulta (sketch quando elegível, senão SQL exato) e monta a resposta.
+    Com enrich, os ids agrupados ganham os atributos do dicionário de dimensões.
+    fresh=True pula os motores atualizados em segundo plano (sketches e cópia
+    colunar), que podem não ter as vendas que acabaram de commitar.
+    fanout=False roda no Postgres só na conexão recebida (threads de fundo, que
+    não podem pegar conexões extras do pool comum).
+    """
+    results, method = _run_flexible_query(conn, request, fresh, fanout)
+    if request.get("enrich"):
+        results = dimension_cache.enrich(conn, results)
+    return {"data": results, "method": method, "status": "ok"}
+
+
+def _run_flexible_query(conn, request: Dict[str, Any], fresh: bool = False, fanout: bool = True) -> tuple:
+    """Linhas e método ('sketch', 'columnar', 'duckdb', 'fanout', 'fanout_approx' ou 'exact')."""
+    builder = QueryBuilder()
+    group_by = request.get("group_by") or []
+    # 'stores.city', 'channels.type' etc. viram store_id/channel_id IN (ids) antes de qualquer motor.
+    filters = builder.rewrite_dimension_filters(
+        request.get("filters") or [], lambda table: dimension_cache.table(conn, table)
+    )
+    request = {**request, "filters": filters}
+    order_by = request.get("order_by", DEFAULT_ORDER_BY)
+    limit = request.get("limit", DEFAULT_LIMIT)
+
+    sketch_plan = None if fresh else plan_timing_sketch_query(
+        builder, request["metric"], group_by, filters,
+        request.get("compare_to"), request.get("grouping")
+    )
+    if sketch_plan:
+        with span("execute", engine="sketch"):
+            results = query_timing_percentiles(conn, sketch_plan, order_by, limit)
+        if results is not None:
+            return results, "sketch"
+
+    # Consultas só em colunas de sales: cópia colunar em memória, quando pronta.
+    columnar_plan = None if fresh else plan_columnar_query(builder, request)
+    if columnar_plan:
+        with span("execute", engine="columnar"):
+            results = columnar_cache.query(columnar_plan, order_by, limit)
+        if results is not None:
+            return results, "columnar"
+
+    # Janelas históricas longas já cobertas pelo snapshot Parquet rodam no DuckDB.
+    engine, _ = duckdb_engine.route(conn, builder, request)
+    if engine == "duckdb":
+        try:
+            with span("execute", engine="duckdb"):
+                results = duckdb_engine.execute(builder, request, order_by, limit)
+            return results, "duckdb"
+        except ValueError:
+            raise
+        except Exception as error:
+            duckdb_engine.record_error()
+            print(f"Erro no DuckDB, usando o Postgres: {error}")
+
+    # Janelas longas no Postgres: fatias mensais em paralelo, mergeadas em Python.
+    fanout_plan = fanout_executor.plan(builder, request) if fanout else None
+    if fanout_plan:
+        with span("execute", engine="fanout"):
+            results = fanout_executor.execute(conn, builder, request, fanout_plan, order_by, limit)
+        if results is not None:
+            return results, fanout_plan["method"]
+
+    with span("build"):
+        query, params = builder.build_analytics_query(
+            metric=request["metric"],
+            group_by=group_by,
+            filters=filters,
+            order_by=order_by,
+            limit=limit,
+            compare_to=request.get("compare_to"),
+            grouping=request.get("grouping"),
+            grouping_sets=request.get("grouping_sets")
+        )
+
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    with span("execute", engine="postgres"):
+        cursor.execute(query, params)
+    with span("fetch"):
+        results = cursor.fetchall()
+
+    return results, "exact"
+
+
+def reference_key(name: str) -> str:
+    return f"{REFERENCE_CACHE_NAMESPACE}:{name}"
+
+
+def fetch_reference(conn, name: str) -> Dict[str, Any]:
+    """Snapshot de uma tabela de referência, no formato da resposta."""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(REFERENCE_QUERIES[name])
+    return {"data": cursor.fetchall(), "status": "ok"}
@@ -0,0 +1,250 @@
+"""
+Cache de resultados compartilhado entre os workers do uvicorn/gunicorn.
+
+Os valores são guardados já serializados em JSON (bytes): um hit devolve os
+bytes direto na resposta, sem reconstruir objetos nem serializar de novo.
+
+Backends (variável CACHE_BACKEND):
+- "file" (padrão): um arquivo por entrada em um diretório compartilhado pelos
+  workers do host, por padrão em /dev/shm (memória). Tamanho total limitado por
+  CACHE_MAX_BYTES, com despejo dos acessados há mais tempo.
+- "redis": qualquer servidor compatível com Redis em CACHE_URL (requer o pacote
+  redis, opcional).
+- "none": desliga o cache.
+"""
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+from typing import Any, Optional
+
+from tracing import span
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "file")
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+CACHE_DIR = os.getenv("CACHE_DIR") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "godlevel-cache"
+)
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+ANALYTICS_CACHE_TTL = int(os.getenv("ANALYTICS_CACHE_TTL", "60"))
+REFERENCE_CACHE_TTL = int(os.getenv("REFERENCE_CACHE_TTL", "600"))
+
+# Cabeçalho de cada arquivo: instante de expiração (epoch, float64).
+_HEADER = struct.Struct("<d")
+
+
+def _json_default(value: Any):
+    """Mesmas conversões que o FastAPI aplica nas respostas."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    raise TypeError(f"Tipo não serializável: {type(value).__name__}")
+
+
+def serialize(payload: Any) -> bytes:
+    """Serializa a resposta uma única vez, no formato em que vai para o cliente."""
+    with span("serialize"):
+        return json.dumps(payload, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def make_key(namespace: str, payload: Any) -> str:
+    """Chave estável a partir da requisição normalizada (ordem de chaves irrelevante)."""
+    raw = json.dumps(payload, default=_json_default, sort_keys=True, separators=(",", ":"))
+    return f"{namespace}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+class FileCacheBackend:
+    """Entradas como arquivos em um diretório compartilhado (tmpfs em /dev/shm)."""
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes_since_sweep = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key.replace(":", "_"))
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as handle:
+                data = handle.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < _HEADER.size or _HEADER.unpack_from(data)[0] < time.time():
+            self._remove(path)
+            return None
+        try:
+            # mtime marca o último acesso, usado no despejo.
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data[_HEADER.size:]
+
+    def set(self, key: str, value: bytes, ttl: int):
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(_HEADER.pack(time.time() + ttl))
+            handle.write(value)
+        # rename é atômico: outro worker nunca lê um arquivo pela metade.
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._bytes_since_sweep += len(value) + _HEADER.size
+            sweep = self._bytes_since_sweep > self.max_bytes // 10
+            if sweep:
+                self._bytes_since_sweep = 0
+        if sweep:
+            self.evict()
+
+    def evict(self):
+        """Remove expirados e, se ainda acima do limite, os acessados há mais tempo."""
+        now = time.time()
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".tmp-"):
+                continue
+            try:
+                stat = entry.stat()
+                with open(entry.path, "rb") as handle:
+                    header = handle.read(_HEADER.size)
+            except FileNotFoundError:
+                continue
+            if len(header) < _HEADER.size or _HEADER.unpack(header)[0] < now:
+                self._remove(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self, prefix: str = ""):
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(prefix.replace(":", "_")):
+                self._remove(entry.path)
+
+    def stats(self) -> dict:
+        entries = [entry for entry in os.scandir(self.directory) if not entry.name.startswith(".tmp-")]
+        return {
+            "backend": "file",
+            "directory": self.directory,
+            "entries": len(entries),
+            "bytes": sum(entry.stat().st_size for entry in entries),
+            "max_bytes": self.max_bytes
+        }
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class RedisCacheBackend:
+    """Backend para Redis (ou qualquer servidor compatível), compartilhado entre hosts."""
+
+    def __init__(self, url: str = CACHE_URL):
+        try:
+            import redis
+        except ImportError as error:
+            raise RuntimeError("CACHE_BACKEND=redis requer o pacote 'redis' instalado.") from error
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: int):
+        self.client.set(key, value, ex=ttl)
+
+    def clear(self, prefix: str = ""):
+        for key in self.client.scan_iter(match=f"{prefix}*"):
+            self.client.delete(key)
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "url": self.url.split("@")[-1], "entries": self.client.dbsize()}
+
+
+class NullCacheBackend:
+    """Cache desligado."""
+
+    def get(self, key: str) -> Optional[bytes]:
+        return None
+
+    def set(self, key: str, value: bytes, ttl: int):
+        pass
+
+    def clear(self, prefix: str = ""):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "none"}
+
+
+class ResultCache:
+    """Fachada usada pelos endpoints: contadores locais + backend compartilhado."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            value = self.backend.get(key)
+        except Exception as error:
+            # Cache indisponível não pode derrubar a consulta.
+            print(f"Erro ao ler do cache: {error}")
+            self.errors += 1
+            return None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes, ttl: int):
+        try:
+            self.backend.set(key, value, ttl)
+        except Exception as error:
+            print(f"Erro ao gravar no cache: {error}")
+            self.errors += 1
+
+    def clear(self, prefix: str = ""):
+        self.backend.clear(prefix)
+
+    def stats(self) -> dict:
+        stats = self.backend.stats()
+        # Contadores são deste worker; as entradas são do host inteiro.
+        stats.update({"worker_pid": os.getpid(), "hits": self.hits, "misses": self.misses, "errors": self.errors})
+        return stats
+
+
+def create_cache() -> ResultCache:
+    if CACHE_BACKEND == "redis":
+        return ResultCache(RedisCacheBackend())
+    if CACHE_BACKEND == "none":
+        return ResultCache(NullCacheBackend())
+    return ResultCache(FileCacheBackend())
+
+
+result_cache = create_cache()
@@ -0,0 +1,102 @@
+"""
+Log de alterações de vendas (sales_changes) e horizontes de transação.
+
+Os triggers de database-schema.sql gravam uma linha por venda inserida,
+alterada ou removida (e por venda cujos itens mudaram), com o txid da
+transação, o dia e o cliente (antes e depois, numa alteração). As linhas
+entram no mesmo COMMIT da venda.
+
+Um consumidor (rollup, métricas de cliente, cópia colunar, snapshot DuckDB)
+guarda o horizonte do último refresh: o xmin do snapshot, tirado no início
+da transação de leitura. Toda transação com txid abaixo dele já terminou e
+está visível; as de txid igual ou acima podem estar em andamento e por isso
+são relidas no próximo refresh (txid >= horizonte). Ao contrário de um
+watermark de MAX(id), nada se perde quando um id menor commita depois de um
+maior, e alterações e remoções também são vistas. Reprocessar uma venda já
+vista não muda o resultado: os consumidores recalculam dias, clientes ou
+vendas inteiros.
+
+prune_changes apaga o que todos os consumidores com watermark já passaram e
+que tem mais de SALES_CHANGES_RETENTION_HOURS; consumidores que ficam para
+trás disso (o marcador sales_changes_pruned passou do horizonte deles)
+precisam recarregar tudo.
+"""
+import os
+from typing import List
+
+SALES_CHANGES_RETENTION_HOURS = float(os.getenv("SALES_CHANGES_RETENTION_HOURS", "24"))
+PRUNE_MARKER = "sales_changes_pruned"
+
+
+def current_horizon(cursor) -> int:
+    """xmin do snapshot atual: rode antes de qualquer leitura da transação."""
+    cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+    return cursor.fetchone()[0]
+
+
+def changes_available(cursor, since: int) -> bool:
+    """False quando o log já foi podado além de since (o consumidor recarrega tudo)."""
+    cursor.execute("SELECT last_id FROM rollup_watermarks WHERE name = %s", (PRUNE_MARKER,))
+    row = cursor.fetchone()
+    return row is None or row[0] <= since
+
+
+def changed_days(cursor, since: int) -> list:
+    """Dias (DATE de created_at) com vendas alteradas desde o horizonte since."""
+    cursor.execute("""
+        SELECT DISTINCT sale_date FROM sales_changes
+        WHERE txid >= %s::text::xid8 AND sale_date IS NOT NULL
+        ORDER BY sale_date
+    """, (str(since),))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def changed_customers(cursor, since: int) -> List[int]:
+    """Clientes com vendas alteradas desde o horizonte since."""
+    cursor.execute("""
+        SELECT DISTINCT customer_id FROM sales_changes
+        WHERE txid >= %s::text::xid8 AND customer_id IS NOT NULL
+    """, (str(since),))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def changed_sales(cursor, since: int) -> List[int]:
+    """Ids de vendas alteradas desde o horizonte since (inclusive removidas)."""
+    cursor.execute("""
+        SELECT DISTINCT sale_id FROM sales_changes
+        WHERE txid >= %s::text::xid8
+        ORDER BY sale_id
+    """, (str(since),))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def prune_changes(cursor, consumers: List[str]) -> int:
+    """
+    Apaga as alterações abaixo do menor horizonte dos consumidores e mais
+    velhas que a retenção. Grava o corte em PRUNE_MARKER. Rode no primário.
+    """
+    cursor.execute(
+        "SELECT MIN(last_id), COUNT(*) FROM rollup_watermarks WHERE name = ANY(%s)",
+        (list(consumers),)
+    )
+    horizon, found = cursor.fetchone()
+    if found < len(consumers) or not horizon:
+        return 0
+    cursor.execute("""
+        WITH pruned AS (
+            DELETE FROM sales_changes
+            WHERE txid < %s::text::xid8
+              AND changed_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            RETURNING txid
+        )
+        SELECT COUNT(*), MAX(txid::text::bigint) FROM pruned
+    """, (str(horizon), SALES_CHANGES_RETENTION_HOURS * 3600))
+    deleted, max_pruned = cursor.fetchone()
+    if deleted:
+        # Horizonte a partir do qual o log está completo.
+        cursor.execute("""
+            INSERT INTO rollup_watermarks (name, last_id) VALUES (%s, %s)
+            ON CONFLICT (name) DO UPDATE
+            SET last_id = GREATEST(rollup_watermarks.last_id, EXCLUDED.last_id), updated_at = CURRENT_TIMESTAMP
+        """, (PRUNE_MARKER, max_pruned + 1))
+    return deleted
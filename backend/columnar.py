@@ -0,0 +1,633 @@
+"""
+Cópia colunar de `sales` em memória compartilhada (NumPy + memmap).
+
+Cada coluna é um arquivo binário em COLUMNAR_DIR (por padrão em /dev/shm, ao
+lado do cache): os workers abrem os arquivos com np.memmap e compartilham as
+mesmas páginas. Um único worker por host (lock de arquivo) carrega e atualiza
+a cópia:
+- a carga usa COPY ... (FORMAT binary) com registros de tamanho fixo, lidos
+  direto com np.frombuffer;
+- sale_status_desc é guardado como código (int16) de um dicionário;
+- created_at é guardado como int64 (microssegundos desde 1970);
+- valores monetários são guardados como int64 em centavos (somas exatas);
+- a atualização anexa as vendas acima do watermark de id e aplica o log
+  sales_changes desde o horizonte do último refresh (ver changes.py): a versão
+  antiga de uma venda alterada ou removida é desmarcada em live e a atual é
+  anexada. Assim ids que commitam fora de ordem, alterações (ex.:
+  cancelamento) e remoções também chegam à cópia.
+
+Os arquivos ficam em uma geração (gen-N) e live em um arquivo por versão:
+nada que um leitor já mapeou é reescrito. Com mais de COLUMNAR_MAX_DEAD_RATIO
+de linhas desmarcadas, ou com o log podado além do horizonte, a cópia é
+recarregada em uma geração nova.
+
+Requisições de /api/v1/analytics/query só em colunas de `sales` (sem JOINs) e
+com SUM/COUNT/AVG/MIN/MAX são respondidas com máscaras vetorizadas e
+np.bincount / np.minimum.reduceat.
+
+Memória: 69 bytes por versão de venda (cerca de 69 MB por milhão), contados uma
+vez por host, porque os workers compartilham o page cache.
+"""
+import fcntl
+import glob
+import io
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from cache import CACHE_DIR
+from changes import changed_sales, changes_available, current_horizon
+from database import read_connection
+from query_helpers import order_rows
+
+COLUMNAR_ENABLED = os.getenv("COLUMNAR_ENABLED", "1") == "1"
+COLUMNAR_DIR = os.getenv("COLUMNAR_DIR", os.path.join(CACHE_DIR, "columnar"))
+COLUMNAR_REFRESH_SECONDS = float(os.getenv("COLUMNAR_REFRESH_SECONDS", "5"))
+# Acima disso (refresh parado), as consultas voltam para o Postgres.
+COLUMNAR_MAX_STALENESS_SECONDS = float(os.getenv("COLUMNAR_MAX_STALENESS_SECONDS", "60"))
+COLUMNAR_CHUNK_IDS = int(os.getenv("COLUMNAR_CHUNK_IDS", "1000000"))
+# Fração de versões desmarcadas (vendas alteradas ou removidas) que dispara a recarga.
+COLUMNAR_MAX_DEAD_RATIO = float(os.getenv("COLUMNAR_MAX_DEAD_RATIO", "0.2"))
+COLUMNAR_LOCK_FILE = os.path.join(COLUMNAR_DIR, ".writer.lock")
+META_FILE = "meta.json"
+
+# Data de referência do COPY binário (timestamps em microssegundos desde 2000-01-01).
+POSTGRES_EPOCH_OFFSET_US = 946684800 * 1_000_000
+UNIX_EPOCH = datetime(1970, 1, 1)
+US_PER_DAY = 86400 * 1_000_000
+NULL_GROUP_KEY = np.iinfo(np.int64).min
+
+# nome -> (expressão SQL, tipo no COPY binário, tipo em disco, anulável, escala)
+COLUMNS = {
+    "id": ("id", ">i4", "<i4", False, None),
+    "store_id": ("store_id", ">i4", "<i4", False, None),
+    "channel_id": ("channel_id", ">i4", "<i4", False, None),
+    "customer_id": ("COALESCE(customer_id, 0)", ">i4", "<i4", "customer_id", None),
+    "sale_status_desc": ("(array_position(%s::text[], sale_status_desc) - 1)::int2", ">i2", "<i2", False, None),
+    "created_at": ("created_at", ">i8", "<i8", False, None),
+    "total_amount": ("(total_amount * 100)::int8", ">i8", "<i8", False, 100),
+    "total_discount": ("COALESCE(total_discount * 100, 0)::int8", ">i8", "<i8", "total_discount", 100),
+    "service_tax_fee": ("COALESCE(service_tax_fee * 100, 0)::int8", ">i8", "<i8", "service_tax_fee", 100),
+    "people_quantity": ("COALESCE(people_quantity, 0)", ">i4", "<i4", "people_quantity", None),
+    "delivery_seconds": ("COALESCE(delivery_seconds, 0)", ">i4", "<i4", "delivery_seconds", None),
+    "production_seconds": ("COALESCE(production_seconds, 0)", ">i4", "<i4", "production_seconds", None),
+}
+GROUP_COLUMNS = ["store_id", "channel_id", "customer_id", "sale_status_desc", "created_at"]
+METRIC_FUNCTIONS = ["SUM", "COUNT", "AVG", "MIN", "MAX"]
+FILTER_OPERATORS = ["=", "!=", "<>", ">", "<", ">=", "<=", "IN", "NOT IN", "BETWEEN", "IS NULL", "IS NOT NULL",
+                    "PERIODO_DIA"]
+GRANULARITY_US = {"second": 1_000_000, "minute": 60_000_000, "hour": 3_600_000_000, "day": US_PER_DAY}
+MONTH_GRANULARITIES = {"month": 1, "quarter": 3, "year": 12}
+
+
+def _record_dtype() -> np.dtype:
+    """Um registro do COPY binário: contagem de campos e (tamanho, valor) por campo."""
+    fields = [("field_count", ">i2")]
+    for name, (_, wire_type, _, nullable, _) in COLUMNS.items():
+        fields += [(f"{name}__len", ">i4"), (name, wire_type)]
+        if nullable:
+            fields += [(f"{name}__valid_len", ">i4"), (f"{name}__valid", "?")]
+    return np.dtype(fields)
+
+
+def _copy_sql(where: str) -> str:
+    expressions = []
+    for expression, _, _, nullable, _ in COLUMNS.values():
+        expressions.append(expression)
+        if nullable:
+            expressions.append(f"{nullable} IS NOT NULL")
+    return f"COPY (SELECT {', '.join(expressions)} FROM sales WHERE {where}) TO STDOUT WITH (FORMAT binary)"
+
+
+def decode_binary_copy(payload: bytes) -> np.ndarray:
+    """Registros de um COPY binário sem NULLs (todos os campos com tamanho fixo)."""
+    header_extension = int.from_bytes(payload[15:19], "big")
+    body = payload[19 + header_extension:-2]
+    return np.frombuffer(body, dtype=_record_dtype())
+
+
+def _to_us(value: datetime) -> int:
+    return (value - UNIX_EPOCH) // timedelta(microseconds=1)
+
+
+def _from_us(value: int) -> datetime:
+    return UNIX_EPOCH + timedelta(microseconds=int(value))
+
+
+def plan_columnar_query(builder, request: Dict[str, Any]) -> Optional[dict]:
+    """
+    Verifica se a requisição pode ser respondida pela cópia colunar: métrica,
+    agrupamentos e filtros só em colunas carregadas de `sales`, sem
+    compare_to/grouping. Converte os valores dos filtros para as unidades em disco.
+    """
+    if request.get("compare_to") or request.get("grouping"):
+        return None
+    metric, group_by, filters = builder.normalize(
+        request["metric"], request.get("group_by") or [], request.get("filters") or []
+    )
+    try:
+        return _plan(builder, metric, group_by, filters)
+    except (KeyError, TypeError, ValueError, ArithmeticError):
+        # Requisição inválida ou valor que o Postgres converteria: o QueryBuilder decide o erro.
+        return None
+
+
+def _plan(builder, metric: dict, group_by: list, filters: list) -> Optional[dict]:
+    func = str(metric.get("func", "")).upper()
+    if func not in METRIC_FUNCTIONS:
+        return None
+    table, metric_column = builder.resolve_column(metric["column"])
+    if table != "sales" or metric_column not in builder.ALLOWED_METRIC_COLUMNS["sales"]:
+        return None
+    if metric_column not in COLUMNS:
+        return None
+
+    plan = {"func": func, "metric": metric_column, "group_by": [], "filters": []}
+    for item in group_by:
+        table, column = builder.resolve_column(item["column"])
+        granularity = item.get("granularity")
+        if table != "sales" or column not in GROUP_COLUMNS or column not in builder.ALLOWED_GROUP_BY_COLUMNS["sales"]:
+            return None
+        if column == "created_at":
+            if granularity not in GRANULARITY_US and granularity not in MONTH_GRANULARITIES \
+                    and granularity not in ("week", "day_of_week"):
+                return None
+            plan["group_by"].append((column, granularity, builder.DATE_GROUP_ALIAS))
+        elif granularity:
+            return None
+        else:
+            plan["group_by"].append((column, None, item["column"]))
+
+    for item in filters:
+        table, column = builder.resolve_column(item["column"])
+        op, value = item.get("op"), item.get("value")
+        if table != "sales" or column not in COLUMNS or op not in FILTER_OPERATORS \
+                or column not in builder.ALLOWED_FILTER_COLUMNS["sales"]:
+            return None
+        if column == "sale_status_desc" and op not in ("=", "!=", "<>", "IN", "NOT IN", "IS NULL", "IS NOT NULL"):
+            return None
+        if op == "PERIODO_DIA":
+            if column != "created_at" or not isinstance(value, (list, tuple)) or len(value) != 2:
+                return None
+            plan["filters"].append((column, op, [int(v) for v in value]))
+            continue
+        if op in ("IS NULL", "IS NOT NULL"):
+            plan["filters"].append((column, op, None))
+            continue
+        if op in ("IN", "NOT IN", "BETWEEN") and not isinstance(value, (list, tuple)):
+            return None
+        if op == "BETWEEN" and len(value) != 2:
+            return None
+        values = [_storage_value(builder, column, v) for v in (value if isinstance(value, (list, tuple)) else [value])]
+        plan["filters"].append((column, op, values))
+    return plan
+
+
+def _storage_value(builder, column: str, value: Any):
+    """Valor de filtro na unidade em disco (µs, centavos; status fica texto até o dicionário)."""
+    if column == "created_at":
+        return _to_us(builder.parse_timestamp(value))
+    if column == "sale_status_desc":
+        return str(value)
+    scale = COLUMNS[column][4]
+    if scale:
+        return float(Decimal(str(value)) * scale)
+    return float(value)
+
+
+class ColumnarSnapshot:
+    """Arrays mapeados de uma versão do meta.json."""
+
+    def __init__(self, directory: str, meta: dict):
+        self.meta = meta
+        self.rows = meta["rows"]
+        self.dictionary = meta["dictionary"]
+        self.codes = {value: code for code, value in enumerate(self.dictionary)}
+        self.columns, self.valid = {}, {}
+        data_dir = os.path.join(directory, meta["data_dir"])
+        for name, (_, _, disk_type, nullable, _) in COLUMNS.items():
+            self.columns[name] = self._map(os.path.join(data_dir, f"{name}.bin"), disk_type)
+            if nullable:
+                self.valid[name] = self._map(os.path.join(data_dir, f"{name}.valid.bin"), "?")
+        self.live = self._map(os.path.join(data_dir, meta["live_file"]), "?")
+
+    def _map(self, path: str, dtype: str) -> np.ndarray:
+        if self.rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(self.rows,))
+
+    def _filter_mask(self, column: str, op: str, values) -> np.ndarray:
+        data = self.columns[column]
+        valid = self.valid.get(column)
+        if op == "IS NULL":
+            return ~valid if valid is not None else np.zeros(self.rows, dtype=bool)
+        if op == "IS NOT NULL":
+            return np.array(valid) if valid is not None else np.ones(self.rows, dtype=bool)
+        if op == "PERIODO_DIA":
+            hours = (data // GRANULARITY_US["hour"]) % 24
+            return (hours >= values[0]) & (hours <= values[1])
+        if column == "sale_status_desc":
+            values = [self.codes.get(value, -1) for value in values]
+
+        if op == "=":
+            mask = data == values[0]
+        elif op in ("!=", "<>"):
+            mask = data != values[0]
+        elif op == ">":
+            mask = data > values[0]
+        elif op == "<":
+            mask = data < values[0]
+        elif op == ">=":
+            mask = data >= values[0]
+        elif op == "<=":
+            mask = data <= values[0]
+        elif op == "BETWEEN":
+            mask = (data >= values[0]) & (data <= values[1])
+        elif op == "IN":
+            mask = np.isin(data, values)
+        else:
+            mask = ~np.isin(data, values)
+        # Comparações com NULL são falsas no SQL.
+        return mask & valid if valid is not None else mask
+
+    def _group_keys(self, column: str, granularity: Optional[str], mask: np.ndarray) -> np.ndarray:
+        data = self.columns[column][mask]
+        if column != "created_at":
+            keys = data.astype(np.int64)
+            valid = self.valid.get(column)
+            return np.where(valid[mask], keys, NULL_GROUP_KEY) if valid is not None else keys
+        if granularity in GRANULARITY_US:
+            unit = GRANULARITY_US[granularity]
+            return (data // unit) * unit
+        days = data // US_PER_DAY
+        if granularity == "week":
+            # 1970-01-01 foi quinta; DATE_TRUNC('week') vai para a segunda.
+            return (days - (days + 3) % 7) * US_PER_DAY
+        if granularity == "day_of_week":
+            return (days + 4) % 7
+        months = data.astype("datetime64[us]").astype("datetime64[M]").astype(np.int64)
+        step = MONTH_GRANULARITIES[granularity]
+        return months - months % step
+
+    def _group_value(self, column: str, granularity: Optional[str], key: int):
+        if column == "created_at":
+            if granularity == "day_of_week":
+                return Decimal(int(key))
+            if granularity in MONTH_GRANULARITIES:
+                return datetime(1970 + int(key) // 12, int(key) % 12 + 1, 1)
+            return _from_us(key)
+        if key == NULL_GROUP_KEY:
+            return None
+        if column == "sale_status_desc":
+            return self.dictionary[int(key)]
+        return int(key)
+
+    def _metric_value(self, column: str, func: str, value, count: int):
+        if value is None or func == "COUNT":
+            return value
+        scale = COLUMNS[column][4]
+        if func == "AVG":
+            # numeric, como o AVG do Postgres (e o merge do fan-out) devolve.
+            average = Decimal(int(round(value))) / count
+            return average.scaleb(-2) if scale else average
+        if scale:
+            return Decimal(int(round(value))).scaleb(-2)
+        return int(value)
+
+    def execute(self, plan: dict) -> List[dict]:
+        mask = np.array(self.live, dtype=bool)
+        for column, op, values in plan["filters"]:
+            mask &= self._filter_mask(column, op, values)
+        selected = int(mask.sum())
+
+        if plan["group_by"]:
+            keys = [self._group_keys(column, granularity, mask) for column, granularity, _ in plan["group_by"]]
+            if len(keys) == 1:
+                unique, inverse = np.unique(keys[0], return_inverse=True)
+                unique = unique.reshape(-1, 1)
+            else:
+                unique, inverse = np.unique(np.stack(keys, axis=1), axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            groups = len(unique)
+        else:
+            # Sem GROUP BY o SQL devolve uma linha mesmo sem vendas.
+            unique, inverse, groups = np.zeros((1, 0), dtype=np.int64), np.zeros(selected, dtype=np.int64), 1
+
+        func, column = plan["func"], plan["metric"]
+        if func == "COUNT" and column not in self.valid:
+            values, valid = None, np.ones(selected, dtype=bool)
+        else:
+            values = self.columns[column][mask]
+            valid = self.valid[column][mask] if column in self.valid else np.ones(selected, dtype=bool)
+        counts = np.bincount(inverse[valid], minlength=groups)
+
+        if func == "COUNT":
+            results = counts
+        elif func in ("SUM", "AVG"):
+            results = np.bincount(inverse[valid], weights=values[valid].astype(np.float64), minlength=groups)
+        else:
+            order = np.argsort(inverse[valid], kind="stable")
+            sorted_groups, sorted_values = inverse[valid][order], values[valid][order]
+            starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]) if len(order) else []
+            reducer = np.minimum if func == "MIN" else np.maximum
+            results = np.zeros(groups, dtype=np.float64)
+            if len(order):
+                results[sorted_groups[starts]] = reducer.reduceat(sorted_values, starts)
+
+        rows = []
+        for index in range(groups):
+            row = {
+                alias: self._group_value(column_name, granularity, unique[index][position])
+                for position, (column_name, granularity, alias) in enumerate(plan["group_by"])
+            }
+            value = results[index].item()
+            if func != "COUNT" and counts[index] == 0:
+                value = None
+            row["metric_result"] = self._metric_value(column, func, value, int(counts[index]))
+            rows.append(row)
+        return rows
+
+
+class ColumnarCache:
+    """Leitura (todos os workers) e carga/atualização (um worker por host) da cópia colunar."""
+
+    def __init__(self, directory: str = COLUMNAR_DIR):
+        self.directory = directory
+        self._snapshot = None
+        self._meta_mtime = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_handle = None
+        self.answered = 0
+        self.fallbacks = 0
+        self.last_refresh = None
+
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, META_FILE)
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(self._meta_path(), encoding="utf-8") as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return None
+
+    def snapshot(self) -> Optional[ColumnarSnapshot]:
+        """Arrays da versão atual (remapeados quando meta.json muda)."""
+        try:
+            mtime = os.stat(self._meta_path()).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if mtime != self._meta_mtime:
+                meta = self._read_meta()
+                self._snapshot = ColumnarSnapshot(self.directory, meta) if meta else None
+                self._meta_mtime = mtime
+            return self._snapshot
+
+    def query(self, plan: dict, order_by: Optional[str], limit: int) -> Optional[List[dict]]:
+        """Resultado no formato do RealDictCursor, ou None se a cópia não estiver pronta/atual."""
+        snapshot = self.snapshot() if COLUMNAR_ENABLED else None
+        if snapshot is None or not snapshot.meta.get("complete") \
+                or time.time() - snapshot.meta["refreshed_at"] > COLUMNAR_MAX_STALENESS_SECONDS:
+            self.fallbacks += 1
+            return None
+        rows = order_rows(
+            snapshot.execute(plan), order_by,
+            [alias for _, granularity, alias in plan["group_by"] if not granularity],
+            any(granularity for _, granularity, _ in plan["group_by"]), limit
+        )
+        if rows is None:
+            self.fallbacks += 1
+            return None
+        self.answered += 1
+        return rows
+
+    # --- carga e atualização (worker com o lock) ---
+
+    def _write_meta(self, meta: dict):
+        temp_path = self._meta_path() + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump(meta, handle)
+        os.replace(temp_path, self._meta_path())
+
+    def _data_path(self, meta: dict, name: str) -> str:
+        return os.path.join(self.directory, meta["data_dir"], name)
+
+    def _new_meta(self, previous: Optional[dict]) -> dict:
+        """Meta de uma carga do zero, em uma geração nova (a anterior fica para leitores em andamento)."""
+        generation = previous.get("generation", -1) + 1 if previous else 0
+        meta = {
+            "columns": list(COLUMNS), "generation": generation, "data_dir": f"gen-{generation}",
+            "rows": 0, "dead": 0, "watermark": 0, "horizon": None, "dictionary": [],
+            "live_version": 0, "live_file": "live.0.bin", "complete": False
+        }
+        shutil.rmtree(os.path.join(self.directory, meta["data_dir"]), ignore_errors=True)
+        for path in glob.glob(os.path.join(self.directory, "*.bin")):
+            # Formato antigo, com as colunas direto em COLUMNAR_DIR.
+            os.remove(path)
+        os.makedirs(os.path.join(self.directory, meta["data_dir"]))
+        return meta
+
+    def _needs_reload(self, cursor, meta: Optional[dict]) -> bool:
+        if meta is None or meta.get("columns") != list(COLUMNS) or "data_dir" not in meta:
+            # Primeira carga ou formato mudou.
+            return True
+        if meta["rows"] and (meta["horizon"] is None or not changes_available(cursor, meta["horizon"])):
+            return True
+        return meta["dead"] > COLUMNAR_MAX_DEAD_RATIO * meta["rows"]
+
+    def _truncate_to(self, meta: dict):
+        """Descarta bytes anexados depois do último meta.json (carga interrompida)."""
+        paths = [(self._data_path(meta, meta["live_file"]), "?")]
+        for name, (_, _, disk_type, nullable, _) in COLUMNS.items():
+            paths.append((self._data_path(meta, f"{name}.bin"), disk_type))
+            if nullable:
+                paths.append((self._data_path(meta, f"{name}.valid.bin"), "?"))
+        for path, dtype in paths:
+            with open(path, "ab") as handle:
+                handle.truncate(meta["rows"] * np.dtype(dtype).itemsize)
+
+    def _copy(self, cursor, meta: dict, where: str, params: tuple) -> np.ndarray:
+        buffer = io.BytesIO()
+        cursor.copy_expert(cursor.mogrify(_copy_sql(where), (meta["dictionary"],) + params).decode(), buffer)
+        return decode_binary_copy(buffer.getvalue())
+
+    def _append(self, meta: dict, records: np.ndarray):
+        for name, (_, _, disk_type, nullable, _) in COLUMNS.items():
+            values = records[name].astype(disk_type)
+            if name == "created_at":
+                values = values + POSTGRES_EPOCH_OFFSET_US
+            with open(self._data_path(meta, f"{name}.bin"), "ab") as handle:
+                handle.write(values.tobytes())
+            if nullable:
+                with open(self._data_path(meta, f"{name}.valid.bin"), "ab") as handle:
+                    handle.write(records[f"{name}__valid"].astype("?").tobytes())
+        with open(self._data_path(meta, meta["live_file"]), "ab") as handle:
+            handle.write(np.ones(len(records), dtype="?").tobytes())
+        meta["rows"] += len(records)
+
+    def _retire(self, meta: dict, sale_ids: List[int]) -> int:
+        """
+        Desmarca as versões atuais das vendas em um arquivo live novo: quem
+        mapeou o meta.json anterior continua vendo o arquivo antigo, intacto.
+        """
+        if not meta["rows"] or not sale_ids:
+            return 0
+        ids = np.fromfile(self._data_path(meta, "id.bin"), dtype="<i4", count=meta["rows"])
+        live = np.fromfile(self._data_path(meta, meta["live_file"]), dtype="?", count=meta["rows"])
+        retired = np.isin(ids, np.asarray(sale_ids, dtype="<i4")) & live
+        count = int(retired.sum())
+        if count:
+            live[retired] = False
+            meta["live_version"] += 1
+            meta["live_file"] = f"live.{meta['live_version']}.bin"
+            live.tofile(self._data_path(meta, meta["live_file"]))
+            meta["dead"] += count
+        return count
+
+    def _remove_old_files(self, meta: dict):
+        """Apaga gerações e arquivos live mais velhos que o anterior ao atual."""
+        for path in glob.glob(os.path.join(self.directory, "gen-*")):
+            generation = int(os.path.basename(path)[4:])
+            if generation < meta["generation"] - 1:
+                shutil.rmtree(path, ignore_errors=True)
+        for path in glob.glob(self._data_path(meta, "live.*.bin")):
+            if int(os.path.basename(path).split(".")[1]) < meta["live_version"] - 1:
+                os.remove(path)
+
+    def refresh(self) -> dict:
+        """
+        Aplica sales_changes desde o horizonte do último refresh às vendas já
+        carregadas e anexa as vendas acima do watermark, em blocos de
+        COLUMNAR_CHUNK_IDS ids. Tudo no mesmo snapshot.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        meta = self._read_meta()
+        started = time.monotonic()
+        loaded = retired = 0
+
+        with read_connection() as conn:
+            conn.rollback()
+            cursor = conn.cursor()
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+            # Primeira leitura da transação: o horizonte é o do snapshot do refresh inteiro.
+            horizon = current_horizon(cursor)
+            if self._needs_reload(cursor, meta):
+                meta = self._new_meta(meta)
+            self._truncate_to(meta)
+
+            # Vendas acima do watermark entram pelo COPY por faixa de id, já na versão atual.
+            changed = []
+            if meta["rows"]:
+                changed = [sale_id for sale_id in changed_sales(cursor, meta["horizon"]) if sale_id <= meta["watermark"]]
+            cursor.execute("SELECT max(id) FROM sales WHERE id > %s;", (meta["watermark"],))
+            target = cursor.fetchone()[0] or meta["watermark"]
+
+            # Dicionário e COPY no mesmo snapshot: nenhum status fica sem código.
+            cursor.execute(
+                "SELECT DISTINCT sale_status_desc FROM sales WHERE (id > %s AND id <= %s) OR id = ANY(%s);",
+                (meta["watermark"], target, changed)
+            )
+            known = set(meta["dictionary"])
+            meta["dictionary"] += sorted(row[0] for row in cursor.fetchall() if row[0] not in known)
+
+            retired = self._retire(meta, changed)
+            for offset in range(0, len(changed), COLUMNAR_CHUNK_IDS):
+                records = self._copy(cursor, meta, "id = ANY(%s)", (changed[offset:offset + COLUMNAR_CHUNK_IDS],))
+                self._append(meta, records)
+                loaded += len(records)
+            meta.update(horizon=horizon, refreshed_at=time.time())
+            self._write_meta(meta)
+
+            low = meta["watermark"]
+            while low < target:
+                high = min(low + COLUMNAR_CHUNK_IDS, target)
+                records = self._copy(cursor, meta, "id > %s AND id <= %s", (low, high))
+                self._append(meta, records)
+                loaded += len(records)
+                meta.update(watermark=high, refreshed_at=time.time())
+                self._write_meta(meta)
+                low = high
+            conn.rollback()
+
+        meta.update(complete=True, refreshed_at=time.time())
+        self._write_meta(meta)
+        self._remove_old_files(meta)
+        self.last_refresh = {
+            "finished_at": datetime.now().isoformat(),
+            "seconds": round(time.monotonic() - started, 3),
+            "rows_loaded": loaded,
+            "rows_retired": retired,
+            "watermark": meta["watermark"],
+            "horizon": meta["horizon"]
+        }
+        return self.last_refresh
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as error:
+                print(f"Erro ao atualizar a cópia colunar de sales: {error}")
+            self._stop.wait(COLUMNAR_REFRESH_SECONDS)
+
+    def start(self) -> bool:
+        """Inicia a carga/atualização em uma thread, se nenhum outro worker do host já o fez."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_handle = open(COLUMNAR_LOCK_FILE, "w")
+        try:
+            fcntl.flock(self._lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_handle.close()
+            self._lock_handle = None
+            return False
+        self._thread = threading.Thread(target=self.run_forever, name="columnar-refresh", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=COLUMNAR_REFRESH_SECONDS)
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
+
+    def stats(self) -> dict:
+        snapshot = self.snapshot()
+        meta = snapshot.meta if snapshot else None
+        rows = meta["rows"] if meta else 0
+        bytes_per_row = 1 + sum(
+            np.dtype(disk_type).itemsize + (1 if nullable else 0)
+            for _, _, disk_type, nullable, _ in COLUMNS.values()
+        )
+        return {
+            "worker_pid": os.getpid(),
+            "enabled": COLUMNAR_ENABLED,
+            "refreshing_here": self._thread is not None and self._thread.is_alive(),
+            "rows": rows,
+            "dead_rows": meta["dead"] if meta else 0,
+            "generation": meta["generation"] if meta else None,
+            "watermark": meta["watermark"] if meta else None,
+            "horizon": meta["horizon"] if meta else None,
+            "complete": bool(meta and meta.get("complete")),
+            "age_seconds": round(time.time() - meta["refreshed_at"], 3) if meta and meta.get("refreshed_at") else None,
+            "dictionary": meta["dictionary"] if meta else [],
+            "bytes_per_row": bytes_per_row,
+            "bytes": rows * bytes_per_row,
+            "answered": self.answered,
+            "fallbacks": self.fallbacks,
+            "last_refresh": self.last_refresh
+        }
+
+
+columnar_cache = ColumnarCache()
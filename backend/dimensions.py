@@ -0,0 +1,137 @@
+"""
+Dicionário de dimensões em memória (lojas, canais, produtos, clientes).
+
+Usado para decorar resultados já agregados (`enrich: true` na query flexível):
+a consulta agrupa só pelos ids inteiros e os nomes/atributos entram depois,
+em Python, sem JOIN nem ida extra do navegador a /reference/*. Também resolve
+filtros em atributos de loja/canal para listas de ids
+(QueryBuilder.rewrite_dimension_filters).
+
+Lojas, canais e produtos são carregados inteiros e recarregados a cada
+DIMENSION_CACHE_TTL segundos; clientes são buscados só pelos ids que
+aparecem no resultado. Ids ausentes (cadastro novo) são buscados na hora; os
+que nem o banco tem ficam marcados até a próxima recarga, para não serem
+buscados de novo a cada requisição.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List
+
+from psycopg2.extras import RealDictCursor
+
+DIMENSION_CACHE_TTL = float(os.getenv("DIMENSION_CACHE_TTL", "300"))
+
+# coluna de id no resultado -> (dimensão, chave adicionada na linha)
+ENRICH_KEYS = {
+    "store_id": ("stores", "store"),
+    "channel_id": ("channels", "channel"),
+    "product_id": ("products", "product"),
+    "customer_id": ("customers", "customer"),
+}
+
+DIMENSIONS = {
+    "stores": {
+        "query": (
+            "SELECT id, name, city, state, district, is_active, is_own, brand_id, sub_brand_id FROM stores"
+        ),
+        "preload": True
+    },
+    "channels": {
+        "query": "SELECT id, name, type, brand_id FROM channels",
+        "preload": True
+    },
+    "products": {
+        "query": "SELECT id, name, category_id FROM products",
+        "preload": True
+    },
+    "customers": {
+        "query": "SELECT id, customer_name FROM customers",
+        "preload": False
+    },
+}
+
+
+class DimensionCache:
+    """Tabelas de dimensão por id, por worker."""
+
+    def __init__(self, ttl: float = DIMENSION_CACHE_TTL):
+        self.ttl = ttl
+        self.tables: Dict[str, Dict[int, dict]] = {}
+        self.loaded_at: Dict[str, float] = {}
+        # Ids procurados e inexistentes no banco, por dimensão (zerados a cada recarga).
+        self.absent: Dict[str, set] = {}
+        self.lock = threading.Lock()
+        self.counters = {"loads": 0, "lookups": 0}
+
+    def _fetch(self, conn, name: str, ids: List[int] = None) -> Dict[int, dict]:
+        query = DIMENSIONS[name]["query"]
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        if ids is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(f"{query} WHERE id = ANY(%s)", (ids,))
+        return {row.pop("id"): dict(row) for row in cursor.fetchall()}
+
+    def table(self, conn, name: str) -> Dict[int, dict]:
+        """Tabela inteira da dimensão (recarregada quando o TTL vence)."""
+        with self.lock:
+            fresh = time.monotonic() - self.loaded_at.get(name, float("-inf")) < self.ttl
+            if fresh and name in self.tables:
+                return self.tables[name]
+
+        if DIMENSIONS[name]["preload"]:
+            rows = self._fetch(conn, name)
+            self.counters["loads"] += 1
+        else:
+            rows = {}
+        with self.lock:
+            self.tables[name] = rows
+            self.absent[name] = set()
+            self.loaded_at[name] = time.monotonic()
+        return rows
+
+    def lookup(self, conn, name: str, ids: Iterable[int]) -> Dict[int, dict]:
+        """Atributos dos ids pedidos; os que faltam no dicionário são buscados no banco."""
+        table = self.table(conn, name)
+        with self.lock:
+            absent = self.absent.setdefault(name, set())
+            missing = sorted({i for i in ids if i is not None and i not in table and i not in absent})
+        if missing:
+            fetched = self._fetch(conn, name, missing)
+            self.counters["lookups"] += 1
+            with self.lock:
+                table.update(fetched)
+                absent.update(i for i in missing if i not in fetched)
+        return table
+
+    def enrich(self, conn, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Adiciona os atributos (ex.: row['store'] = {'name': ...}) para cada id agrupado."""
+        if not rows:
+            return rows
+        present = [column for column in ENRICH_KEYS if column in rows[0]]
+        for column in present:
+            name, key = ENRICH_KEYS[column]
+            table = self.lookup(conn, name, (row[column] for row in rows))
+            for row in rows:
+                row[key] = table.get(row[column])
+        return rows
+
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+            self.absent.clear()
+            self.loaded_at.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "worker_pid": os.getpid(),
+                "ttl_seconds": self.ttl,
+                "tables": {name: len(rows) for name, rows in self.tables.items()},
+                "absent": {name: len(ids) for name, ids in self.absent.items()},
+                **self.counters
+            }
+
+
+dimension_cache = DimensionCache()
@@ -0,0 +1,438 @@
+"""
+Execução das consultas analíticas em DuckDB sobre snapshots Parquet.
+
+O export copia as tabelas usadas pelo QueryBuilder para Parquet em disco
+(PARQUET_DIR), com sales particionada por ano/mês e ordenada por created_at.
+Tudo é lido em uma única transação REPEATABLE READ, então o snapshot é
+consistente. O manifesto guarda o horizonte de transação do snapshot (ver
+changes.py) e o maior created_at.
+
+O roteador manda para o DuckDB as consultas históricas e longas, e deixa no
+Postgres as recentes ou curtas. Uma consulta só vai para o DuckDB se nenhuma
+venda da sua janela foi inserida, alterada ou removida desde o horizonte
+(sales_changes) e nenhuma tabela de dimensão mudou (dimension_changes), então
+o resultado é o mesmo do Postgres.
+
+Requer o pacote duckdb (em requirements.txt; sem ele tudo roda no Postgres). Uso:
+    python duckdb_engine.py --export                  # gera um snapshot
+    python duckdb_engine.py --compare consulta.json   # roda nos dois motores e compara
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import threading
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from psycopg2 import sql
+
+from changes import changes_available, current_horizon
+from database import open_dedicated_connection, read_connection
+from query_helpers import created_at_window
+from querybuilder import QueryBuilder
+
+PARQUET_DIR = os.getenv(
+    "PARQUET_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "parquet")
+)
+# auto: roteia por janela e marca d'água; off: sempre Postgres.
+DUCKDB_ROUTING = os.getenv("DUCKDB_ROUTING", "auto")
+DUCKDB_MIN_SPAN_DAYS = float(os.getenv("DUCKDB_MIN_SPAN_DAYS", "90"))
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", "0"))
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "")
+DUCKDB_KEEP_SNAPSHOTS = 2
+
+CURRENT_FILE = "current.json"
+PARTITION_COLUMNS = ["created_year", "created_month"]
+
+POSTGRES_TO_DUCKDB = {
+    "smallint": "SMALLINT",
+    "integer": "INTEGER",
+    "bigint": "BIGINT",
+    "real": "FLOAT",
+    "double precision": "DOUBLE",
+    "boolean": "BOOLEAN",
+    "date": "DATE",
+    "timestamp without time zone": "TIMESTAMP",
+    "timestamp with time zone": "TIMESTAMPTZ",
+    "text": "VARCHAR",
+    "character varying": "VARCHAR",
+    "character": "VARCHAR"
+}
+
+
+# Falha do import guardada: sem o pacote, o roteador não tenta importar a cada consulta.
+_duckdb_import_error = None
+
+
+def _require_duckdb():
+    global _duckdb_import_error
+    if _duckdb_import_error is None:
+        try:
+            import duckdb
+            return duckdb
+        except ImportError as error:
+            _duckdb_import_error = error
+    raise RuntimeError("O motor DuckDB requer o pacote 'duckdb' instalado.") from _duckdb_import_error
+
+
+def duckdb_available() -> bool:
+    try:
+        _require_duckdb()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def snapshot_tables() -> List[str]:
+    """Tabelas que o QueryBuilder pode ler: a tabela fato e as do JOIN_MAP."""
+    builder = QueryBuilder()
+    return [builder.main_table] + list(builder.JOIN_MAP)
+
+
+def _table_columns(cursor, table: str) -> List[tuple]:
+    """(coluna, tipo DuckDB) na ordem da tabela."""
+    cursor.execute("""
+        SELECT column_name, data_type, numeric_precision, numeric_scale
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s
+        ORDER BY ordinal_position;
+    """, (table,))
+    columns = []
+    for name, data_type, precision, scale in cursor.fetchall():
+        if data_type == "numeric":
+            duck_type = f"DECIMAL({precision}, {scale})" if precision else "DOUBLE"
+        else:
+            duck_type = POSTGRES_TO_DUCKDB.get(data_type, "VARCHAR")
+        columns.append((name, duck_type))
+    return columns
+
+
+def _export_table(cursor, duck, table: str, columns: List[tuple], target_dir: str) -> dict:
+    """COPY do Postgres para CSV temporário e do CSV para Parquet pelo DuckDB."""
+    csv_path = os.path.join(target_dir, f"{table}.csv")
+    with open(csv_path, "w", encoding="utf-8") as handle:
+        cursor.copy_expert(
+            sql.SQL("COPY {table} ({columns}) TO STDOUT WITH (FORMAT csv)").format(
+                table=sql.Identifier(table),
+                columns=sql.SQL(", ").join(sql.Identifier(name) for name, _ in columns)
+            ),
+            handle
+        )
+
+    column_types = ", ".join(f"{_literal(name)}: {_literal(duck_type)}" for name, duck_type in columns)
+    source = (
+        f"read_csv({_literal(csv_path)}, header = false, auto_detect = false, "
+        f"quote = '\"', escape = '\"', columns = {{{column_types}}})"
+    )
+
+    if table == "sales":
+        # Partições por mês e created_at ordenado: os filtros de data pulam row groups pelas estatísticas.
+        target = os.path.join(target_dir, table)
+        duck.execute(
+            f"COPY (SELECT *, year(created_at) AS created_year, month(created_at) AS created_month "
+            f"FROM {source} ORDER BY created_at) "
+            f"TO {_literal(target)} (FORMAT PARQUET, PARTITION_BY (created_year, created_month))"
+        )
+        files, partitioned = f"{table}/**/*.parquet", True
+    else:
+        target = os.path.join(target_dir, f"{table}.parquet")
+        duck.execute(f"COPY (SELECT * FROM {source}) TO {_literal(target)} (FORMAT PARQUET)")
+        files, partitioned = f"{table}.parquet", False
+
+    os.remove(csv_path)
+    rows = duck.execute(
+        f"SELECT count(*) FROM read_parquet({_literal(os.path.join(target_dir, files))})"
+    ).fetchone()[0]
+    return {"files": files, "partitioned": partitioned, "rows": rows}
+
+
+def _write_json_atomic(path: str, payload: dict):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle, indent=2, default=str)
+    os.replace(temp_path, path)
+
+
+def export_snapshot(parquet_dir: str = PARQUET_DIR) -> dict:
+    """Exporta um snapshot consistente e o torna o atual. Retorna o manifesto."""
+    duckdb = _require_duckdb()
+    snapshot_id = datetime.now(timezone.utc).strftime("snapshot_%Y%m%dT%H%M%S%fZ")
+    temp_dir = os.path.join(parquet_dir, f".{snapshot_id}.tmp")
+    os.makedirs(temp_dir)
+
+    conn = open_dedicated_connection()
+    duck = duckdb.connect()
+    started = datetime.now(timezone.utc)
+    try:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        cursor = conn.cursor()
+        # Primeira leitura da transação: o horizonte é o do snapshot exportado.
+        horizon = current_horizon(cursor)
+        cursor.execute("SELECT min(created_at), max(created_at) FROM sales;")
+        min_created_at, max_created_at = cursor.fetchone()
+        tables = {
+            table: _export_table(cursor, duck, table, _table_columns(cursor, table), temp_dir)
+            for table in snapshot_tables()
+        }
+        conn.rollback()
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    finally:
+        conn.close()
+        duck.close()
+
+    manifest = {
+        "snapshot": snapshot_id,
+        "exported_at": started.isoformat(),
+        "seconds": round((datetime.now(timezone.utc) - started).total_seconds(), 3),
+        "horizon": horizon,
+        "min_created_at": min_created_at.isoformat() if min_created_at else None,
+        "max_created_at": max_created_at.isoformat() if max_created_at else None,
+        "tables": tables
+    }
+    _write_json_atomic(os.path.join(temp_dir, "manifest.json"), manifest)
+    os.rename(temp_dir, os.path.join(parquet_dir, snapshot_id))
+    _write_json_atomic(os.path.join(parquet_dir, CURRENT_FILE), manifest)
+    _prune_snapshots(parquet_dir, snapshot_id)
+    return manifest
+
+
+def _prune_snapshots(parquet_dir: str, current: str):
+    """Mantém os DUCKDB_KEEP_SNAPSHOTS mais novos (consultas em andamento ainda leem o anterior)."""
+    snapshots = sorted(name for name in os.listdir(parquet_dir) if name.startswith("snapshot_"))
+    for name in snapshots[:-DUCKDB_KEEP_SNAPSHOTS]:
+        if name != current:
+            shutil.rmtree(os.path.join(parquet_dir, name), ignore_errors=True)
+
+
+def _match_postgres_types(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Tipos do DuckDB -> tipos que o psycopg2 devolveria para a mesma coluna."""
+    for key, value in row.items():
+        if isinstance(value, date) and not isinstance(value, datetime):
+            row[key] = datetime(value.year, value.month, value.day)
+        elif key == QueryBuilder.DATE_GROUP_ALIAS and isinstance(value, int):
+            # EXTRACT(DOW ...) é numeric no Postgres.
+            row[key] = Decimal(value)
+    return row
+
+
+class DuckDBEngine:
+    """Conexão DuckDB com views sobre o snapshot atual e o roteador Postgres/DuckDB."""
+
+    def __init__(self, parquet_dir: str = PARQUET_DIR):
+        self.parquet_dir = parquet_dir
+        self._lock = threading.Lock()
+        self._conn = None
+        self._snapshot = None
+        self._manifest = None
+        self._manifest_mtime = None
+        self.routed = {"duckdb": 0, "postgres": 0}
+        self.reasons = {}
+        self.errors = 0
+
+    def manifest(self) -> Optional[dict]:
+        """Manifesto do snapshot atual (relido quando current.json muda)."""
+        path = os.path.join(self.parquet_dir, CURRENT_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self._manifest_mtime:
+            with open(path, encoding="utf-8") as handle:
+                self._manifest = json.load(handle)
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def _cursor(self):
+        """Cursor (conexão duplicada, segura por thread) sobre o snapshot atual."""
+        manifest = self.manifest()
+        if manifest is None:
+            raise RuntimeError("Nenhum snapshot Parquet exportado.")
+        with self._lock:
+            if self._snapshot != manifest["snapshot"]:
+                duckdb = _require_duckdb()
+                conn = duckdb.connect()
+                if DUCKDB_THREADS:
+                    conn.execute(f"SET threads = {DUCKDB_THREADS}")
+                if DUCKDB_MEMORY_LIMIT:
+                    conn.execute(f"SET memory_limit = {_literal(DUCKDB_MEMORY_LIMIT)}")
+                # Mesma ordem de NULLs do Postgres (ASC NULLS LAST, DESC NULLS FIRST).
+                conn.execute("SET default_null_order = 'nulls_last_on_asc_first_on_desc'")
+                snapshot_dir = os.path.join(self.parquet_dir, manifest["snapshot"])
+                for table, info in manifest["tables"].items():
+                    files = _literal(os.path.join(snapshot_dir, info["files"]))
+                    if info["partitioned"]:
+                        source = (
+                            f"SELECT * EXCLUDE ({', '.join(PARTITION_COLUMNS)}) "
+                            f"FROM read_parquet({files}, hive_partitioning = true)"
+                        )
+                    else:
+                        source = f"SELECT * FROM read_parquet({files})"
+                    conn.execute(f"CREATE VIEW {_identifier(table)} AS {source}")
+                self._conn = conn
+                self._snapshot = manifest["snapshot"]
+            return self._conn.cursor()
+
+    def _decide(self, engine: str, reason: str) -> tuple:
+        self.routed[engine] += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        return engine, reason
+
+    def route(self, conn, builder: QueryBuilder, request: Dict[str, Any]) -> tuple:
+        """
+        ("duckdb" | "postgres", motivo). DuckDB só para janelas de pelo menos
+        DUCKDB_MIN_SPAN_DAYS que terminam antes do maior created_at do snapshot e
+        sem alterações (vendas da janela ou dimensões) desde o horizonte dele.
+        """
+        if DUCKDB_ROUTING == "off":
+            return self._decide("postgres", "disabled")
+        if not duckdb_available():
+            return self._decide("postgres", "duckdb_unavailable")
+        manifest = self.manifest()
+        if manifest is None or manifest.get("max_created_at") is None or "horizon" not in manifest:
+            return self._decide("postgres", "no_snapshot")
+        if request.get("compare_to"):
+            return self._decide("postgres", "compare_to")
+
+        metric, _, filters = builder.normalize(
+            request["metric"], request.get("group_by") or [], request.get("filters") or []
+        )
+        if builder.get_histogram_spec(metric):
+            return self._decide("postgres", "histogram")
+
+        start, end = created_at_window(builder, filters)
+        snapshot_start = datetime.fromisoformat(manifest["min_created_at"])
+        snapshot_end = datetime.fromisoformat(manifest["max_created_at"])
+        if end is not None and end > snapshot_end:
+            return self._decide("postgres", "after_watermark")
+        span = min(end or snapshot_end, snapshot_end) - max(start or snapshot_start, snapshot_start)
+        if span < timedelta(days=DUCKDB_MIN_SPAN_DAYS):
+            return self._decide("postgres", "small_range")
+
+        cursor = conn.cursor()
+        if not changes_available(cursor, manifest["horizon"]):
+            return self._decide("postgres", "snapshot_expired")
+        cursor.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM sales_changes
+                WHERE txid >= %(horizon)s::text::xid8
+                  AND (sale_date IS NULL OR (
+                      (%(start)s::date IS NULL OR sale_date >= %(start)s::date)
+                      AND (%(end)s::date IS NULL OR sale_date <= %(end)s::date)
+                  ))
+            ), EXISTS (
+                SELECT 1 FROM dimension_changes WHERE txid >= %(horizon)s::text::xid8
+            );
+        """, {"horizon": str(manifest["horizon"]), "start": start, "end": end})
+        sales_changed, dimensions_changed = cursor.fetchone()
+        if sales_changed:
+            return self._decide("postgres", "changed_rows")
+        if dimensions_changed:
+            return self._decide("postgres", "changed_dimensions")
+        return self._decide("duckdb", "snapshot")
+
+    def execute(self, builder: QueryBuilder, request: Dict[str, Any], order_by: Optional[str], limit: int) -> list:
+        """Roda a QueryRequest no snapshot e devolve as linhas como o RealDictCursor devolveria."""
+        query, params = builder.build_duckdb_query(
+            metric=request["metric"],
+            group_by=request.get("group_by") or [],
+            filters=request.get("filters") or [],
+            order_by=order_by,
+            limit=limit,
+            grouping=request.get("grouping"),
+            grouping_sets=request.get("grouping_sets")
+        )
+        cursor = self._cursor()
+        try:
+            cursor.execute(query, params)
+            columns = [description[0] for description in cursor.description]
+            return [_match_postgres_types(dict(zip(columns, row))) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def record_error(self):
+        self.errors += 1
+
+    def status(self) -> dict:
+        return {
+            "worker_pid": os.getpid(),
+            "routing": DUCKDB_ROUTING,
+            "duckdb_installed": duckdb_available(),
+            "min_span_days": DUCKDB_MIN_SPAN_DAYS,
+            "snapshot": self.manifest(),
+            "routed": dict(self.routed),
+            "reasons": dict(self.reasons),
+            "errors": self.errors
+        }
+
+
+duckdb_engine = DuckDBEngine()
+
+
+def _comparable(value: Any):
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def compare_results(postgres_rows: list, duckdb_rows: list, rel_tol: float = 1e-9) -> list:
+    """Diferenças entre os dois resultados (mesma ordem de linhas; floats com tolerância relativa)."""
+    differences = []
+    if len(postgres_rows) != len(duckdb_rows):
+        differences.append({"rows": [len(postgres_rows), len(duckdb_rows)]})
+    for index, (expected, actual) in enumerate(zip(postgres_rows, duckdb_rows)):
+        for key in sorted(set(expected) | set(actual)):
+            left, right = _comparable(expected.get(key)), _comparable(actual.get(key))
+            if isinstance(left, float) and isinstance(right, (int, float)):
+                equal = math.isclose(left, right, rel_tol=rel_tol, abs_tol=1e-9)
+            else:
+                equal = left == right
+            if not equal:
+                differences.append({"row": index, "column": key, "postgres": str(left), "duckdb": str(right)})
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshots Parquet e consultas no DuckDB.")
+    parser.add_argument("--export", action="store_true", help="Exporta um snapshot novo")
+    parser.add_argument("--compare", metavar="ARQUIVO", help="QueryRequest em JSON para rodar nos dois motores")
+    args = parser.parse_args()
+
+    if args.export:
+        print(json.dumps(export_snapshot(), indent=2, ensure_ascii=False))
+    if args.compare:
+        from psycopg2.extras import RealDictCursor
+
+        with open(args.compare, encoding="utf-8") as handle:
+            request = json.load(handle)
+        builder = QueryBuilder()
+        order_by, limit = request.get("order_by", "metric_result DESC"), request.get("limit", 100)
+        query, params = builder.build_analytics_query(
+            metric=request["metric"], group_by=request.get("group_by") or [],
+            filters=request.get("filters") or [], order_by=order_by, limit=limit,
+            grouping=request.get("grouping"), grouping_sets=request.get("grouping_sets")
+        )
+        with read_connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(query, params)
+            postgres_rows = cursor.fetchall()
+            conn.rollback()
+        duckdb_rows = duckdb_engine.execute(builder, request, order_by, limit)
+        differences = compare_results(postgres_rows, duckdb_rows)
+        print(json.dumps({"rows": len(postgres_rows), "differences": differences}, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
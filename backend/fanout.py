@@ -0,0 +1,263 @@
+"""
+Fan-out por faixa de tempo para agregações longas no Postgres.
+
+Uma consulta flexível com janela fechada de created_at de pelo menos
+FANOUT_MIN_SPAN_DAYS, que iria inteira para um backend do Postgres, é
+quebrada em fatias mensais. Cada fatia é a mesma consulta com os filtros
+originais mais created_at >= início / < fim da fatia, em modo parcial do
+QueryBuilder (sem ORDER BY/LIMIT). As fatias rodam em paralelo na conexão da
+requisição e em conexões extras obtidas sem espera (vagas livres da classe
+de carga ou do pool, até FANOUT_MAX_WORKERS); sem nenhuma extra livre a
+consulta segue em um único statement. As extras nunca esgotam a classe de
+carga da requisição: o fan-out pega no máximo FANOUT_CLASS_SHARE das vagas
+livres, depois de deixar FANOUT_CLASS_RESERVE para as próximas requisições.
+
+Os parciais são mergeados por grupo em Python: SUM/COUNT somam, MIN/MAX pelo
+extremo, AVG por soma/contagem e COUNT DISTINCT por HyperLogLog (aproximado,
+método 'fanout_approx'; FANOUT_APPROX_DISTINCT=0 deixa COUNT DISTINCT fora do
+fan-out). O ORDER BY/LIMIT final é aplicado no merge, com as regras do SQL
+gerado (NULLs primeiro no DESC).
+
+Cada fatia roda em sua própria transação: linhas inseridas durante a
+consulta podem aparecer em uma fatia e não em outra.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from psycopg2.extras import RealDictCursor
+
+from database import release_db_connection, try_get_read_connection
+from query_helpers import created_at_window, order_rows
+from querybuilder import QueryBuilder
+from sketches import HyperLogLog
+from tracing import span
+from workload import current_ticket
+
+FANOUT_ENABLED = os.getenv("FANOUT_ENABLED", "1") == "1"
+FANOUT_MIN_SPAN_DAYS = float(os.getenv("FANOUT_MIN_SPAN_DAYS", "60"))
+FANOUT_MAX_WORKERS = int(os.getenv("FANOUT_MAX_WORKERS", "8"))
+FANOUT_APPROX_DISTINCT = os.getenv("FANOUT_APPROX_DISTINCT", "1") == "1"
+# Fração das vagas livres da classe de carga que um fan-out pode ocupar, e
+# quantas vagas ficam sempre livres para outras requisições da classe.
+FANOUT_CLASS_SHARE = float(os.getenv("FANOUT_CLASS_SHARE", "0.5"))
+FANOUT_CLASS_RESERVE = int(os.getenv("FANOUT_CLASS_RESERVE", "1"))
+
+
+def _month_boundaries(start: datetime, end: datetime) -> List[datetime]:
+    """Inícios de mês estritamente dentro de (start, end)."""
+    boundaries = []
+    year, month = start.year, start.month
+    while True:
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        boundary = datetime(year, month, 1)
+        if boundary >= end:
+            return boundaries
+        boundaries.append(boundary)
+
+
+def _extra_connections(wanted: int) -> int:
+    """Conexões extras que o fan-out pode pedir sem tomar as vagas da classe de carga."""
+    ticket = current_ticket()
+    if ticket is None:
+        return wanted
+    free = ticket.workload_class.free_slots()
+    return max(0, min(wanted, int((free - FANOUT_CLASS_RESERVE) * FANOUT_CLASS_SHARE)))
+
+
+def _merge_values(func: str, current: Any, value: Any) -> Any:
+    if current is None:
+        return value
+    if value is None:
+        return current
+    if func == "MIN":
+        return min(current, value)
+    if func == "MAX":
+        return max(current, value)
+    return current + value
+
+
+def _average(total: Any, count: int) -> Any:
+    """metric_sum / metric_count com o tipo que AVG devolveria (numeric ou float)."""
+    if not count or total is None:
+        return None
+    if isinstance(total, float):
+        return total / count
+    return Decimal(total) / count
+
+
+class FanoutExecutor:
+    """Plano (janela, fatias), execução paralela e merge dos parciais, com contadores."""
+
+    def __init__(self):
+        self.executed = 0
+        self.chunks = 0
+        self.connections = 0
+        self.reasons = {}
+        self._lock = threading.Lock()
+
+    def _skip(self, reason: str):
+        with self._lock:
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        return None
+
+    def plan(self, builder: QueryBuilder, request: Dict[str, Any]) -> Optional[dict]:
+        """Fatias e campos de agrupamento, ou None quando a consulta não é elegível."""
+        if not FANOUT_ENABLED:
+            return None
+        if request.get("compare_to") or request.get("grouping"):
+            return self._skip("compare_or_grouping")
+        metric, group_by, filters = builder.normalize(
+            request["metric"], request.get("group_by") or [], request.get("filters") or []
+        )
+        func = metric["func"].upper()
+        if func not in builder.PARTIAL_FUNCTIONS or builder.get_histogram_spec(metric):
+            return self._skip("function")
+        if func == "COUNT DISTINCT" and not FANOUT_APPROX_DISTINCT:
+            return self._skip("exact_distinct")
+        start, end = created_at_window(builder, filters)
+        if start is None or end is None:
+            return self._skip("open_range")
+        if (end - start).total_seconds() < FANOUT_MIN_SPAN_DAYS * 86400:
+            return self._skip("small_range")
+        boundaries = _month_boundaries(start, end)
+        if not boundaries:
+            return self._skip("single_chunk")
+
+        chunks = []
+        edges = [None] + boundaries + [None]
+        for lower, upper in zip(edges, edges[1:]):
+            chunk_filters = list(filters)
+            if lower is not None:
+                chunk_filters.append({"column": "created_at", "op": ">=", "value": lower})
+            if upper is not None:
+                chunk_filters.append({"column": "created_at", "op": "<", "value": upper})
+            chunks.append(chunk_filters)
+        return {
+            "func": func,
+            "group_by": group_by,
+            "fields": [
+                builder.DATE_GROUP_ALIAS if item["granularity"] else item["column"] for item in group_by
+            ],
+            "chunks": chunks,
+            "method": "fanout_approx" if func == "COUNT DISTINCT" else "fanout"
+        }
+
+    def execute(self, conn, builder: QueryBuilder, request: Dict[str, Any], plan: dict,
+                order_by: Optional[str], limit: Optional[int]) -> Optional[list]:
+        """Roda as fatias e devolve as linhas finais; None para seguir em um único statement."""
+        with span("build"):
+            queries = [
+                builder.build_analytics_query(
+                    metric=request["metric"], group_by=plan["group_by"], filters=chunk_filters,
+                    order_by=order_by, limit=None, partial=True
+                )
+                for chunk_filters in plan["chunks"]
+            ]
+
+        extra = []
+        budget = _extra_connections(min(len(queries), FANOUT_MAX_WORKERS) - 1)
+        try:
+            while len(extra) < budget:
+                extra_conn = try_get_read_connection()
+                if extra_conn is None:
+                    break
+                extra.append(extra_conn)
+            if not extra:
+                return self._skip("no_spare_connection")
+            partials = self._run(queries, [conn] + extra)
+        finally:
+            for extra_conn in extra:
+                release_db_connection(extra_conn)
+
+        with span("merge", chunks=len(queries)):
+            rows = self._merge(plan, partials, builder.HLL_PRECISION)
+            rows = order_rows(
+                rows, order_by, [item["column"] for item in plan["group_by"] if not item["granularity"]],
+                any(item["granularity"] for item in plan["group_by"]), limit
+            )
+        if rows is None:
+            return self._skip("order_column_not_selected")
+        with self._lock:
+            self.executed += 1
+            self.chunks += len(queries)
+            self.connections += 1 + len(extra)
+        return rows
+
+    def _run(self, queries: List[tuple], conns: list) -> List[list]:
+        """Uma fatia por vez em cada conexão livre; resultados na ordem das fatias."""
+        idle = queue.Queue()
+        for chunk_conn in conns:
+            idle.put(chunk_conn)
+
+        def run_chunk(index, query, params):
+            chunk_conn = idle.get()
+            try:
+                with span("chunk", index=index):
+                    cursor = chunk_conn.cursor(cursor_factory=RealDictCursor)
+                    cursor.execute(query, params)
+                    return cursor.fetchall()
+            finally:
+                idle.put(chunk_conn)
+
+        with ThreadPoolExecutor(max_workers=len(conns)) as executor:
+            futures = [
+                executor.submit(copy_context().run, run_chunk, index, query, params)
+                for index, (query, params) in enumerate(queries)
+            ]
+            return [future.result() for future in futures]
+
+    def _merge(self, plan: dict, partials: List[list], precision: int) -> List[dict]:
+        func, fields = plan["func"], plan["fields"]
+        groups = {}
+        for rows in partials:
+            for row in rows:
+                key = tuple(row[field] for field in fields)
+                if key not in groups:
+                    groups[key] = HyperLogLog(precision) if func == "COUNT DISTINCT" else {}
+                state = groups[key]
+                if func == "COUNT DISTINCT":
+                    for register, rank in zip(row["hll_registers"] or [], row["hll_ranks"] or []):
+                        if register is not None and rank is not None:
+                            state.add_register(register, rank)
+                elif func == "AVG":
+                    state["sum"] = _merge_values("SUM", state.get("sum"), row["metric_sum"])
+                    state["count"] = state.get("count", 0) + row["metric_count"]
+                else:
+                    state["value"] = _merge_values(func, state.get("value"), row["metric_result"])
+
+        results = []
+        for key, state in groups.items():
+            row = dict(zip(fields, key))
+            if func == "COUNT DISTINCT":
+                row["metric_result"] = state.count()
+            elif func == "AVG":
+                row["metric_result"] = _average(state.get("sum"), state.get("count"))
+            else:
+                row["metric_result"] = state.get("value")
+            results.append(row)
+        return results
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "worker_pid": os.getpid(),
+                "enabled": FANOUT_ENABLED,
+                "min_span_days": FANOUT_MIN_SPAN_DAYS,
+                "max_workers": FANOUT_MAX_WORKERS,
+                "class_share": FANOUT_CLASS_SHARE,
+                "class_reserve": FANOUT_CLASS_RESERVE,
+                "approx_distinct": FANOUT_APPROX_DISTINCT,
+                "executed": self.executed,
+                "chunks": self.chunks,
+                "connections": self.connections,
+                "skipped": dict(self.reasons)
+            }
+
+
+fanout_executor = FanoutExecutor()
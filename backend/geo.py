@@ -0,0 +1,142 @@
+"""
+Heatmap de entregas por células de grade (/api/v1/analytics/geo/heatmap).
+
+delivery_addresses guarda, em colunas geradas e indexadas, a célula de cada
+endereço em alguns zooms (tiles Web Mercator, id = x * 2^zoom + y, calculados
+por geo_tile_cell no banco). O heatmap de um bounding box soma as vendas por
+célula pelo índice, sem ler latitude/longitude. distance_km (loja -> endereço)
+é preenchida por trigger na escrita.
+"""
+import math
+from datetime import date, timedelta
+from typing import List, Optional
+
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+# Zooms com coluna geo_cell_z<zoom> em delivery_addresses (database-schema.sql).
+GEO_CELL_ZOOMS = [8, 11, 14, 17]
+# Células por tile do mapa: zoom da célula = zoom do mapa + GEO_CELL_DETAIL (2^5 = 32 por lado).
+GEO_CELL_DETAIL = 5
+GEO_MAX_CELLS = 20000
+MAX_LATITUDE = 85.05112878
+HEATMAP_METRICS = {
+    "deliveries": sql.SQL("COUNT(*)"),
+    "revenue": sql.SQL("SUM(s.total_amount)")
+}
+
+
+def tile_xy(lon: float, lat: float, zoom: int) -> tuple:
+    """Tile (x, y) de uma coordenada: mesma conta de geo_tile_cell no banco."""
+    size = 2 ** zoom
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    x = math.floor((lon + 180.0) / 360.0 * size)
+    y = math.floor((1.0 - math.log(math.tan(math.radians(lat)) + 1.0 / math.cos(math.radians(lat))) / math.pi) / 2.0 * size)
+    return min(max(x, 0), size - 1), min(max(y, 0), size - 1)
+
+
+def tile_bounds(x: int, y: int, zoom: int) -> List[float]:
+    """[sul, oeste, norte, leste] de um tile."""
+    size = 2 ** zoom
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / size))))
+
+    return [latitude(y + 1), x / size * 360.0 - 180.0, latitude(y), (x + 1) / size * 360.0 - 180.0]
+
+
+def choose_cell_zoom(map_zoom: int, bbox: tuple) -> tuple:
+    """
+    Maior zoom de célula até map_zoom + GEO_CELL_DETAIL cujo bbox caiba em
+    GEO_MAX_CELLS células. Retorna (zoom, x_min, x_max, y_min, y_max).
+    """
+    south, west, north, east = bbox
+    target = map_zoom + GEO_CELL_DETAIL
+    candidates = [zoom for zoom in GEO_CELL_ZOOMS if zoom <= target] or GEO_CELL_ZOOMS[:1]
+    for zoom in reversed(candidates):
+        x_min, y_min = tile_xy(west, north, zoom)
+        x_max, y_max = tile_xy(east, south, zoom)
+        if (x_max - x_min + 1) * (y_max - y_min + 1) <= GEO_MAX_CELLS or zoom == candidates[0]:
+            return zoom, x_min, x_max, y_min, y_max
+
+
+def query_delivery_heatmap(
+    conn,
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    zoom: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    store_ids: Optional[List[int]] = None,
+    channel_ids: Optional[List[int]] = None,
+    status: Optional[str] = "COMPLETED",
+    metric: str = "deliveries"
+) -> dict:
+    """Entregas, receita e distância média por célula dentro do bbox."""
+    if not (-90 <= south < north <= 90) or not (-180 <= west < east <= 180):
+        raise ValueError("Bounding box inválido: use sul < norte e oeste < leste (sem cruzar o antimeridiano).")
+    if not 0 <= zoom <= 22:
+        raise ValueError("zoom deve estar entre 0 e 22.")
+    if metric not in HEATMAP_METRICS:
+        raise ValueError(f"metric inválida: {metric}. Permitidas: {list(HEATMAP_METRICS)}")
+
+    cell_zoom, x_min, x_max, y_min, y_max = choose_cell_zoom(zoom, (south, west, north, east))
+    size = 2 ** cell_zoom
+    cell = sql.SQL("da.{}").format(sql.Identifier(f"geo_cell_z{cell_zoom}"))
+
+    # Faixa contínua de ids (x entre x_min e x_max) pelo índice; y pelo resto da divisão.
+    conditions = [
+        sql.SQL("{cell} BETWEEN %s AND %s").format(cell=cell),
+        sql.SQL("{cell} %% %s BETWEEN %s AND %s").format(cell=cell)
+    ]
+    params = [x_min * size, x_max * size + size - 1, size, y_min, y_max]
+    if status:
+        conditions.append(sql.SQL("s.sale_status_desc = %s"))
+        params.append(status)
+    if start_date:
+        conditions.append(sql.SQL("s.created_at >= %s"))
+        params.append(start_date)
+    if end_date:
+        conditions.append(sql.SQL("s.created_at < %s"))
+        params.append(end_date + timedelta(days=1))
+    if store_ids:
+        conditions.append(sql.SQL("s.store_id = ANY(%s)"))
+        params.append(store_ids)
+    if channel_ids:
+        conditions.append(sql.SQL("s.channel_id = ANY(%s)"))
+        params.append(channel_ids)
+
+    query = sql.SQL("""
+        SELECT {cell} AS cell,
+               COUNT(*) AS deliveries,
+               SUM(s.total_amount) AS revenue,
+               AVG(da.distance_km) AS avg_distance_km
+        FROM delivery_addresses AS da
+        JOIN sales AS s ON s.id = da.sale_id
+        WHERE {conditions}
+        GROUP BY 1
+        ORDER BY {metric} DESC
+    """).format(
+        cell=cell,
+        conditions=sql.SQL(" AND ").join(conditions),
+        metric=HEATMAP_METRICS[metric]
+    )
+
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(query, params)
+    cells = []
+    for row in cursor.fetchall():
+        x, y = divmod(row["cell"], size)
+        bounds = tile_bounds(x, y, cell_zoom)
+        cells.append({
+            **row,
+            "x": x,
+            "y": y,
+            "lat": (bounds[0] + bounds[2]) / 2,
+            "lng": (bounds[1] + bounds[3]) / 2,
+            "bounds": bounds
+        })
+
+    return {"cell_zoom": cell_zoom, "metric": metric, "cells": cells}
@@ -0,0 +1,316 @@
+"""
+Ingestão de vendas em lote (POST /api/v1/ingest/sales).
+
+As requisições entram em uma fila asyncio limitada (INGEST_QUEUE_MAX_SALES):
+com a fila cheia, a requisição espera até INGEST_ENQUEUE_TIMEOUT e depois
+recebe 503, em vez de acumular memória sem limite. Um flusher junta os lotes
+até INGEST_FLUSH_MAX_SALES vendas ou INGEST_FLUSH_INTERVAL segundos e grava
+tudo com COPY em uma transação por flush, usando uma conexão própria (fora do
+pool das consultas analíticas).
+
+Os ids de sales, product_sales, item_product_sales e delivery_sales são
+reservados com nextval antes do COPY, para que as linhas filhas já saiam com a
+chave do pai sem ida e volta por linha. Por isso os ids não commitam em ordem:
+um flush (ou um INSERT de outro cliente) pode tornar visíveis ids menores
+depois de outro com ids maiores, e um flush recusado deixa buracos. Quem
+acompanha vendas novas usa o log sales_changes (changes.py), não MAX(id).
+"""
+import asyncio
+import csv
+import io
+import os
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, List
+
+import psycopg2
+
+from database import open_dedicated_connection
+
+INGEST_QUEUE_MAX_SALES = int(os.getenv("INGEST_QUEUE_MAX_SALES", "50000"))
+INGEST_FLUSH_MAX_SALES = int(os.getenv("INGEST_FLUSH_MAX_SALES", "5000"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.2"))
+INGEST_ENQUEUE_TIMEOUT = float(os.getenv("INGEST_ENQUEUE_TIMEOUT", "5"))
+
+SALES_COLUMNS = [
+    "id", "store_id", "customer_id", "channel_id", "customer_name", "created_at", "sale_status_desc",
+    "total_amount_items", "total_discount", "total_increase", "delivery_fee", "service_tax_fee",
+    "total_amount", "value_paid", "production_seconds", "delivery_seconds", "discount_reason",
+    "people_quantity", "origin"
+]
+PRODUCT_SALES_COLUMNS = ["id", "sale_id", "product_id", "quantity", "base_price", "total_price"]
+ITEM_PRODUCT_SALES_COLUMNS = [
+    "id", "product_sale_id", "item_id", "option_group_id", "quantity", "additional_price", "price", "amount"
+]
+DELIVERY_SALES_COLUMNS = [
+    "id", "sale_id", "courier_name", "courier_phone", "courier_type", "delivery_type", "status",
+    "delivery_fee", "courier_fee"
+]
+DELIVERY_ADDRESSES_COLUMNS = [
+    "sale_id", "delivery_sale_id", "street", "number", "complement", "neighborhood", "city", "state",
+    "postal_code", "latitude", "longitude"
+]
+PAYMENTS_COLUMNS = ["sale_id", "payment_type_id", "value"]
+
+
+class IngestQueueFull(Exception):
+    """Fila de ingestão cheia por mais que INGEST_ENQUEUE_TIMEOUT."""
+
+
+class IngestRejected(ValueError):
+    """Lote recusado pelo banco (ex.: loja/produto inexistente)."""
+
+
+def _timestamp(value: datetime) -> datetime:
+    # created_at é TIMESTAMP sem fuso em UTC, como os filtros do QueryBuilder.
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _copy(cursor, table: str, columns: List[str], rows: List[tuple]):
+    if not rows:
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _reserve_ids(cursor, table: str, count: int) -> List[int]:
+    """
+    count ids da sequence da tabela. nextval não é transacional: os ids ficam
+    reservados já aqui, mas só aparecem no COMMIT do flush (fora de ordem em
+    relação a outras transações) e são perdidos se ele falhar.
+    """
+    if count == 0:
+        return []
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s);",
+        (table, count)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+class SalesWriter:
+    """Grava lotes de vendas (formato de generate_single_sale) com COPY."""
+
+    def __init__(self):
+        self.conn = None
+        self.payment_types = {}
+
+    def _connection(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = open_dedicated_connection()
+            self.payment_types = {}
+        return self.conn
+
+    def _payment_type_id(self, cursor, description: str) -> int:
+        if description not in self.payment_types:
+            cursor.execute("SELECT description, id FROM payment_types;")
+            self.payment_types = dict(cursor.fetchall())
+        if description not in self.payment_types:
+            raise IngestRejected(f"Tipo de pagamento desconhecido: {description}")
+        return self.payment_types[description]
+
+    def write(self, sales: List[Dict[str, Any]]) -> List[int]:
+        """Uma transação: reserva ids, COPY em todas as tabelas e COMMIT. Retorna os ids das vendas."""
+        conn = self._connection()
+        try:
+            with conn.cursor() as cursor:
+                ids = self._write(cursor, sales)
+            conn.commit()
+            return ids
+        except psycopg2.IntegrityError as error:
+            conn.rollback()
+            raise IngestRejected(str(error).strip()) from error
+        except IngestRejected:
+            conn.rollback()
+            raise
+        except psycopg2.Error:
+            conn.rollback()
+            raise
+
+    def _write(self, cursor, sales: List[Dict[str, Any]]) -> List[int]:
+        products = [product for sale in sales for product in sale["products"]]
+        items = [item for product in products for item in product["items"]]
+        deliveries = [sale["delivery"] for sale in sales if sale.get("delivery")]
+
+        sale_ids = _reserve_ids(cursor, "sales", len(sales))
+        product_sale_ids = iter(_reserve_ids(cursor, "product_sales", len(products)))
+        item_ids = iter(_reserve_ids(cursor, "item_product_sales", len(items)))
+        delivery_ids = iter(_reserve_ids(cursor, "delivery_sales", len(deliveries)))
+
+        sales_rows, product_rows, item_rows = [], [], []
+        delivery_rows, address_rows, payment_rows = [], [], []
+        for sale_id, sale in zip(sale_ids, sales):
+            sales_rows.append((
+                sale_id, sale["store_id"], sale.get("customer_id"), sale["channel_id"],
+                sale.get("customer_name"), _timestamp(sale["created_at"]).isoformat(), sale["status"],
+                sale["total_items_value"], sale.get("discount", 0), sale.get("increase", 0),
+                sale.get("delivery_fee", 0), sale.get("service_tax", 0), sale["total_amount"],
+                sale.get("value_paid", 0), sale.get("production_sec"), sale.get("delivery_sec"),
+                sale.get("discount_reason"), sale.get("people_qty"), sale.get("origin") or "POS"
+            ))
+            for product in sale["products"]:
+                product_sale_id = next(product_sale_ids)
+                product_rows.append((
+                    product_sale_id, sale_id, product["product_id"], product["quantity"],
+                    product["base_price"], product["total_price"]
+                ))
+                for item in product["items"]:
+                    item_rows.append((
+                        next(item_ids), product_sale_id, item["item_id"], item.get("option_group_id"),
+                        item["quantity"], item["additional_price"], item["price"], item.get("amount", 1)
+                    ))
+            delivery = sale.get("delivery")
+            if delivery:
+                delivery_sale_id = next(delivery_ids)
+                delivery_rows.append((
+                    delivery_sale_id, sale_id, delivery.get("courier_name"), delivery.get("courier_phone"),
+                    delivery.get("courier_type"), delivery.get("delivery_type"), delivery.get("status"),
+                    delivery.get("delivery_fee"), delivery.get("courier_fee")
+                ))
+                address = delivery.get("address")
+                if address:
+                    address_rows.append((
+                        sale_id, delivery_sale_id, address.get("street"), address.get("number"),
+                        address.get("complement"), address.get("neighborhood"), address.get("city"),
+                        address.get("state"), address.get("postal_code"), address.get("latitude"),
+                        address.get("longitude")
+                    ))
+            for payment in sale.get("payments", []):
+                payment_rows.append((
+                    sale_id, self._payment_type_id(cursor, payment["type"]), Decimal(str(payment["value"]))
+                ))
+
+        # Pais antes dos filhos (as FKs são verificadas por linha).
+        _copy(cursor, "sales", SALES_COLUMNS, sales_rows)
+        _copy(cursor, "product_sales", PRODUCT_SALES_COLUMNS, product_rows)
+        _copy(cursor, "item_product_sales", ITEM_PRODUCT_SALES_COLUMNS, item_rows)
+        _copy(cursor, "delivery_sales", DELIVERY_SALES_COLUMNS, delivery_rows)
+        _copy(cursor, "delivery_addresses", DELIVERY_ADDRESSES_COLUMNS, address_rows)
+        _copy(cursor, "payments", PAYMENTS_COLUMNS, payment_rows)
+        return sale_ids
+
+
+class SalesIngestor:
+    """Fila com backpressure + flusher em lote."""
+
+    def __init__(self):
+        self.queue = None
+        self.writer = SalesWriter()
+        self._task = None
+        self.pending_sales = 0
+        self.stats_counters = {
+            "accepted": 0, "written": 0, "rejected": 0, "flushes": 0, "queue_full": 0, "flush_seconds_total": 0.0
+        }
+
+    def start(self):
+        """Cria a fila e o flusher no event loop atual (chamar no startup)."""
+        if self._task is None:
+            self.queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._flush_forever())
+
+    async def stop(self, drain_seconds: float = 10):
+        """Espera a fila esvaziar (até drain_seconds) e encerra o flusher."""
+        deadline = time.monotonic() + drain_seconds
+        while self.pending_sales > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def submit(self, sales: List[Dict[str, Any]]):
+        """
+        Enfileira um lote e devolve um Future resolvido com os ids após o COMMIT.
+        Espera por espaço na fila até INGEST_ENQUEUE_TIMEOUT.
+        """
+        deadline = time.monotonic() + INGEST_ENQUEUE_TIMEOUT
+        while self.pending_sales + len(sales) > INGEST_QUEUE_MAX_SALES and self.pending_sales > 0:
+            if time.monotonic() >= deadline:
+                self.stats_counters["queue_full"] += 1
+                raise IngestQueueFull()
+            await asyncio.sleep(0.01)
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending_sales += len(sales)
+        self.stats_counters["accepted"] += len(sales)
+        await self.queue.put((sales, future))
+        return future
+
+    @staticmethod
+    def detach(future):
+        """Para quem não espera o COMMIT (wait=false): a falha do lote vai para o log."""
+        def log_failure(done):
+            if not done.cancelled() and done.exception() is not None:
+                print(f"Lote de ingestão recusado (wait=false): {done.exception()}")
+        future.add_done_callback(log_failure)
+
+    async def _flush_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batches = [await self.queue.get()]
+            count = len(batches[0][0])
+            deadline = loop.time() + INGEST_FLUSH_INTERVAL
+            while count < INGEST_FLUSH_MAX_SALES:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batches.append(batch)
+                count += len(batch[0])
+
+            # O COPY roda em thread para não travar o event loop.
+            await loop.run_in_executor(None, self._flush, batches, loop)
+            self.pending_sales -= count
+
+    def _flush(self, batches: list, loop):
+        started = time.monotonic()
+        try:
+            ids = self.writer.write([sale for sales, _ in batches for sale in sales])
+        except Exception as error:
+            if len(batches) == 1:
+                self._resolve(loop, batches[0][1], error=error)
+                self.stats_counters["rejected"] += len(batches[0][0])
+                return
+            # Um lote ruim não derruba os outros: regrava lote a lote.
+            for batch in batches:
+                self._flush([batch], loop)
+            return
+        finally:
+            self.stats_counters["flushes"] += 1
+            self.stats_counters["flush_seconds_total"] += time.monotonic() - started
+
+        self.stats_counters["written"] += len(ids)
+        offset = 0
+        for sales, future in batches:
+            self._resolve(loop, future, result=ids[offset:offset + len(sales)])
+            offset += len(sales)
+
+    @staticmethod
+    def _resolve(loop, future, result=None, error=None):
+        def apply():
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        loop.call_soon_threadsafe(apply)
+
+    def stats(self) -> dict:
+        return {
+            "worker_pid": os.getpid(),
+            "pending_sales": self.pending_sales,
+            "queue_max_sales": INGEST_QUEUE_MAX_SALES,
+            **self.stats_counters
+        }
+
+
+sales_ingestor = SalesIngestor()
@@ -0,0 +1,424 @@
+"""
+Dashboards ao vivo: assinaturas de QueryRequest atualizadas por LISTEN/NOTIFY.
+
+O trigger trg_sales_inserted_notify (database-schema.sql) avisa no canal
+'sales_inserted' o intervalo de ids e de created_at de cada INSERT em sales.
+Uma thread escuta o canal, junta os avisos por LIVE_DEBOUNCE_SECONDS e
+recalcula cada consulta assinada só no que mudou:
+
+- "buckets": agrupada por created_at truncado (day, month...): reexecuta só os
+  buckets que receberam vendas e substitui essas linhas.
+- "additive": SUM/COUNT sem agrupamento por data: guarda o resultado por dia
+  (agrupamento extra por created_at/day), reexecuta só os dias que receberam
+  vendas e devolve a soma dos dias, com o ORDER BY/LIMIT da consulta. O dia
+  recalculado substitui o anterior: avisos com faixas de id intercaladas
+  (transações concorrentes) não contam a mesma venda duas vezes.
+- "full": o resto (AVG, percentis, compare_to, subtotais, rankings cheios):
+  reexecuta inteira e envia só as linhas que mudaram.
+
+Assinantes com a mesma consulta normalizada compartilham estado e cálculo; cada
+evento é serializado uma vez e entregue a todos. Os recálculos rodam em
+LIVE_WORKERS threads, fora da thread do LISTEN; avisos que chegam enquanto uma
+consulta é recalculada são mesclados e aplicados em seguida, na ordem.
+
+Só inserções são acompanhadas: mudanças de status (ex.: cancelamento) aparecem
+na próxima consulta completa.
+"""
+import asyncio
+import json
+import os
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from analytics import DEFAULT_ORDER_BY, flexible_query_key, execute_flexible_query
+from cache import serialize
+from database import primary_connection, open_dedicated_connection
+from query_helpers import created_at_window, order_rows
+from querybuilder import QueryBuilder
+
+LIVE_CHANNEL = "sales_inserted"
+LIVE_DEBOUNCE_SECONDS = float(os.getenv("LIVE_DEBOUNCE_SECONDS", "1"))
+LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+LIVE_WORKERS = int(os.getenv("LIVE_WORKERS", "4"))
+
+METRIC_FIELDS = {"metric_result", "metric_previous", "delta", "delta_pct"}
+BUCKET_GRANULARITIES = ["second", "minute", "hour", "day", "week", "month", "quarter", "year"]
+ADDITIVE_FUNCTIONS = ["SUM", "COUNT"]
+
+
+def truncate(moment: datetime, granularity: str) -> datetime:
+    """Mesmo resultado de DATE_TRUNC(granularity, moment) no Postgres."""
+    if granularity == "second":
+        return moment.replace(microsecond=0)
+    if granularity == "minute":
+        return moment.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    if granularity == "quarter":
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    return day.replace(month=1, day=1)
+
+
+def next_bucket(start: datetime, granularity: str) -> datetime:
+    if granularity in ("second", "minute", "hour", "day", "week"):
+        return start + timedelta(**{f"{granularity}s": 1})
+    months = {"month": 1, "quarter": 3, "year": 12}[granularity]
+    month_index = start.month - 1 + months
+    return start.replace(year=start.year + month_index // 12, month=month_index % 12 + 1)
+
+
+def row_key(row: Dict[str, Any]) -> tuple:
+    """Identifica a linha pelos campos de agrupamento (tudo que não é métrica)."""
+    return tuple(sorted((name, value) for name, value in row.items() if name not in METRIC_FIELDS))
+
+
+class LiveQuery:
+    """Estado compartilhado de uma consulta assinada."""
+
+    def __init__(self, key: str, request: Dict[str, Any]):
+        self.key = key
+        self.request = request
+        self.subscribers = []
+        self.rows = {}
+        # additive: dia -> {chave: linha sem o dia}.
+        self.days = {}
+        self.lock = threading.Lock()
+        # Aviso ainda não aplicado (mesclado) e se já há um recálculo na fila (protegidos pelo lock do hub).
+        self.pending = None
+        self.scheduled = False
+        self.builder = QueryBuilder()
+        self.mode, self.granularity = self._choose_mode()
+        self.window = created_at_window(self.builder, request.get("filters") or [])
+
+    def _choose_mode(self) -> tuple:
+        request = self.request
+        metric = self.builder.normalize(request["metric"], [], [])[0]
+        func = str(metric.get("func", "")).upper()
+        if request.get("compare_to") or request.get("grouping") or request.get("grouping_sets") or func == "HISTOGRAM":
+            return "full", None
+        for item in request.get("group_by") or []:
+            column = item.get("column") if isinstance(item, dict) else item
+            granularity = item.get("granularity") if isinstance(item, dict) else None
+            if self.builder.resolve_column(column) == ("sales", "created_at"):
+                if granularity in BUCKET_GRANULARITIES:
+                    return "buckets", granularity
+                return "full", None
+        if func in ADDITIVE_FUNCTIONS:
+            return "additive", None
+        return "full", None
+
+    def affected_by(self, change: dict) -> bool:
+        start, end = self.window
+        if start is not None and change["max_created_at"] < start:
+            return False
+        if end is not None and change["min_created_at"] > end:
+            return False
+        return True
+
+    def at_limit(self) -> bool:
+        """Com o resultado cortado pelo limit, mesclar parcial poderia esconder grupos novos."""
+        limit = self.request.get("limit")
+        return limit is not None and len(self.rows) >= limit
+
+    def totals(self) -> List[dict]:
+        """additive: soma dos dias por grupo, ordenada e cortada como o SQL da consulta."""
+        totals = {}
+        for rows in self.days.values():
+            for key, row in rows.items():
+                current = totals.get(key)
+                if current is None:
+                    totals[key] = dict(row)
+                elif row["metric_result"] is not None:
+                    current["metric_result"] = (current["metric_result"] or 0) + row["metric_result"]
+        metric, group_by, _ = self.builder.normalize(self.request["metric"], self.request.get("group_by") or [], [])
+        if not group_by and not totals:
+            # Sem GROUP BY o SQL devolve uma linha mesmo sem vendas.
+            return [{"metric_result": 0 if str(metric.get("func", "")).upper() == "COUNT" else None}]
+        rows = order_rows(
+            list(totals.values()), self.request.get("order_by", DEFAULT_ORDER_BY),
+            [item["column"] for item in group_by], False, self.request.get("limit")
+        )
+        return rows if rows is not None else list(totals.values())
+
+
+class LiveHub:
+    """Assinaturas, thread de LISTEN e recálculo incremental."""
+
+    def __init__(self):
+        self.queries = {}
+        self.lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.notifications = 0
+        self.recomputes = {"buckets": 0, "additive": 0, "full": 0}
+        self._executor = ThreadPoolExecutor(max_workers=LIVE_WORKERS, thread_name_prefix="live-recompute")
+
+    def _run(self, request: Dict[str, Any]) -> list:
+        # No primário e sem a cópia colunar/sketches: o aviso chega logo depois do COMMIT.
+        with primary_connection() as conn:
+            rows = execute_flexible_query(conn, request, fresh=True)["data"]
+            conn.rollback()
+        return rows
+
+    def _run_days(self, live_query: LiveQuery, filters: list) -> dict:
+        """Consulta agrupada também por dia, sem ORDER BY/LIMIT: {dia: {chave: linha}}."""
+        request = live_query.request
+        rows = self._run({
+            **request,
+            "group_by": list(request.get("group_by") or []) + [{"column": "created_at", "granularity": "day"}],
+            "filters": list(request.get("filters") or []) + filters,
+            "order_by": None,
+            "limit": None
+        })
+        days = {}
+        for row in rows:
+            day = row.pop(QueryBuilder.DATE_GROUP_ALIAS)
+            days.setdefault(day, {})[row_key(row)] = row
+        return days
+
+    # --- assinaturas -------------------------------------------------------
+
+    def subscribe(self, request: Dict[str, Any], loop, queue) -> LiveQuery:
+        """Registra o assinante e lhe entrega o snapshot atual (bloqueante: rode em threadpool)."""
+        self._ensure_listener()
+        key = flexible_query_key(request)
+        with self.lock:
+            live_query = self.queries.get(key)
+            created = live_query is None
+            if created:
+                live_query = LiveQuery(key, request)
+                self.queries[key] = live_query
+
+        with live_query.lock:
+            if created or not live_query.rows:
+                try:
+                    if live_query.mode == "additive":
+                        live_query.days = self._run_days(live_query, [])
+                        rows = live_query.totals()
+                    else:
+                        rows = self._run(request)
+                except Exception:
+                    with self.lock:
+                        if not live_query.subscribers:
+                            self.queries.pop(key, None)
+                    raise
+                live_query.rows = {row_key(row): row for row in rows}
+            snapshot = serialize({"type": "snapshot", "mode": live_query.mode, "data": list(live_query.rows.values())})
+            live_query.subscribers.append((loop, queue))
+        loop.call_soon_threadsafe(queue.put_nowait, snapshot)
+        return live_query
+
+    def unsubscribe(self, live_query: LiveQuery, queue):
+        with live_query.lock:
+            live_query.subscribers = [(loop, q) for loop, q in live_query.subscribers if q is not queue]
+            empty = not live_query.subscribers
+        if empty:
+            with self.lock:
+                if self.queries.get(live_query.key) is live_query:
+                    del self.queries[live_query.key]
+
+    async def stream(self, live_query: LiveQuery, queue: asyncio.Queue, http_request):
+        """Gerador SSE: eventos da consulta e comentários de keepalive."""
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), LIVE_HEARTBEAT_SECONDS)
+                    yield b"data: " + event + b"\n\n"
+                except asyncio.TimeoutError:
+                    if await http_request.is_disconnected():
+                        break
+                    yield b": keepalive\n\n"
+        finally:
+            self.unsubscribe(live_query, queue)
+
+    # --- LISTEN ------------------------------------------------------------
+
+    def _ensure_listener(self):
+        with self.lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._listen_forever, name="live-listener", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _listen_forever(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception as error:
+                print(f"Erro no LISTEN {LIVE_CHANNEL}: {error}")
+                self._stop.wait(5)
+
+    def _listen(self):
+        # LISTEN só funciona no primário (NOTIFY não é replicado).
+        conn = open_dedicated_connection()
+        conn.autocommit = True
+        try:
+            conn.cursor().execute(f"LISTEN {LIVE_CHANNEL};")
+            pending = None
+            first_pending_at = None
+            while not self._stop.is_set():
+                timeout = LIVE_DEBOUNCE_SECONDS if pending else 5
+                if select.select([conn], [], [], timeout)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        change = self._parse(conn.notifies.pop(0).payload)
+                        self.notifications += 1
+                        pending = change if pending is None else self._merge(pending, change)
+                        first_pending_at = first_pending_at or time.monotonic()
+                if pending and time.monotonic() - first_pending_at >= LIVE_DEBOUNCE_SECONDS:
+                    self._apply(pending)
+                    pending = first_pending_at = None
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _parse(payload: str) -> dict:
+        data = json.loads(payload)
+        return {
+            "min_id": data["min_id"],
+            "max_id": data["max_id"],
+            "min_created_at": datetime.fromisoformat(data["min_created_at"]),
+            "max_created_at": datetime.fromisoformat(data["max_created_at"]),
+            "count": data["count"]
+        }
+
+    @staticmethod
+    def _merge(a: dict, b: dict) -> dict:
+        return {
+            "min_id": min(a["min_id"], b["min_id"]),
+            "max_id": max(a["max_id"], b["max_id"]),
+            "min_created_at": min(a["min_created_at"], b["min_created_at"]),
+            "max_created_at": max(a["max_created_at"], b["max_created_at"]),
+            "count": a["count"] + b["count"]
+        }
+
+    # --- recálculo ---------------------------------------------------------
+
+    def _apply(self, change: dict):
+        """Agenda o recálculo das consultas afetadas (no máximo um por consulta na fila)."""
+        with self.lock:
+            live_queries = list(self.queries.values())
+        for live_query in live_queries:
+            if not live_query.affected_by(change):
+                continue
+            with self.lock:
+                live_query.pending = change if live_query.pending is None else self._merge(live_query.pending, change)
+                if live_query.scheduled:
+                    continue
+                live_query.scheduled = True
+            self._executor.submit(self._drain, live_query)
+
+    def _drain(self, live_query: LiveQuery):
+        """Aplica os avisos pendentes da consulta, um recálculo por vez."""
+        while True:
+            with self.lock:
+                change, live_query.pending = live_query.pending, None
+                if change is None:
+                    live_query.scheduled = False
+                    return
+            try:
+                with live_query.lock:
+                    event = self._recompute(live_query, change)
+                    subscribers = list(live_query.subscribers)
+            except Exception as error:
+                print(f"Erro ao recalcular consulta ao vivo {live_query.key}: {error}")
+                continue
+            if event is None:
+                continue
+            for loop, queue in subscribers:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def _recompute(self, live_query: LiveQuery, change: dict) -> Optional[bytes]:
+        mode = live_query.mode
+        if mode == "buckets" and live_query.at_limit():
+            mode = "full"
+        self.recomputes[mode] += 1
+        request = live_query.request
+        filters = list(request.get("filters") or [])
+
+        if mode == "buckets":
+            start = truncate(change["min_created_at"], live_query.granularity)
+            end = next_bucket(truncate(change["max_created_at"], live_query.granularity), live_query.granularity)
+            rows = self._run({**request, "filters": filters + [
+                {"column": "created_at", "op": ">=", "value": start.isoformat()},
+                {"column": "created_at", "op": "<", "value": end.isoformat()}
+            ]})
+            upserts = self._upsert(live_query, rows)
+            removed = []
+        elif mode == "additive":
+            start = truncate(change["min_created_at"], "day")
+            end = next_bucket(truncate(change["max_created_at"], "day"), "day")
+            days = self._run_days(live_query, [
+                {"column": "created_at", "op": ">=", "value": start.isoformat()},
+                {"column": "created_at", "op": "<", "value": end.isoformat()}
+            ])
+            for day in [day for day in live_query.days if start <= day < end]:
+                del live_query.days[day]
+            live_query.days.update(days)
+            upserts, removed = self._replace(live_query, live_query.totals())
+        else:
+            upserts, removed = self._replace(live_query, self._run(request))
+
+        if not upserts and not removed:
+            return None
+        return serialize({
+            "type": "delta",
+            "mode": mode,
+            "upserts": upserts,
+            "removed": removed,
+            "sales": {"count": change["count"], "min_id": change["min_id"], "max_id": change["max_id"]}
+        })
+
+    @classmethod
+    def _replace(cls, live_query: LiveQuery, rows: list) -> tuple:
+        """Troca o estado pelo resultado novo: (linhas alteradas, chaves removidas)."""
+        fresh = {row_key(row): row for row in rows}
+        removed = [dict(key) for key in live_query.rows if key not in fresh]
+        upserts = cls._upsert(live_query, rows)
+        for key in list(live_query.rows):
+            if key not in fresh:
+                del live_query.rows[key]
+        return upserts, removed
+
+    @staticmethod
+    def _upsert(live_query: LiveQuery, rows: list) -> list:
+        changed = []
+        for row in rows:
+            key = row_key(row)
+            if live_query.rows.get(key) != row:
+                live_query.rows[key] = row
+                changed.append(row)
+        return changed
+
+    def stats(self) -> dict:
+        with self.lock:
+            queries = [
+                {"key": live_query.key, "mode": live_query.mode, "subscribers": len(live_query.subscribers),
+                 "rows": len(live_query.rows), "recompute_queued": live_query.scheduled}
+                for live_query in self.queries.values()
+            ]
+        return {
+            "worker_pid": os.getpid(),
+            "listening": self._thread is not None and self._thread.is_alive(),
+            "notifications": self.notifications,
+            "workers": LIVE_WORKERS,
+            "recomputes": dict(self.recomputes),
+            "queries": queries
+        }
+
+
+live_hub = LiveHub()
@@ -1,15 +1,112 @@
-from fastapi import FastAPI, Depends, HTTPException
-from database import get_db_connection, release_db_connection
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from database import (
+    get_db_connection, get_read_connection, release_db_connection, read_connection, replica_status,
+    pool_stats, close_pool
+)
 from psycopg2.extras import RealDictCursor
 from psycopg2 import sql
 from typing import Any
-from querybuilder import QueryBuilder  # <--- NOVO IMPORT
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from geo import query_delivery_heatmap
+from rollups import query_top_products, query_attach_rates
+from customer_metrics import query_rfm_segments, query_cohorts
+from analytics import flexible_query_key, flexible_query_shape, execute_flexible_query, reference_key, fetch_reference
+from singleflight import query_flight, SingleFlightTimeout
+from warmer import cache_warmer, dashboard_query_shapes
+from live import live_hub
+from columnar import columnar_cache, COLUMNAR_ENABLED
+from rollup_scheduler import rollup_scheduler, refresh_rollups_and_metrics, ROLLUP_SCHEDULER_ENABLED
+from duckdb_engine import duckdb_engine, export_snapshot
+from fanout import fanout_executor
+from dimensions import dimension_cache
+from startup import startup_state
+from tracing import TRACING_ENABLED, start_trace, finish_trace, export_trace, span
+from workload import WORKLOAD_ISOLATION, WorkloadRejected, open_ticket, close_ticket, assign_class, workload_stats
+from ingest import sales_ingestor, IngestQueueFull, INGEST_ENQUEUE_TIMEOUT
+from cache import result_cache, serialize, make_key, ANALYTICS_CACHE_TTL, REFERENCE_CACHE_TTL
+from pydantic import BaseModel, ValidationError
+from typing import List, Dict, Any, Optional, Union
+from datetime import date, datetime
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import psycopg2
+import asyncio
+import os
+
+WARMER_ENABLED = os.getenv("WARMER_ENABLED", "1") == "1"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pool, aquecimento e pré-carga em segundo plano: /readyz só libera depois.
+    startup_state.start()
+    # Só um worker por host fica com o warmer (lock de arquivo).
+    if WARMER_ENABLED and cache_warmer.start():
+        print("Aquecimento do cache iniciado neste worker.")
+    # Um worker carrega/atualiza a cópia colunar; os demais só leem os arquivos.
+    if COLUMNAR_ENABLED and columnar_cache.start():
+        print("Cópia colunar de sales sendo carregada neste worker.")
+    # Um worker por host agenda o refresh dos rollups e das métricas de clientes.
+    if ROLLUP_SCHEDULER_ENABLED and rollup_scheduler.start():
+        print("Refresh agendado dos rollups iniciado neste worker.")
+    sales_ingestor.start()
+
+    yield
+
+    await sales_ingestor.stop()
+    startup_state.stop()
+    cache_warmer.stop()
+    live_hub.stop()
+    columnar_cache.stop()
+    rollup_scheduler.stop()
+    close_pool()
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+def workload_rejected_response(rejected: WorkloadRejected) -> JSONResponse:
+    return JSONResponse(
+        status_code=503, content={"detail": str(rejected)},
+        headers={"Retry-After": str(rejected.retry_after), "X-Workload-Class": rejected.workload_class.name}
+    )
+
+@app.middleware("http")
+async def isolate_workloads(request: Request, call_next):
+    """
+    Ticket de classe de carga (padrão WORKLOAD_DEFAULT_CLASS; os endpoints podem
+    reclassificar) para a admissão em database.get_read_connection. Uma recusa
+    vira 503 com Retry-After, mesmo que o endpoint a tenha convertido em 500.
+    """
+    if not WORKLOAD_ISOLATION:
+        return await call_next(request)
+    ticket, token = open_ticket()
+    try:
+        response = await call_next(request)
+    except WorkloadRejected as rejected:
+        return workload_rejected_response(rejected)
+    finally:
+        close_ticket(token)
+    if ticket.rejected is not None:
+        return workload_rejected_response(ticket.rejected)
+    response.headers["X-Workload-Class"] = ticket.workload_class.name
+    return response
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Abre o Trace da requisição e devolve o header Server-Timing."""
+    if not TRACING_ENABLED:
+        return await call_next(request)
+    trace, token = start_trace(f"{request.method} {request.url.path}")
+    try:
+        response = await call_next(request)
+    finally:
+        finish_trace(trace, token)
+    trace.attributes["http.status_code"] = response.status_code
+    response.headers["Server-Timing"] = trace.server_timing()
+    # Permite ver o Server-Timing no DevTools a partir do frontend (outra origem).
+    response.headers["Timing-Allow-Origin"] = "*"
+    if trace.should_export():
+        await run_in_threadpool(export_trace, trace)
+    return response
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,11 +121,82 @@ class GroupByItem(BaseModel):
     granularity: Optional[str] = None 
 
 class QueryRequest(BaseModel):
-    metric: Dict[str, str]
+    metric: Dict[str, Any]
     group_by: List[GroupByItem] = []
     filters: List[Dict[str, Any]] = []
     order_by: Optional[str] = "metric_result DESC"
     limit: int = 100
+    compare_to: Optional[Union[str, Dict[str, float]]] = None
+    grouping: Optional[str] = None
+    grouping_sets: Optional[List[List[str]]] = None
+    enrich: bool = False
+
+class IngestItem(BaseModel):
+    item_id: int
+    option_group_id: Optional[int] = None
+    quantity: float = 1
+    additional_price: float = 0
+    price: float = 0
+    amount: float = 1
+
+class IngestProduct(BaseModel):
+    product_id: int
+    quantity: float
+    base_price: float
+    total_price: float
+    items: List[IngestItem] = []
+
+class IngestAddress(BaseModel):
+    street: Optional[str] = None
+    number: Optional[str] = None
+    complement: Optional[str] = None
+    neighborhood: Optional[str] = None
+    city: Optional[str] = None
+    state: Optional[str] = None
+    postal_code: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+
+class IngestDelivery(BaseModel):
+    courier_name: Optional[str] = None
+    courier_phone: Optional[str] = None
+    courier_type: Optional[str] = None
+    delivery_type: Optional[str] = None
+    status: Optional[str] = None
+    delivery_fee: Optional[float] = None
+    courier_fee: Optional[float] = None
+    address: Optional[IngestAddress] = None
+
+class IngestPayment(BaseModel):
+    type: str
+    value: float
+
+class IngestSale(BaseModel):
+    """Mesmo formato de generate_single_sale (generate_data.py)."""
+    store_id: int
+    customer_id: Optional[int] = None
+    customer_name: Optional[str] = None
+    channel_id: int
+    created_at: datetime
+    status: str = "COMPLETED"
+    total_items_value: float
+    discount: float = 0
+    discount_reason: Optional[str] = None
+    increase: float = 0
+    delivery_fee: float = 0
+    service_tax: float = 0
+    total_amount: float
+    value_paid: float = 0
+    production_sec: Optional[int] = None
+    delivery_sec: Optional[int] = None
+    people_qty: Optional[int] = None
+    origin: str = "POS"
+    products: List[IngestProduct] = []
+    delivery: Optional[IngestDelivery] = None
+    payments: List[IngestPayment] = []
+
+class IngestBatch(BaseModel):
+    sales: List[IngestSale]
 
 def get_db():
     conn = None
@@ -38,12 +206,76 @@ def get_db():
     finally:
         release_db_connection(conn)
 
+def get_read_db():
+    """Conexão para endpoints somente leitura (réplica quando disponível)."""
+    conn = None
+    try:
+        conn = get_read_connection()
+        yield conn
+    finally:
+        release_db_connection(conn)
+
+def cached_json_response(key: str, ttl: int, compute) -> Response:
+    """
+    Resposta JSON servida do cache compartilhado entre workers. No miss, pega uma
+    conexão de leitura, roda `compute(conn)` e guarda os bytes já serializados;
+    misses concorrentes da mesma chave são coalescidos em uma execução
+    (X-Cache: COALESCED para quem recebeu o resultado de outra requisição).
+    Quem espera demais pela execução em voo, ou cujo líder foi recusado na
+    admissão da classe de carga, recebe 503 com Retry-After.
+    """
+    with span("cache"):
+        body = result_cache.get(key)
+    cache_status = "HIT"
+    if body is None:
+        cache_status = "MISS"
+
+        def load() -> bytes:
+            with read_connection() as conn:
+                loaded = serialize(compute(conn))
+            result_cache.set(key, loaded, ttl)
+            return loaded
+
+        # Requisições idênticas simultâneas esperam uma única execução.
+        try:
+            body, coalesced = query_flight.do(key, load)
+        except SingleFlightTimeout as timeout:
+            return JSONResponse(
+                status_code=503, content={"detail": str(timeout)},
+                headers={"Retry-After": str(timeout.retry_after), "X-Cache": "TIMEOUT"}
+            )
+        except WorkloadRejected as rejected:
+            # Também para quem foi coalescido em um líder recusado na admissão:
+            # o ticket dele não tem a recusa e o endpoint a converteria em 500.
+            return workload_rejected_response(rejected)
+        if coalesced:
+            cache_status = "COALESCED"
+    return Response(content=body, media_type="application/json", headers={"X-Cache": cache_status})
+
+def reference_response(name: str) -> Response:
+    return cached_json_response(
+        reference_key(name), REFERENCE_CACHE_TTL, lambda conn: fetch_reference(conn, name)
+    )
+
 @app.get("/")
 def read_root():
     return {"message": "API de Analytics para Restaurantes Rodando!"}
 
+@app.get("/healthz")
+def healthz():
+    """Liveness: o processo responde (não toca no banco)."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: 200 só depois do pool aquecido e dos caches pré-carregados."""
+    status = startup_state.status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content={"data": status, "status": "starting"})
+    return {"data": status, "status": "ok"}
+
 @app.get("/api/v1/metrics/vendas_e_lojas")
-def get_sales_and_stores_count(conn: Any = Depends(get_db)):
+def get_sales_and_stores_count(conn: Any = Depends(get_read_db)):
     """Endpoint para retornar a contagem de vendas e lojas."""
     try:
         cursor = conn.cursor()
@@ -67,7 +299,7 @@ def get_sales_and_stores_count(conn: Any = Depends(get_db)):
 
 
 @app.get("/api/v1/analytics/tabelas")
-def get_all_tables_count(conn: Any = Depends(get_db)):
+def get_all_tables_count(conn: Any = Depends(get_read_db)):
     """Retorna a contagem de registros de todas as tabelas do banco de dados."""
     try:
         cursor = conn.cursor(cursor_factory=RealDictCursor)
@@ -97,7 +329,7 @@ def get_all_tables_count(conn: Any = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
     
 @app.get("/api/v1/analytics/vendas")
-def get_monthly_sales(conn: Any = Depends(get_db)):
+def get_monthly_sales(conn: Any = Depends(get_read_db)):
     """
     Retorna o total de vendas (total_amount) agrupado por mês e ano.
     Ideal para gráficos de série temporal.
@@ -125,26 +357,25 @@ def get_monthly_sales(conn: Any = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
 
 @app.post("/api/v1/analytics/query")
-def run_flexible_query(request: QueryRequest, conn: Any = Depends(get_db)):
-    """Endpoint flexível para construir e executar queries de agregação."""
+def run_flexible_query(request: QueryRequest):
+    """
+    Endpoint flexível para construir e executar queries de agregação. Consultas
+    com o formato de um widget registrado rodam na classe "dashboard", à frente
+    da fila (prioridade "high"); as demais (QueryBuilder, clientes externos) na
+    classe "adhoc".
+    """
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        builder = QueryBuilder()
-        
-        query, params = builder.build_analytics_query(
-            metric=request.metric,
-            group_by=request.group_by,
-            filters=request.filters,
-            order_by=request.order_by,
-            limit=request.limit
+        payload = request.model_dump()
+        is_widget = flexible_query_shape(payload) in dashboard_query_shapes()
+        if is_widget:
+            assign_class("dashboard", "high")
+        else:
+            assign_class("adhoc")
+        return cached_json_response(
+            flexible_query_key(payload), ANALYTICS_CACHE_TTL,
+            lambda conn: execute_flexible_query(conn, payload)
         )
         
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        
-        return {"data": results, "status": "ok"}
-        
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except psycopg2.Error as e:
@@ -154,8 +385,73 @@ def run_flexible_query(request: QueryRequest, conn: Any = Depends(get_db)):
         print(f"ERRO INTERNO INESPERADO: {e}")
         raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
     
+@app.get("/api/v1/analytics/live")
+async def stream_live_query(query: str, http_request: Request):
+    """
+    Server-Sent Events com o resultado de uma QueryRequest (JSON em `query`):
+    um evento "snapshot" e depois eventos "delta" a cada lote de vendas novas.
+    """
+    try:
+        payload = QueryRequest.model_validate_json(query).model_dump()
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    queue = asyncio.Queue()
+    try:
+        live_query = await run_in_threadpool(live_hub.subscribe, payload, asyncio.get_running_loop(), queue)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Erro no Banco de Dados: {str(e)}")
+    
+    return StreamingResponse(
+        live_hub.stream(live_query, queue, http_request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/v1/analytics/live/stats")
+def get_live_stats():
+    """Consultas ao vivo assinadas neste worker, avisos recebidos e recálculos por modo."""
+    return {"data": live_hub.stats(), "status": "ok"}
+    
+@app.post("/api/v1/ingest/sales", status_code=202)
+async def ingest_sales(batch: IngestBatch, response: Response, wait: bool = True):
+    """
+    Recebe um lote de vendas do PDV. Com wait=true (padrão) responde depois do
+    COMMIT, com os ids gerados; com wait=false responde assim que o lote entra na fila.
+    Fila cheia: 503 com Retry-After.
+    """
+    if not batch.sales:
+        raise HTTPException(status_code=400, detail="Lote sem vendas.")
+    try:
+        future = await sales_ingestor.submit([sale.model_dump() for sale in batch.sales])
+        if not wait:
+            sales_ingestor.detach(future)
+            return {"data": {"accepted": len(batch.sales)}, "status": "ok"}
+        sale_ids = await future
+        response.status_code = 201
+        return {"data": {"accepted": len(sale_ids), "sale_ids": sale_ids}, "status": "ok"}
+        
+    except IngestQueueFull:
+        raise HTTPException(
+            status_code=503, detail="Fila de ingestão cheia, tente novamente.",
+            headers={"Retry-After": str(max(1, int(INGEST_ENQUEUE_TIMEOUT)))}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Erro no Banco de Dados: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
+
+@app.get("/api/v1/ingest/stats")
+def get_ingest_stats():
+    """Vendas aceitas, gravadas e recusadas, flushes e fila deste worker."""
+    return {"data": sales_ingestor.stats(), "status": "ok"}
+
 @app.get("/api/v1/sales/all")
-def get_all_sales(page: int = 1, page_size: int = 100, conn: Any = Depends(get_db)):
+def get_all_sales(page: int = 1, page_size: int = 100, conn: Any = Depends(get_read_db)):
     """Retorna registros da tabela sales com paginação."""
     try:
         cursor = conn.cursor(cursor_factory=RealDictCursor)
@@ -181,7 +477,7 @@ def get_all_sales(page: int = 1, page_size: int = 100, conn: Any = Depends(get_d
         raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
     
 @app.get("/api/v1/customers/all")
-def get_all_customers(page: int = 1, page_size: int = 100, conn: Any = Depends(get_db)):
+def get_all_customers(page: int = 1, page_size: int = 100, conn: Any = Depends(get_read_db)):
     """Retorna registros da tabela sales com paginação."""
     try:
         cursor = conn.cursor(cursor_factory=RealDictCursor)
@@ -207,96 +503,330 @@ def get_all_customers(page: int = 1, page_size: int = 100, conn: Any = Depends(g
         raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
 
 @app.get("/api/v1/reference/brands") 
-def get_brands(conn: Any = Depends(get_db)):
+def get_brands():
    "Retorna as marcas"
    try:
-       cursor = conn.cursor(cursor_factory=RealDictCursor)
-       cursor.execute("SELECT * FROM brands;")
-       return {"data": cursor.fetchall(),"status":"ok"}
+       return reference_response("brands")
    except psycopg2.Error as e:
        raise HTTPException(status_code=500, detail=str(e))
    
 @app.get("/api/v1/reference/sub_brands") 
-def get_sub_brands(conn: Any = Depends(get_db)):
+def get_sub_brands():
    "Retorna as sub marcas"
    try:
-       cursor = conn.cursor(cursor_factory=RealDictCursor)
-       cursor.execute("SELECT * FROM sub_brands;")
-       return {"data": cursor.fetchall(),"status":"ok"}
+       return reference_response("sub_brands")
    except psycopg2.Error as e:
        raise HTTPException(status_code=500, detail=str(e))
    
 @app.get("/api/v1/reference/stores") 
-def get_stores(conn: Any = Depends(get_db)):
+def get_stores():
    "Retorna as lojas"
    try:
-       cursor = conn.cursor(cursor_factory=RealDictCursor)
-       cursor.execute("SELECT * FROM stores;")
-       return {"data": cursor.fetchall(),"status":"ok"}
+       return reference_response("stores")
    except psycopg2.Error as e:
        raise HTTPException(status_code=500, detail=str(e))
    
 @app.get("/api/v1/reference/channels") 
-def get_channels(conn: Any = Depends(get_db)):
+def get_channels():
    "Retorna os canais"
    try:
-       cursor = conn.cursor(cursor_factory=RealDictCursor)
-       cursor.execute("SELECT * FROM channels;")
-       return {"data": cursor.fetchall(),"status":"ok"}
+       return reference_response("channels")
    except psycopg2.Error as e:
        raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/v1/analytics/top_products")
-def get_top_products(conn: Any = Depends(get_db)):
+def get_top_products(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    store_id: Optional[List[int]] = Query(None),
+    channel_id: Optional[List[int]] = Query(None),
+    rank_by: str = "quantity",
+    limit: int = 5
+):
     """
-    Retorna os 5 produtos mais vendidos (por quantidade total vendida).
-    Este endpoint usa uma query SQL otimizada com JOINs.
+    Retorna os N produtos mais vendidos (por quantidade ou faturamento).
+    Servido pelo rollup diário product_sales_daily; o ranking histórico sem
+    filtros vem do sketch de heavy hitters. Não lê as linhas de product_sales.
     """
+    params = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "store_ids": store_id,
+        "channel_ids": channel_id,
+        "rank_by": rank_by,
+        "limit": limit
+    }
+
+    def compute(conn):
+        results, method = query_top_products(conn, **params)
+        return {"data": results, "method": method, "status": "ok"}
+
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        return cached_json_response(
+            make_key("analytics", {"endpoint": "top_products", **params}), ANALYTICS_CACHE_TTL, compute
+        )
         
-        sql_query = """
-            SELECT
-                p.name AS product_name,
-                SUM(ps.quantity) AS total_quantity_sold
-            FROM product_sales ps
-            JOIN products p ON ps.product_id = p.id
-            JOIN sales s ON ps.sale_id = s.id
-            WHERE
-                s.sale_status_desc = 'COMPLETED'
-            GROUP BY
-                p.name
-            ORDER BY
-                total_quantity_sold DESC
-            LIMIT 5;
-        """
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Erro no Banco de Dados: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
+
+@app.get("/api/v1/analytics/attach_rates")
+def get_attach_rates(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    store_id: Optional[List[int]] = Query(None),
+    channel_id: Optional[List[int]] = Query(None),
+    product_id: Optional[List[int]] = Query(None),
+    item_id: Optional[List[int]] = Query(None),
+    by_product: bool = True,
+    order_by: str = "attach_rate",
+    limit: int = 50
+):
+    """
+    Retorna a taxa de anexação e a receita por add-on (itens de customização),
+    por item x produto ou só por item. Servido pelos rollups diários.
+    """
+    params = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "store_ids": store_id,
+        "channel_ids": channel_id,
+        "product_ids": product_id,
+        "item_ids": item_id,
+        "by_product": by_product,
+        "order_by": order_by,
+        "limit": limit
+    }
+
+    def compute(conn):
+        return {"data": query_attach_rates(conn, **params), "status": "ok"}
+
+    try:
+        return cached_json_response(
+            make_key("analytics", {"endpoint": "attach_rates", **params}), ANALYTICS_CACHE_TTL, compute
+        )
         
-        cursor.execute(sql_query)
-        results = cursor.fetchall()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Erro no Banco de Dados: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
+
+@app.get("/api/v1/analytics/geo/heatmap")
+def get_delivery_heatmap(
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    zoom: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    store_id: Optional[List[int]] = Query(None),
+    channel_id: Optional[List[int]] = Query(None),
+    status: Optional[str] = "COMPLETED",
+    metric: str = "deliveries"
+):
+    """
+    Entregas, receita e distância média (loja -> endereço) por célula da grade
+    dentro do bounding box, na resolução adequada ao zoom do mapa.
+    """
+    params = {
+        "south": south,
+        "west": west,
+        "north": north,
+        "east": east,
+        "zoom": zoom,
+        "start_date": start_date,
+        "end_date": end_date,
+        "store_ids": store_id,
+        "channel_ids": channel_id,
+        "status": status,
+        "metric": metric
+    }
+
+    def compute(conn):
+        return {"data": query_delivery_heatmap(conn, **params), "status": "ok"}
+
+    try:
+        return cached_json_response(
+            make_key("analytics", {"endpoint": "geo_heatmap", **params}), ANALYTICS_CACHE_TTL, compute
+        )
         
-        return {"data": results, "status": "ok"}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Erro no Banco de Dados: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
+
+@app.get("/api/v1/customers/rfm")
+def get_customer_rfm(
+    as_of: Optional[datetime] = None,
+    store_id: Optional[List[int]] = Query(None),
+    channel_id: Optional[List[int]] = Query(None),
+    segment: Optional[str] = None,
+    limit: int = 100
+):
+    """
+    Segmentos RFM (recência, frequência, valor) lidos de customer_metrics.
+    store_id/channel_id filtram pela loja/canal favorito do cliente.
+    """
+    params = {
+        "as_of": as_of,
+        "store_ids": store_id,
+        "channel_ids": channel_id,
+        "segment": segment,
+        "limit": limit
+    }
+
+    def compute(conn):
+        return {"data": query_rfm_segments(conn, **params), "status": "ok"}
+
+    try:
+        return cached_json_response(
+            make_key("analytics", {"endpoint": "customer_rfm", **params}), ANALYTICS_CACHE_TTL, compute
+        )
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except psycopg2.Error as e:
         raise HTTPException(status_code=500, detail=f"Erro no Banco de Dados: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
+
+@app.get("/api/v1/customers/cohorts")
+def get_customer_cohorts(
+    start_month: Optional[date] = None,
+    end_month: Optional[date] = None,
+    store_id: Optional[List[int]] = Query(None),
+    channel_id: Optional[List[int]] = Query(None),
+    max_periods: int = 12
+):
+    """Matriz de coortes mensais (retenção, pedidos e receita por mês desde a primeira compra)."""
+    params = {
+        "start_month": start_month,
+        "end_month": end_month,
+        "store_ids": store_id,
+        "channel_ids": channel_id,
+        "max_periods": max_periods
+    }
+
+    def compute(conn):
+        return {"data": query_cohorts(conn, **params), "status": "ok"}
+
+    try:
+        return cached_json_response(
+            make_key("analytics", {"endpoint": "customer_cohorts", **params}), ANALYTICS_CACHE_TTL, compute
+        )
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Erro no Banco de Dados: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
+
+@app.post("/api/v1/rollups/refresh")
+def refresh_rollups(conn: Any = Depends(get_db)):
+    """Atualiza incrementalmente os rollups com as vendas novas (e descarta o cache de analytics se algo mudou)."""
+    try:
+        return {"data": refresh_rollups_and_metrics(conn), "status": "ok"}
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Erro no Banco de Dados: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
+
+@app.get("/api/v1/rollups/status")
+def get_rollups_status():
+    """Agendador de refresh dos rollups neste worker (última rodada e erro)."""
+    return {"data": rollup_scheduler.status(), "status": "ok"}
+
+@app.get("/api/v1/cache/stats")
+def get_cache_stats():
+    """Entradas e bytes do cache compartilhado e hits/misses deste worker."""
+    return {"data": result_cache.stats(), "status": "ok"}
+
+@app.get("/api/v1/dimensions/stats")
+def get_dimension_stats():
+    """Tamanho do dicionário de dimensões deste worker (usado por enrich)."""
+    return {"data": dimension_cache.stats(), "status": "ok"}
+
+@app.get("/api/v1/cache/warmer")
+def get_warmer_status():
+    """Estado do aquecimento do cache (última rodada, último id de venda visto)."""
+    return {"data": cache_warmer.status(), "status": "ok"}
+
+@app.post("/api/v1/cache/warm")
+def warm_cache():
+    """Executa uma rodada de aquecimento agora."""
+    try:
+        return {"data": cache_warmer.warm_once(), "status": "ok"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
+
+@app.get("/api/v1/analytics/columnar/stats")
+def get_columnar_stats():
+    """Linhas, watermark, memória e consultas respondidas pela cópia colunar de sales."""
+    return {"data": columnar_cache.stats(), "status": "ok"}
+
+@app.post("/api/v1/olap/snapshot")
+def create_olap_snapshot():
+    """Exporta as tabelas fato para um snapshot Parquet novo (motor DuckDB)."""
+    try:
+        return {"data": export_snapshot(), "status": "ok"}
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Erro no Banco de Dados: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro Interno: {str(e)}")
+
+@app.get("/api/v1/olap/status")
+def get_olap_status():
+    """Snapshot atual, consultas roteadas para DuckDB/Postgres e motivos, neste worker."""
+    return {"data": duckdb_engine.status(), "status": "ok"}
+
+@app.get("/api/v1/analytics/fanout/stats")
+def get_fanout_stats():
+    """Consultas divididas em fatias, conexões usadas e motivos para não dividir, neste worker."""
+    return {"data": fanout_executor.status(), "status": "ok"}
+
+@app.get("/api/v1/analytics/inflight")
+def get_inflight_stats():
+    """Contadores de coalescência (execuções, requisições coalescidas, timeouts) deste worker."""
+    return {"data": query_flight.stats(), "status": "ok"}
+
+@app.get("/api/v1/db/pool_stats")
+def get_pool_stats():
+    """Conexões obtidas, tempo de espera e pools esgotados neste worker."""
+    return {"data": pool_stats(), "status": "ok"}
+
+@app.get("/api/v1/db/workloads")
+def get_workloads():
+    """Vagas em uso, fila, esperas e recusas por classe de carga neste worker."""
+    return {"data": workload_stats(), "status": "ok"}
+
+@app.get("/api/v1/db/replicas")
+def get_replicas():
+    """Estado das réplicas de leitura (lag, conexões em uso, indisponibilidade)."""
+    return {"data": replica_status(), "status": "ok"}
     
 @app.get("/api/v1/reference/products") 
-def get_products(conn: Any = Depends(get_db)):
+def get_products():
    "Retorna os produtos"
    try:
-       cursor = conn.cursor(cursor_factory=RealDictCursor)
-       cursor.execute("SELECT id, name FROM products;")
-       return {"data": cursor.fetchall(),"status":"ok"}
+       return reference_response("products")
    except psycopg2.Error as e:
        raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/v1/reference/customers") 
-def get_customers(conn: Any = Depends(get_db)):
+def get_customers():
    "Retorna os clientes"
    try:
-       cursor = conn.cursor(cursor_factory=RealDictCursor)
-       cursor.execute("SELECT id, customer_name FROM customers;")
-       return {"data": cursor.fetchall(),"status":"ok"}
+       return reference_response("customers")
    except psycopg2.Error as e:
        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""
+Períodos relativos dos dashboards, calculados como o frontend calcula.
+
+O frontend monta os filtros de data com meia-noite no fuso do navegador e os
+envia com Date.toISOString() (UTC). Quem precisa reproduzir essas requisições
+(aquecimento do cache, benchmarks) usa estas funções com o mesmo fuso
+(DASHBOARD_TIMEZONE) para gerar exatamente os mesmos valores.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+from zoneinfo import ZoneInfo
+
+DASHBOARD_TIMEZONE = os.getenv("DASHBOARD_TIMEZONE", "America/Sao_Paulo")
+
+
+def period_bounds(period: str, now: Optional[datetime] = None) -> tuple:
+    """Início e fim do período, como getFiltrosDeData nos componentes do frontend."""
+    now = now or datetime.now(ZoneInfo(DASHBOARD_TIMEZONE))
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    end_of = lambda day: day.replace(hour=23, minute=59, second=59)
+
+    if period == "hoje":
+        return today, end_of(today)
+    if period == "esta_semana":
+        # Semana começando no domingo (Date.getDay() == 0).
+        start = today - timedelta(days=(today.weekday() + 1) % 7)
+        return start, end_of(start + timedelta(days=6))
+    if period == "semana_passada":
+        start = today - timedelta(days=(today.weekday() + 1) % 7 + 7)
+        return start, end_of(start + timedelta(days=6))
+    if period == "mes_passado":
+        first_this_month = today.replace(day=1)
+        last_previous = first_this_month - timedelta(days=1)
+        return last_previous.replace(day=1), end_of(last_previous)
+    if period == "este_mes":
+        first = today.replace(day=1)
+        first_next = (first + timedelta(days=32)).replace(day=1)
+        return first, end_of(first_next - timedelta(days=1))
+    raise ValueError(f"Período desconhecido: {period}")
+
+
+def to_iso_string(moment: datetime) -> str:
+    """Formato de Date.toISOString(): UTC com milissegundos e sufixo Z."""
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def resolve_request(value: Any, now: Optional[datetime] = None) -> Any:
+    """Substitui os marcadores $period_start/$period_end pelas datas atuais."""
+    if isinstance(value, dict):
+        if len(value) == 1 and "$period_start" in value:
+            return to_iso_string(period_bounds(value["$period_start"], now)[0])
+        if len(value) == 1 and "$period_end" in value:
+            return to_iso_string(period_bounds(value["$period_end"], now)[1])
+        return {key: resolve_request(item, now) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_request(item, now) for item in value]
+    return value
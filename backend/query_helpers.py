@@ -0,0 +1,56 @@
+"""
+Regras do SQL gerado pelo QueryBuilder reproduzidas em Python.
+
+Usadas pelos motores que planejam ou montam o resultado fora do SQL exato
+(cópia colunar, DuckDB, fan-out, dashboards ao vivo) para ver a mesma janela
+de created_at e devolver as mesmas linhas, na mesma ordem.
+"""
+from typing import Any, Dict, List, Optional
+
+from querybuilder import QueryBuilder
+
+
+def created_at_window(builder: QueryBuilder, filters: List[Dict[str, Any]]) -> tuple:
+    """(início, fim) da janela de sales.created_at nos filtros; None quando aberta."""
+    start = end = None
+    for item in filters:
+        if builder.resolve_column(item['column']) != ('sales', 'created_at'):
+            continue
+        op, value = item.get('op'), item.get('value')
+        if op in ('>=', '>'):
+            start = builder.parse_timestamp(value)
+        elif op in ('<=', '<'):
+            end = builder.parse_timestamp(value)
+        elif op == '=':
+            start = end = builder.parse_timestamp(value)
+        elif op == 'BETWEEN' and isinstance(value, (list, tuple)) and len(value) == 2:
+            start, end = builder.parse_timestamp(value[0]), builder.parse_timestamp(value[1])
+    return start, end
+
+
+def order_rows(rows: List[dict], order_by: Optional[str], group_columns: List[str], date_grouped: bool,
+               limit: Optional[int]) -> Optional[List[dict]]:
+    """
+    ORDER BY/LIMIT com as regras de _build_order_by_clause (DESC por padrão,
+    NULLs primeiro no DESC). group_columns são os agrupamentos sem
+    granularidade. Devolve None quando a coluna é permitida mas não está no
+    SELECT (o Postgres falharia; quem chamou segue para o SQL exato).
+    """
+    if not order_by:
+        column, descending = (QueryBuilder.DATE_GROUP_ALIAS, False) if date_grouped else ("metric_result", True)
+    else:
+        parts = order_by.strip().split()
+        if len(parts) not in (1, 2):
+            raise ValueError(f"Formato de 'order_by' inválido: {order_by}")
+        allowed = [QueryBuilder.DATE_GROUP_ALIAS, "metric_result"] + list(group_columns)
+        if parts[0] not in allowed:
+            raise ValueError(f"Coluna de 'order_by' não permitida: {parts[0]}. Permitidas: {allowed}")
+        direction = parts[1].upper() if len(parts) == 2 else "DESC"
+        if direction not in ("ASC", "DESC"):
+            raise ValueError(f"Direção de 'order_by' inválida: {direction}")
+        column, descending = parts[0], direction == "DESC"
+    if column == QueryBuilder.DATE_GROUP_ALIAS and not date_grouped:
+        return None
+    rows.sort(key=lambda row: (row[column] is None, row[column] if row[column] is not None else 0),
+              reverse=descending)
+    return rows if limit is None else rows[:limit]
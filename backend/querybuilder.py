@@ -1,11 +1,69 @@
 from psycopg2 import sql
 from typing import List, Dict, Any, Optional, Union
+from datetime import datetime, timedelta
+from itertools import combinations
 import logging
+import re
+
+from tracing import span
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def render_duckdb(composable: sql.Composable) -> str:
+    """
+    Converte um sql.Composed em texto para o DuckDB, sem conexão com o Postgres:
+    identificadores entre aspas duplas, literais inline e %s vira '?'.
+    """
+    if isinstance(composable, sql.Composed):
+        return "".join(render_duckdb(part) for part in composable.seq)
+    if isinstance(composable, sql.SQL):
+        return composable.string.replace("%s", "?").replace("%%", "%")
+    if isinstance(composable, sql.Identifier):
+        return ".".join('"' + name.replace('"', '""') + '"' for name in composable.strings)
+    if isinstance(composable, sql.Literal):
+        value = composable.wrapped
+        if value is None:
+            return "NULL"
+        if isinstance(value, bool):
+            return "TRUE" if value else "FALSE"
+        if isinstance(value, (int, float)):
+            return repr(value)
+        return "'" + str(value).replace("'", "''") + "'"
+    raise ValueError(f"Trecho de SQL não suportado no DuckDB: {composable!r}")
+
+
+def match_dimension_value(attribute: Any, op: str, value: Any) -> bool:
+    """Aplica um operador de filtro a um atributo em memória, com a semântica do SQL (NULL não casa)."""
+    if op == "IS NULL":
+        return attribute is None
+    if op == "IS NOT NULL":
+        return attribute is not None
+    if attribute is None:
+        return False
+    if op in ("IN", "NOT IN"):
+        if not isinstance(value, (list, tuple)):
+            raise ValueError(f"{op} requer uma lista de valores. Recebido: {value}")
+        return (attribute in value) == (op == "IN")
+    if op == "BETWEEN":
+        if not isinstance(value, (list, tuple)) or len(value) != 2:
+            raise ValueError(f"BETWEEN requer uma lista de 2 valores. Recebido: {value}")
+        return value[0] <= attribute <= value[1]
+    if op in ("LIKE", "ILIKE"):
+        pattern = "".join(
+            ".*" if char == "%" else "." if char == "_" else re.escape(char) for char in str(value)
+        )
+        flags = re.IGNORECASE | re.DOTALL if op == "ILIKE" else re.DOTALL
+        return re.fullmatch(pattern, str(attribute), flags) is not None
+    comparisons = {
+        "=": lambda a, b: a == b, "!=": lambda a, b: a != b, "<>": lambda a, b: a != b,
+        ">": lambda a, b: a > b, "<": lambda a, b: a < b, ">=": lambda a, b: a >= b, "<=": lambda a, b: a <= b
+    }
+    if op not in comparisons:
+        raise ValueError(f"Operador não permitido em atributo de dimensão: {op}")
+    return comparisons[op](attribute, value)
+
+
 class QueryBuilder:
     """
     Query Builder flexível e adaptativo para construir queries SQL de agregação.
@@ -19,6 +77,17 @@ class QueryBuilder:
     """
     
     DATE_GROUP_ALIAS = "date_group_field"
+    COMPARE_ALIAS = "cmp"
+    COMPARE_COLUMNS = ["metric_previous", "delta", "delta_pct"]
+    GROUPING_ID_ALIAS = "grouping_id"
+    GROUPING_MODES = ["rollup", "cube", "sets"]
+    MAX_CUBE_COLUMNS = 5
+    HISTOGRAM_BUCKET_ALIAS = "histogram_bucket"
+    MAX_HISTOGRAM_BUCKETS = 1000
+    PERCENTILE_SHORTCUTS = {"P50": 0.5, "P90": 0.9, "P95": 0.95, "P99": 0.99}
+    # Agregados parciais (partial=True), somados depois em Python (fanout.py).
+    PARTIAL_FUNCTIONS = ["SUM", "COUNT", "MIN", "MAX", "AVG", "COUNT DISTINCT"]
+    HLL_PRECISION = 11
     
     def __init__(self):
         """Inicializa o QueryBuilder com as configurações de segurança E o mapa de tabelas."""
@@ -30,7 +99,8 @@ class QueryBuilder:
             "PERIODO_DIA": "PERIODO_DIA" 
         }
         
-        self.ALLOWED_FUNCTIONS = ["SUM", "COUNT", "AVG", "MIN", "MAX", "COUNT DISTINCT"]
+        self.ALLOWED_FUNCTIONS = ["SUM", "COUNT", "AVG", "MIN", "MAX", "COUNT DISTINCT",
+                                  "P50", "P90", "P95", "P99", "PERCENTILE", "HISTOGRAM"]
         
         self.ALLOWED_DATE_GRANULARITIES = ["second", "minute", "hour", "day", "week", "month", "quarter", "year","day_of_week"]
 
@@ -41,6 +111,7 @@ class QueryBuilder:
             'product_sales': {
                 'alias': 'ps',
                 'on': sql.SQL("s.id = ps.sale_id"), 
+                'grain': 'product_sales',
                 'allowed_metric_cols': ['quantity', 'total_price'],
                 'allowed_group_by_cols': ['product_id'],
                 'allowed_filter_cols': ['product_id']
@@ -49,36 +120,88 @@ class QueryBuilder:
                 'alias': 'p',
                 'on': sql.SQL("ps.product_id = p.id"),
                 'depends_on': 'product_sales', 
+                'grain': 'product_sales',
                 'allowed_metric_cols': [],
                 'allowed_group_by_cols': ['name', 'category_id'], 
                 'allowed_filter_cols': ['name', 'category_id', 'id']
             },
+            'item_product_sales': {
+                'alias': 'ips',
+                'on': sql.SQL("ps.id = ips.product_sale_id"),
+                'depends_on': 'product_sales',
+                'grain': 'item_product_sales',
+                'allowed_metric_cols': ['quantity', 'additional_price', 'price', 'amount'],
+                'allowed_group_by_cols': ['item_id', 'option_group_id'],
+                'allowed_filter_cols': ['item_id', 'option_group_id']
+            },
+            'items': {
+                'alias': 'i',
+                'on': sql.SQL("ips.item_id = i.id"),
+                'depends_on': 'item_product_sales',
+                'grain': 'item_product_sales',
+                'allowed_metric_cols': [],
+                'allowed_group_by_cols': ['name', 'category_id'],
+                'allowed_filter_cols': ['name', 'category_id', 'id']
+            },
+            'option_groups': {
+                'alias': 'og',
+                'on': sql.SQL("ips.option_group_id = og.id"),
+                'depends_on': 'item_product_sales',
+                'grain': 'item_product_sales',
+                'allowed_metric_cols': [],
+                'allowed_group_by_cols': ['name'],
+                'allowed_filter_cols': ['name', 'id']
+            },
             'delivery_addresses': {
                 'alias': 'da',
                 'on': sql.SQL("s.id = da.sale_id"),
-                'allowed_metric_cols': [],
+                'grain': 'sales',
+                'allowed_metric_cols': ['distance_km'],
                 'allowed_group_by_cols': ['neighborhood', 'city', 'state'], 
-                'allowed_filter_cols': ['neighborhood', 'city', 'state']
+                'allowed_filter_cols': ['neighborhood', 'city', 'state', 'distance_km']
             },
             'customers': {
                 'alias': 'c',
                 'on': sql.SQL("s.customer_id = c.id"),
+                'grain': 'sales',
                 'allowed_metric_cols': [],
                 'allowed_group_by_cols': ['customer_name', 'email'],
                 'allowed_filter_cols': ['customer_name', 'email', 'id']
             }
         }
         
+        # Cadeia de tabelas fato: cada nível tem N linhas por linha do nível anterior.
+        # 'parent_key' liga a tabela ao 'id' do nível acima.
+        self.FACT_GRAINS = {
+            'sales': {'depth': 0, 'alias': 's'},
+            'product_sales': {'depth': 1, 'alias': 'ps', 'parent_key': 'sale_id'},
+            'item_product_sales': {'depth': 2, 'alias': 'ips', 'parent_key': 'product_sale_id'}
+        }
+        
         self.ALLOWED_METRIC_COLUMNS = {
             'sales': ["total_amount", "people_quantity", "id", "delivery_seconds",
-                      "total_discount", "service_tax_fee"]
+                      "production_seconds", "total_discount", "service_tax_fee"]
         }
         self.ALLOWED_GROUP_BY_COLUMNS = {
             'sales': ["channel_id", "store_id", "customer_id", "sale_status_desc", "created_at"]
         }
         self.ALLOWED_FILTER_COLUMNS = {
             'sales': ["channel_id", "store_id", "customer_id", "sale_status_desc", "created_at",
-                      "total_amount", "people_quantity", "id", "delivery_seconds"]
+                      "total_amount", "people_quantity", "id", "delivery_seconds",
+                      "production_seconds"]
+        }
+
+        # Atributos de dimensão filtráveis sem JOIN: o filtro é resolvido no
+        # dicionário de dimensões e vira '<key> IN (ids)' direto em sales.
+        self.DIMENSION_FILTERS = {
+            'stores': {
+                'key': 'store_id',
+                'columns': ['name', 'city', 'state', 'district', 'is_active', 'is_own', 'brand_id', 'sub_brand_id']
+            },
+            'channels': {
+                'key': 'channel_id',
+                'columns': ['name', 'type', 'brand_id']
+            }
         }
 
         for table_name, config in self.JOIN_MAP.items():
@@ -93,38 +216,135 @@ class QueryBuilder:
         group_by: List[Any] = [],
         filters: List[Union[Dict[str, Any], Any]] = [],
         order_by: Optional[str] = None,
-        limit: int = 100
+        limit: Optional[int] = 100,
+        compare_to: Optional[Union[str, Dict[str, Any]]] = None,
+        grouping: Optional[str] = None,
+        grouping_sets: Optional[List[List[str]]] = None,
+        partial: bool = False
     ) -> tuple:
         """
-        Constrói uma query SQL de agregação com JOINs dinâmicos.
+        Constrói uma query SQL de agregação com JOINs dinâmicos (limit=None: sem LIMIT).
+        
+        Com `compare_to` ('previous_period', 'previous_year' ou {'days': N, 'hours': N}),
+        a janela de created_at dos filtros e a janela de comparação são lidas no
+        mesmo scan; cada grupo traz metric_result, metric_previous, delta e delta_pct.
+        
+        Com `grouping` ('rollup', 'cube' ou 'sets' + `grouping_sets`), todos os níveis
+        de subtotal saem de um único GROUP BY GROUPING SETS, com colunas
+        grouping_<coluna> (1 = agregado nesse nível) e grouping_id.
+        
+        Métricas de distribuição: P50/P90/P95/P99, PERCENTILE (com 'percentile'
+        entre 0 e 1) usam percentile_cont exato; HISTOGRAM (com 'range' [min, max] e
+        'buckets') conta as linhas por faixa em histogram_bucket.
+        
+        Com `partial`, devolve agregados parciais mergeáveis, sem ORDER BY nem
+        LIMIT (o order_by só é validado): SUM/COUNT/MIN/MAX em metric_result, AVG
+        em metric_sum + metric_count e COUNT DISTINCT como registradores de um
+        HyperLogLog por grupo (hll_registers, hll_ranks).
         """
         
-        logger.info("=== Iniciando construção da query com JOINs ===")
-        logger.info(f"Metric: {metric}")
-        logger.info(f"Group By: {group_by}")
-        logger.info(f"Filters: {filters}")
+        logger.debug("Construindo query: metric=%s group_by=%s filters=%s", metric, group_by, filters)
+        
+        with span("validate"):
+            metric_dict = self._normalize_metric(metric)
+            normalized_group_by = self._normalize_group_by(group_by)
+            normalized_filters = self._normalize_filters(filters)
+            
+            self._validate_metric(metric_dict)
+            self._validate_columns(normalized_group_by, self.ALLOWED_GROUP_BY_COLUMNS, "agrupamento")
+            self._validate_columns(normalized_filters, self.ALLOWED_FILTER_COLUMNS, "filtro")
         
-        metric_dict = self._normalize_metric(metric)
-        normalized_group_by = self._normalize_group_by(group_by)
-        normalized_filters = self._normalize_filters(filters)
+        plan = self._plan_joins(metric_dict, normalized_group_by, normalized_filters)
+        plan['grouping_sets'] = self._resolve_grouping_sets(normalized_group_by, grouping, grouping_sets)
+        plan['histogram'] = self.get_histogram_spec(metric_dict)
+        if plan['histogram'] and plan['grouping_sets'] is not None:
+            raise ValueError("HISTOGRAM não pode ser combinado com grouping.")
+        if partial:
+            if metric_dict['func'].upper() not in self.PARTIAL_FUNCTIONS:
+                raise ValueError(f"Agregado parcial não suportado para {metric_dict['func']}.")
+            if compare_to or plan['grouping_sets'] is not None:
+                raise ValueError("Agregados parciais não combinam com compare_to nem grouping.")
+            plan['partial'] = True
         
-        self._validate_metric(metric_dict)
-        self._validate_columns(normalized_group_by, self.ALLOWED_GROUP_BY_COLUMNS, "agrupamento")
-        self._validate_columns(normalized_filters, self.ALLOWED_FILTER_COLUMNS, "filtro")
+        compare_params = []
+        if compare_to:
+            plan['compare'] = self._resolve_compare_windows(plan['direct_filters'], compare_to)
+            plan['direct_filters'] = plan['compare']['remaining_filters']
         
-        required_cols = self._get_required_columns(
-            metric_dict, normalized_group_by, normalized_filters
-        )
+        from_clause, from_params = self._build_from_clause(plan)
         
-        from_clause = self._build_from_clause(required_cols)
+        if compare_to:
+            compare_join, compare_params = self._build_compare_join(plan['compare'])
+            from_clause += compare_join
         
         select_clause, group_by_clause, group_by_fields = self._build_select_and_group_by(
-            metric_dict, normalized_group_by
+            metric_dict, normalized_group_by, plan
+        )
+        
+        where_clause, where_params = self._build_where_clause(plan['direct_filters'])
+        
+        semi_join_clause, semi_join_params = self._build_semi_join(plan)
+        if semi_join_clause is not None:
+            where_clause = sql.SQL("{where} AND {semi_join}").format(
+                where=where_clause, semi_join=semi_join_clause
+            )
+        
+        if compare_to:
+            window_clause, window_params = self._build_compare_where(plan['compare'])
+            where_clause = sql.SQL("{where} AND {windows}").format(
+                where=where_clause, windows=window_clause
+            )
+            semi_join_params += window_params
+        
+        params = from_params + compare_params + where_params + semi_join_params
+        
+        order_by_clause = self._build_order_by_clause(
+            order_by, normalized_group_by, bool(compare_to), plan['grouping_sets'] is not None,
+            plan['histogram'] is not None
         )
         
-        where_clause, params = self._build_where_clause(normalized_filters)
+        limit_clause = sql.SQL("LIMIT %s") if limit is not None else sql.SQL("")
+        limit_params = [limit] if limit is not None else []
         
-        order_by_clause = self._build_order_by_clause(order_by, normalized_group_by)
+        if partial:
+            query = sql.SQL("""
+            SELECT {select_clause}
+            FROM {from_clause}
+            WHERE {where_clause}
+            {group_by_clause}
+            """).format(
+                select_clause=select_clause,
+                from_clause=from_clause,
+                where_clause=where_clause,
+                group_by_clause=group_by_clause
+            )
+            if metric_dict['func'].upper() == "COUNT DISTINCT":
+                query = self._wrap_hll_partial(query, group_by_fields)
+            return query, params
+        
+        if compare_to:
+            query = sql.SQL("""
+            SELECT {totals}.*,
+                {totals}.metric_result - {totals}.metric_previous AS delta,
+                100.0 * ({totals}.metric_result - {totals}.metric_previous) / NULLIF({totals}.metric_previous, 0) AS delta_pct
+            FROM (
+                SELECT {select_clause}
+                FROM {from_clause}
+                WHERE {where_clause}
+                {group_by_clause}
+            ) AS {totals}
+            {order_by_clause}
+            {limit_clause}
+            """).format(
+                totals=sql.Identifier("totals"),
+                select_clause=select_clause,
+                from_clause=from_clause,
+                where_clause=where_clause,
+                group_by_clause=group_by_clause,
+                order_by_clause=order_by_clause,
+                limit_clause=limit_clause
+            )
+            return query, params + limit_params
         
         query = sql.SQL("""
             SELECT {select_clause}
@@ -132,22 +352,101 @@ class QueryBuilder:
             WHERE {where_clause}
             {group_by_clause}
             {order_by_clause}
-            LIMIT %s
+            {limit_clause}
         """).format(
             select_clause=select_clause,
             from_clause=from_clause,
             where_clause=where_clause,
             group_by_clause=group_by_clause,
-            order_by_clause=order_by_clause
+            order_by_clause=order_by_clause,
+            limit_clause=limit_clause
         )
         
-        params.append(limit)
+        return query, params + limit_params
+    
+    def build_duckdb_query(
+        self,
+        metric: Union[Dict[str, str], Any],
+        group_by: List[Any] = [],
+        filters: List[Union[Dict[str, Any], Any]] = [],
+        order_by: Optional[str] = None,
+        limit: int = 100,
+        compare_to: Optional[Union[str, Dict[str, Any]]] = None,
+        grouping: Optional[str] = None,
+        grouping_sets: Optional[List[List[str]]] = None
+    ) -> tuple:
+        """
+        Mesma query de build_analytics_query em SQL do DuckDB (placeholders '?'),
+        para rodar sobre os snapshots Parquet com as mesmas tabelas e colunas.
         
-        logger.info("=== Query construída com sucesso ===")
-                
-        return query, params
+        compare_to e HISTOGRAM ficam só no Postgres (intervalo como parâmetro e
+        width_bucket não têm equivalente direto).
+        """
+        if compare_to:
+            raise ValueError("compare_to não é suportado no DuckDB.")
+        if self.get_histogram_spec(self._normalize_metric(metric)):
+            raise ValueError("HISTOGRAM não é suportado no DuckDB.")
+        
+        # O Postgres ignora o fuso ao comparar TIMESTAMP com texto; o DuckDB recebe o datetime já convertido.
+        duckdb_filters = []
+        for item in self._normalize_filters(filters):
+            if self._resolve_column(item['column'])[1] == 'created_at' and item.get('op') != 'PERIODO_DIA':
+                value = item.get('value')
+                if isinstance(value, (list, tuple)):
+                    value = [self._parse_timestamp(v) for v in value]
+                elif value is not None:
+                    value = self._parse_timestamp(value)
+                item = {**item, 'value': value}
+            duckdb_filters.append(item)
+        
+        query, params = self.build_analytics_query(
+            metric=metric, group_by=group_by, filters=duckdb_filters, order_by=order_by, limit=limit,
+            grouping=grouping, grouping_sets=grouping_sets
+        )
+        return render_duckdb(query), params
     
-    def _normalize_metric(self, metric: Any) -> Dict[str, str]:
+    def rewrite_dimension_filters(self, filters: List[Any], dimension_lookup) -> List[Dict[str, Any]]:
+        """
+        Troca filtros em atributos de dimensão ('stores.city', 'channels.type')
+        por 'store_id'/'channel_id' IN (ids). dimension_lookup(tabela) devolve
+        {id: atributos}. Os demais filtros passam sem alteração.
+        """
+        rewritten = []
+        for item in self._normalize_filters(filters):
+            table, _, attribute = str(item.get('column') or '').partition('.')
+            config = self.DIMENSION_FILTERS.get(table)
+            if config is None or not attribute:
+                rewritten.append(item)
+                continue
+            if attribute not in config['columns']:
+                raise ValueError(f"Atributo de dimensão não permitido: {item['column']}")
+            if item.get('op') not in self.ALLOWED_OPERATORS or item.get('op') == 'PERIODO_DIA':
+                raise ValueError(f"Operador não permitido: {item.get('op')}")
+
+            ids = sorted(
+                dimension_id for dimension_id, attributes in dimension_lookup(table).items()
+                if match_dimension_value(attributes.get(attribute), item['op'], item.get('value'))
+            )
+            rewritten.append({'column': config['key'], 'op': 'IN', 'value': ids})
+        return rewritten
+
+    def normalize(self, metric: Any, group_by: List[Any], filters: List[Any]) -> tuple:
+        """Normaliza métrica, agrupamentos e filtros (para quem precisa inspecionar a requisição)."""
+        return (
+            self._normalize_metric(metric),
+            self._normalize_group_by(group_by),
+            self._normalize_filters(filters)
+        )
+
+    def resolve_column(self, column_name: str) -> tuple:
+        """Versão pública de _resolve_column: (tabela, coluna)."""
+        return self._resolve_column(column_name)
+
+    def parse_timestamp(self, value: Any) -> datetime:
+        """Versão pública de _parse_timestamp."""
+        return self._parse_timestamp(value)
+
+    def _normalize_metric(self, metric: Any) -> Dict[str, Any]:
         """Normaliza a métrica para um dicionário padrão."""
         if isinstance(metric, dict):
             return metric
@@ -173,7 +472,6 @@ class QueryBuilder:
                 })
             else:
                 raise ValueError(f"Formato de agrupamento inválido: {item} (tipo: {type(item)})")
-        logger.info(f"Group By normalizado: {normalized}")
         return normalized
     
     def _normalize_filters(self, filters: List[Any]) -> List[Dict[str, Any]]:
@@ -190,74 +488,196 @@ class QueryBuilder:
                 })
             else:
                 raise ValueError(f"Formato de filtro inválido: {item} (tipo: {type(item)})")
-        logger.info(f"Filters normalizados: {normalized}")
         return normalized
     
+    def _resolve_column(self, column_name: str) -> tuple:
+        """
+        Resolve uma coluna para (tabela, coluna).
+        Aceita nomes simples ('product_id') ou qualificados ('items.name'),
+        necessários quando o mesmo nome existe em mais de uma tabela.
+        """
+        if '.' in column_name:
+            table, col = column_name.split('.', 1)
+            if table != self.main_table and table not in self.JOIN_MAP and table not in self.DIMENSION_FILTERS:
+                raise ValueError(f"Tabela não mapeada: {table}")
+            return table, col
+
+        for table in [self.main_table] + list(self.JOIN_MAP):
+            if column_name in self.ALLOWED_GROUP_BY_COLUMNS.get(table, []) or \
+               column_name in self.ALLOWED_FILTER_COLUMNS.get(table, []) or \
+               column_name in self.ALLOWED_METRIC_COLUMNS.get(table, []):
+                return table, column_name
+        
+        raise ValueError(f"Coluna não mapeada: {column_name}")
+
+    def _table_alias(self, table: str) -> str:
+        if table == self.main_table:
+            return self.main_alias
+        return self.JOIN_MAP[table]['alias']
+
     def _get_table_alias(self, column_name: str) -> str:
         """Descobre o alias da tabela para uma coluna (ex: 'product_id' -> 'ps')"""
-        if column_name in self.ALLOWED_GROUP_BY_COLUMNS.get('sales', []) or \
-           column_name in self.ALLOWED_FILTER_COLUMNS.get('sales', []) or \
-           column_name in self.ALLOWED_METRIC_COLUMNS.get('sales', []):
-            return self.main_alias 
+        table, _ = self._resolve_column(column_name)
+        return self._table_alias(table)
 
-        for table, config in self.JOIN_MAP.items():
-            if column_name in config.get('allowed_group_by_cols', []) or \
-               column_name in config.get('allowed_filter_cols', []) or \
-               column_name in config.get('allowed_metric_cols', []):
-                return config['alias']
+    def _column_sql(self, column_name: str) -> sql.Composed:
+        """Retorna a referência 'alias.coluna' para uma coluna."""
+        table, col = self._resolve_column(column_name)
+        return sql.SQL("{alias}.{col}").format(
+            alias=sql.Identifier(self._table_alias(table)),
+            col=sql.Identifier(col)
+        )
+
+    def _grain_of(self, table: str) -> str:
+        if table == self.main_table:
+            return self.main_table
+        return self.JOIN_MAP[table]['grain']
+
+    def _with_dependencies(self, tables: set) -> list:
+        """Inclui as dependências (depends_on) e ordena na ordem do JOIN_MAP."""
+        expanded = set()
+        for table in tables:
+            while table and table != self.main_table and table not in expanded:
+                expanded.add(table)
+                table = self.JOIN_MAP[table].get('depends_on')
+        return [table for table in self.JOIN_MAP if table in expanded]
+
+    def _plan_joins(self, metric, group_by_list, filters) -> dict:
+        """
+        Decide como cada tabela entra na query.
         
-        raise ValueError(f"Coluna não mapeada: {column_name}")
+        A tabela da métrica define o grão da query. Tabelas no mesmo grão ou mais
+        grossas entram como JOIN direto. Tabelas de grão mais fino multiplicariam
+        as linhas da métrica (fan-out), então são lidas por uma subquery DISTINCT
+        (quando agrupadas) ou por EXISTS (quando só filtradas).
+        """
+        metric_table, _ = self._resolve_column(metric['column'])
+        anchor = self._grain_of(metric_table)
+        anchor_depth = self.FACT_GRAINS[anchor]['depth']
+
+        def is_finer(column_name):
+            table, _ = self._resolve_column(column_name)
+            return self.FACT_GRAINS[self._grain_of(table)]['depth'] > anchor_depth
+
+        direct_tables = {metric_table}
+        direct_filters, fine_filters, fine_group_by = [], [], []
 
-    def _get_required_columns(self, metric, group_by_list, filters) -> set:
-        """Coleta todas as colunas únicas necessárias para a query."""
-        cols = set()
-        cols.add(metric.get('column'))
         for item in group_by_list:
-            cols.add(item.get('column'))
+            if is_finer(item['column']):
+                fine_group_by.append(item)
+            else:
+                direct_tables.add(self._resolve_column(item['column'])[0])
+
         for item in filters:
-            cols.add(item.get('column'))
-        cols.discard(None) 
-        return cols
+            if is_finer(item['column']):
+                fine_filters.append(item)
+            else:
+                direct_filters.append(item)
+                direct_tables.add(self._resolve_column(item['column'])[0])
+
+        fine_tables = {
+            self._resolve_column(item['column'])[0] for item in fine_group_by + fine_filters
+        }
+        fine_path = [
+            table for table in self._with_dependencies(fine_tables)
+            if self.FACT_GRAINS[self._grain_of(table)]['depth'] > anchor_depth
+        ]
+
+        return {
+            'anchor': anchor,
+            'direct_tables': self._with_dependencies(direct_tables),
+            'direct_filters': direct_filters,
+            'fine_path': fine_path,
+            'fine_filters': fine_filters,
+            'fine_group_by': fine_group_by
+        }
 
-    def _build_from_clause(self, required_cols: set) -> sql.SQL:
+    def _build_fine_path(self, plan: dict) -> tuple:
+        """FROM/JOIN das tabelas de grão fino e a chave que as liga ao grão da métrica."""
+        first_table = plan['fine_path'][0]
+        first_alias = self.JOIN_MAP[first_table]['alias']
+        path_clause = sql.SQL("{table} AS {alias}").format(
+            table=sql.Identifier(first_table),
+            alias=sql.Identifier(first_alias)
+        )
+        for table in plan['fine_path'][1:]:
+            config = self.JOIN_MAP[table]
+            path_clause += sql.SQL(" JOIN {table} AS {alias} ON {on}").format(
+                table=sql.Identifier(table),
+                alias=sql.Identifier(config['alias']),
+                on=config['on']
+            )
+        parent_key = sql.SQL("{alias}.{col}").format(
+            alias=sql.Identifier(first_alias),
+            col=sql.Identifier(self.FACT_GRAINS[first_table]['parent_key'])
+        )
+        anchor_key = sql.SQL("{alias}.{col}").format(
+            alias=sql.Identifier(self.FACT_GRAINS[plan['anchor']]['alias']),
+            col=sql.Identifier("id")
+        )
+        return path_clause, parent_key, anchor_key
+
+    def _build_from_clause(self, plan: dict) -> tuple:
         """Constrói a cláusula FROM e os JOINs necessários."""
         from_clause = sql.SQL("{table} AS {alias}").format(
             table=sql.Identifier(self.main_table),
             alias=sql.Identifier(self.main_alias)
         )
+        params = []
         
-        joined_tables = set()
-        
-        for table, config in self.JOIN_MAP.items():
-            table_cols = set(config['allowed_metric_cols'] + config['allowed_group_by_cols'] + config['allowed_filter_cols'])
-            if not required_cols.isdisjoint(table_cols): 
-                
-                dependency = config.get('depends_on')
-                if dependency and dependency not in joined_tables:
-                    dep_config = self.JOIN_MAP[dependency]
-                    join_sql = sql.SQL(" JOIN {table} AS {alias} ON {on}").format(
-                        table=sql.Identifier(dependency),
-                        alias=sql.Identifier(dep_config['alias']),
-                        on=dep_config['on']
-                    )
-                    from_clause += join_sql
-                    joined_tables.add(dependency)
-
-                if table not in joined_tables:
-                    join_sql = sql.SQL(" JOIN {table} AS {alias} ON {on}").format(
-                        table=sql.Identifier(table),
-                        alias=sql.Identifier(config['alias']),
-                        on=config['on']
-                    )
-                    from_clause += join_sql
-                    joined_tables.add(table)
+        for table in plan['direct_tables']:
+            config = self.JOIN_MAP[table]
+            from_clause += sql.SQL(" JOIN {table} AS {alias} ON {on}").format(
+                table=sql.Identifier(table),
+                alias=sql.Identifier(config['alias']),
+                on=config['on']
+            )
+
+        if plan['fine_group_by']:
+            path_clause, parent_key, anchor_key = self._build_fine_path(plan)
+            dim_columns = [
+                sql.SQL("{col} AS {alias}").format(
+                    col=self._column_sql(item['column']),
+                    alias=sql.Identifier(f"g{index}")
+                )
+                for index, item in enumerate(plan['fine_group_by'])
+            ]
+            fine_where, params = self._build_where_clause(plan['fine_filters'])
+            from_clause += sql.SQL(
+                " JOIN (SELECT DISTINCT {parent_key} AS {anchor_id}, {dims} FROM {path} WHERE {where}) AS {fx}"
+                " ON {fx}.{anchor_id} = {anchor_key}"
+            ).format(
+                parent_key=parent_key,
+                anchor_id=sql.Identifier("anchor_id"),
+                dims=sql.SQL(", ").join(dim_columns),
+                path=path_clause,
+                where=fine_where,
+                fx=sql.Identifier("fx"),
+                anchor_key=anchor_key
+            )
                 
-        return from_clause
+        return from_clause, params
+
+    def _build_semi_join(self, plan: dict) -> tuple:
+        """EXISTS para filtros em tabelas de grão fino que não são agrupadas."""
+        if plan['fine_group_by'] or not plan['fine_filters']:
+            return None, []
+
+        path_clause, parent_key, anchor_key = self._build_fine_path(plan)
+        fine_where, params = self._build_where_clause(plan['fine_filters'])
+        clause = sql.SQL("EXISTS (SELECT 1 FROM {path} WHERE {parent_key} = {anchor_key} AND {where})").format(
+            path=path_clause,
+            parent_key=parent_key,
+            anchor_key=anchor_key,
+            where=fine_where
+        )
+        return clause, params
 
     def _build_select_and_group_by(
         self, 
         metric: Dict[str, str], 
-        group_by: List[Dict[str, Any]]
+        group_by: List[Dict[str, Any]],
+        plan: dict
     ) -> tuple:
         """Constrói as cláusulas SELECT e GROUP BY (com aliases)."""
         select_parts = []
@@ -268,25 +688,36 @@ class QueryBuilder:
             column = item['column']
             granularity = item['granularity']
             
-            alias = self._get_table_alias(column)
-            
             if granularity is None:
-                col_identifier = sql.SQL("{alias}.{col}").format(
-                    alias=sql.Identifier(alias),
-                    col=sql.Identifier(column)
-                )
-                select_parts.append(col_identifier)
+                if item in plan['fine_group_by']:
+                    col_identifier = sql.SQL("{fx}.{col}").format(
+                        fx=sql.Identifier("fx"),
+                        col=sql.Identifier(f"g{plan['fine_group_by'].index(item)}")
+                    )
+                else:
+                    col_identifier = self._column_sql(column)
+                
+                if item in plan['fine_group_by'] or '.' in column:
+                    select_parts.append(sql.SQL("{col} AS {alias}").format(
+                        col=col_identifier, alias=sql.Identifier(column)
+                    ))
+                else:
+                    select_parts.append(col_identifier)
                 group_by_parts.append(col_identifier)
                 group_by_fields.append(column)
             
             else:
-                if column != 'created_at':
+                if self._resolve_column(column)[1] != 'created_at':
                     raise ValueError("Granularidade só é permitida em 'created_at'.")
                 
-                col_identifier = sql.SQL("{alias}.{col}").format(
-                    alias=sql.Identifier(alias),
-                    col=sql.Identifier(column)
-                )
+                if plan.get('compare'):
+                    # Linhas do período de comparação caem no bucket alinhado do período atual
+                    col_identifier = sql.SQL("{cmp}.{col}").format(
+                        cmp=sql.Identifier(self.COMPARE_ALIAS),
+                        col=sql.Identifier("aligned_at")
+                    )
+                else:
+                    col_identifier = self._column_sql(column)
                 
                 date_expr = None
                 
@@ -311,29 +742,335 @@ class QueryBuilder:
                 group_by_parts.append(date_expr)
                 group_by_fields.append(self.DATE_GROUP_ALIAS)
         
-        metric_func = sql.SQL(metric["func"])
-        metric_col_name = metric["column"]
-        metric_alias = self._get_table_alias(metric_col_name)
+        metric_col = self._column_sql(metric["column"])
         
-        metric_col = sql.SQL("{alias}.{col}").format(
-            alias=sql.Identifier(metric_alias),
-            col=sql.Identifier(metric_col_name)
-        )
-        metric_expr = sql.SQL("{func}({col}) AS metric_result").format(
-            func=metric_func,
-            col=metric_col
-        )
-        select_parts.append(metric_expr)
+        if plan.get('histogram'):
+            low, high, buckets = plan['histogram']
+            width = (high - low) / buckets
+            bucket_expr = sql.SQL("width_bucket({col}, {low}, {high}, {buckets})").format(
+                col=metric_col,
+                low=sql.Literal(low),
+                high=sql.Literal(high),
+                buckets=sql.Literal(buckets)
+            )
+            select_parts.append(sql.SQL("{expr} AS {alias}").format(
+                expr=bucket_expr, alias=sql.Identifier(self.HISTOGRAM_BUCKET_ALIAS)
+            ))
+            select_parts.append(sql.SQL("{low} + ({expr} - 1) * {width} AS bucket_start").format(
+                low=sql.Literal(low), expr=bucket_expr, width=sql.Literal(width)
+            ))
+            select_parts.append(sql.SQL("{low} + {expr} * {width} AS bucket_end").format(
+                low=sql.Literal(low), expr=bucket_expr, width=sql.Literal(width)
+            ))
+            group_by_parts.append(bucket_expr)
+        
+        if plan.get('compare'):
+            for period, alias in [(0, "metric_result"), (1, "metric_previous")]:
+                period_col = sql.SQL("CASE WHEN {cmp}.period = {period} THEN {col} END").format(
+                    cmp=sql.Identifier(self.COMPARE_ALIAS),
+                    period=sql.Literal(period),
+                    col=metric_col
+                )
+                select_parts.append(sql.SQL("{expr} AS {alias}").format(
+                    expr=self._metric_expression(metric, period_col),
+                    alias=sql.Identifier(alias)
+                ))
+        elif plan.get('partial'):
+            partial_parts, register_expr = self._partial_metric_expressions(metric, metric_col)
+            select_parts.extend(partial_parts)
+            if register_expr is not None:
+                group_by_parts.append(register_expr)
+        else:
+            metric_expr = sql.SQL("{expr} AS metric_result").format(
+                expr=self._metric_expression(metric, metric_col)
+            )
+            select_parts.append(metric_expr)
+        
+        if plan.get('grouping_sets') is not None:
+            for field, part in zip(group_by_fields, group_by_parts):
+                select_parts.append(sql.SQL("GROUPING({expr}) AS {alias}").format(
+                    expr=part, alias=sql.Identifier(f"grouping_{field}")
+                ))
+            select_parts.append(sql.SQL("GROUPING({exprs}) AS {alias}").format(
+                exprs=sql.SQL(", ").join(group_by_parts),
+                alias=sql.Identifier(self.GROUPING_ID_ALIAS)
+            ))
         
         select_clause = sql.SQL(", ").join(select_parts)
         
-        if group_by_parts:
+        if plan.get('grouping_sets') is not None:
+            sets = [
+                sql.SQL("({})").format(sql.SQL(", ").join(group_by_parts[index] for index in grouping_set))
+                for grouping_set in plan['grouping_sets']
+            ]
+            group_by_clause = sql.SQL("GROUP BY GROUPING SETS ({sets})").format(
+                sets=sql.SQL(", ").join(sets)
+            )
+        elif group_by_parts:
             group_by_clause = sql.SQL("GROUP BY ") + sql.SQL(", ").join(group_by_parts)
         else:
             group_by_clause = sql.SQL("")
         
         return select_clause, group_by_clause, group_by_fields
     
+    def _resolve_grouping_sets(
+        self,
+        group_by: List[Dict[str, Any]],
+        grouping: Optional[str],
+        grouping_sets: Optional[List[List[str]]]
+    ) -> Optional[List[tuple]]:
+        """
+        Converte rollup/cube/sets em uma lista de conjuntos (índices de group_by).
+        Em 'sets', cada conjunto lista colunas do group_by ('date_group_field' para a data).
+        """
+        if not grouping:
+            if grouping_sets:
+                raise ValueError("grouping_sets requer grouping='sets'.")
+            return None
+
+        grouping = grouping.lower()
+        if grouping not in self.GROUPING_MODES:
+            raise ValueError(f"grouping inválido: {grouping}. Permitidos: {self.GROUPING_MODES}")
+        if not group_by:
+            raise ValueError("grouping requer ao menos uma coluna em group_by.")
+
+        fields = [
+            self.DATE_GROUP_ALIAS if item.get('granularity') else item['column']
+            for item in group_by
+        ]
+        count = len(fields)
+
+        if grouping == "rollup":
+            return [tuple(range(size)) for size in range(count, -1, -1)]
+
+        if grouping == "cube":
+            if count > self.MAX_CUBE_COLUMNS:
+                raise ValueError(f"cube aceita no máximo {self.MAX_CUBE_COLUMNS} colunas.")
+            return [
+                combo for size in range(count, -1, -1)
+                for combo in combinations(range(count), size)
+            ]
+
+        if not grouping_sets:
+            raise ValueError("grouping='sets' requer grouping_sets.")
+        resolved = []
+        for grouping_set in grouping_sets:
+            indexes = []
+            for field in grouping_set:
+                if field not in fields:
+                    raise ValueError(f"Coluna de grouping_sets fora do group_by: {field}")
+                indexes.append(fields.index(field))
+            resolved.append(tuple(indexes))
+        return resolved
+    
+    def _metric_expression(self, metric: Dict[str, Any], col: sql.Composable) -> sql.Composed:
+        """Aplica a função de agregação à coluna (COUNT DISTINCT vira COUNT(DISTINCT col))."""
+        func = metric["func"].upper()
+        if func == "COUNT DISTINCT":
+            return sql.SQL("COUNT(DISTINCT {col})").format(col=col)
+        if func == "HISTOGRAM":
+            return sql.SQL("COUNT({col})").format(col=col)
+        percentile = self.get_percentile(metric)
+        if percentile is not None:
+            return sql.SQL("percentile_cont({fraction}) WITHIN GROUP (ORDER BY {col})").format(
+                fraction=sql.Literal(percentile), col=col
+            )
+        return sql.SQL("{func}({col})").format(func=sql.SQL(func), col=col)
+
+    def _partial_metric_expressions(self, metric: Dict[str, Any], col: sql.Composable) -> tuple:
+        """
+        (colunas, expressão extra de GROUP BY) do agregado parcial. COUNT DISTINCT
+        usa o hash de 64 bits do valor: os HLL_PRECISION bits baixos escolhem o
+        registrador e o rank é 1 + zeros à esquerda nos 63 - HLL_PRECISION bits
+        seguintes (o bit de sinal fica de fora).
+        """
+        func = metric["func"].upper()
+        if func == "AVG":
+            return [
+                sql.SQL("SUM({col}) AS metric_sum").format(col=col),
+                sql.SQL("COUNT({col}) AS metric_count").format(col=col)
+            ], None
+        if func == "COUNT DISTINCT":
+            rank_bits = 63 - self.HLL_PRECISION
+            hashed = sql.SQL("hashtextextended({col}::text, 0)").format(col=col)
+            register = sql.SQL("({hashed} & {mask})").format(
+                hashed=hashed, mask=sql.Literal((1 << self.HLL_PRECISION) - 1)
+            )
+            rank = sql.SQL(
+                "MAX({bits} + 1 - length(ltrim((({hashed} >> {precision}) & {mask})::bit({bits})::text, '0')))"
+            ).format(
+                bits=sql.SQL(str(rank_bits)),
+                hashed=hashed,
+                precision=sql.Literal(self.HLL_PRECISION),
+                mask=sql.Literal((1 << rank_bits) - 1)
+            )
+            return [
+                sql.SQL("{register} AS hll_register").format(register=register),
+                sql.SQL("{rank} AS hll_rank").format(rank=rank)
+            ], register
+        return [sql.SQL("{expr} AS metric_result").format(expr=self._metric_expression(metric, col))], None
+
+    def _wrap_hll_partial(self, query: sql.Composable, group_by_fields: List[str]) -> sql.Composed:
+        """Uma linha por grupo com os registradores do HyperLogLog em arrays."""
+        fields = [sql.Identifier(field) for field in group_by_fields]
+        aggregates = sql.SQL("array_agg(hll_register) AS hll_registers, array_agg(hll_rank) AS hll_ranks")
+        if not fields:
+            return sql.SQL("SELECT {aggregates} FROM ({query}) AS {partial}").format(
+                aggregates=aggregates, query=query, partial=sql.Identifier("partial")
+            )
+        return sql.SQL("SELECT {fields}, {aggregates} FROM ({query}) AS {partial} GROUP BY {fields}").format(
+            fields=sql.SQL(", ").join(fields), aggregates=aggregates, query=query,
+            partial=sql.Identifier("partial")
+        )
+
+    def get_percentile(self, metric: Dict[str, Any]) -> Optional[float]:
+        """Fração (0-1) de uma métrica de percentil, ou None se a métrica não for percentil."""
+        func = str(metric.get("func", "")).upper()
+        if func in self.PERCENTILE_SHORTCUTS:
+            return self.PERCENTILE_SHORTCUTS[func]
+        if func != "PERCENTILE":
+            return None
+        try:
+            fraction = float(metric.get("percentile"))
+        except (TypeError, ValueError):
+            raise ValueError("PERCENTILE requer 'percentile' numérico entre 0 e 1.")
+        if not 0 <= fraction <= 1:
+            raise ValueError(f"'percentile' deve estar entre 0 e 1. Recebido: {fraction}")
+        return fraction
+
+    def get_histogram_spec(self, metric: Dict[str, Any]) -> Optional[tuple]:
+        """(min, max, buckets) de uma métrica HISTOGRAM, ou None."""
+        if str(metric.get("func", "")).upper() != "HISTOGRAM":
+            return None
+        value_range = metric.get("range")
+        if not isinstance(value_range, (list, tuple)) or len(value_range) != 2:
+            raise ValueError("HISTOGRAM requer 'range' com [min, max].")
+        try:
+            low, high = float(value_range[0]), float(value_range[1])
+            buckets = int(metric.get("buckets", 20))
+        except (TypeError, ValueError):
+            raise ValueError("HISTOGRAM requer 'range' e 'buckets' numéricos.")
+        if low >= high:
+            raise ValueError("HISTOGRAM requer min < max em 'range'.")
+        if not 1 <= buckets <= self.MAX_HISTOGRAM_BUCKETS:
+            raise ValueError(f"'buckets' deve estar entre 1 e {self.MAX_HISTOGRAM_BUCKETS}.")
+        return low, high, buckets
+
+    def _parse_timestamp(self, value: Any) -> datetime:
+        """Converte o valor de um filtro de data para datetime sem fuso (como o Postgres faz com TIMESTAMP)."""
+        if isinstance(value, datetime):
+            return value.replace(tzinfo=None)
+        try:
+            return datetime.fromisoformat(str(value).replace('Z', '+00:00')).replace(tzinfo=None)
+        except ValueError:
+            raise ValueError(f"Data inválida em filtro de created_at: {value}")
+
+    def _resolve_compare_windows(self, filters: List[Dict[str, Any]], compare_to: Any) -> dict:
+        """
+        Extrai a janela atual dos filtros de created_at e calcula a janela de comparação.
+        Os filtros de intervalo em created_at são substituídos pelas duas janelas.
+        """
+        start = end = None
+        start_op, end_op = ">=", "<="
+        remaining = []
+
+        for item in filters:
+            is_created_at = self._resolve_column(item['column']) == (self.main_table, 'created_at')
+            op = item.get('op')
+            if is_created_at and op in (">=", ">"):
+                start, start_op = self._parse_timestamp(item['value']), op
+            elif is_created_at and op in ("<=", "<"):
+                end, end_op = self._parse_timestamp(item['value']), op
+            elif is_created_at and op == "BETWEEN":
+                value = item['value']
+                if not isinstance(value, (list, tuple)) or len(value) != 2:
+                    raise ValueError(f"BETWEEN requer uma lista de 2 valores. Recebido: {value}")
+                start, end = self._parse_timestamp(value[0]), self._parse_timestamp(value[1])
+                start_op, end_op = ">=", "<="
+            else:
+                remaining.append(item)
+
+        if start is None or end is None:
+            raise ValueError("compare_to requer filtros de início e fim em 'created_at'.")
+
+        if compare_to == "previous_period":
+            offset = end - start
+            if end_op == "<=":
+                offset += timedelta(seconds=1)
+            previous = (start - offset, end - offset)
+            shift = offset
+        elif compare_to == "previous_year":
+            previous = (self._shift_years(start, -1), self._shift_years(end, -1))
+            shift = "1 year"
+        elif isinstance(compare_to, dict):
+            try:
+                offset = timedelta(days=float(compare_to.get('days', 0)), hours=float(compare_to.get('hours', 0)))
+            except (TypeError, ValueError):
+                raise ValueError(f"compare_to inválido: {compare_to}")
+            if offset <= timedelta(0):
+                raise ValueError("compare_to personalizado requer 'days' e/ou 'hours' positivos.")
+            previous = (start - offset, end - offset)
+            shift = offset
+        else:
+            raise ValueError(
+                f"compare_to inválido: {compare_to}. Use 'previous_period', 'previous_year' ou {{'days': N}}."
+            )
+
+        # Com fim exclusivo (<) ou início exclusivo (>), a comparação pode terminar
+        # exatamente onde a janela atual começa.
+        touches = previous[1] == start and end_op == "<=" and start_op == ">="
+        if previous[1] > start or touches:
+            raise ValueError("A janela de comparação não pode se sobrepor à janela atual.")
+
+        return {
+            'current': (start, end),
+            'previous': previous,
+            'start_op': start_op,
+            'end_op': end_op,
+            'shift': shift,
+            'remaining_filters': remaining
+        }
+
+    def _shift_years(self, value: datetime, years: int) -> datetime:
+        try:
+            return value.replace(year=value.year + years)
+        except ValueError:
+            # 29/02 -> 28/02
+            return value.replace(year=value.year + years, day=28)
+
+    def _window_condition(self, compare: dict) -> sql.Composed:
+        created_at = self._column_sql('created_at')
+        return sql.SQL("{col} {start_op} %s AND {col} {end_op} %s").format(
+            col=created_at,
+            start_op=sql.SQL(compare['start_op']),
+            end_op=sql.SQL(compare['end_op'])
+        )
+
+    def _build_compare_join(self, compare: dict) -> tuple:
+        """
+        LATERAL que marca cada linha com o período (0 = atual, 1 = comparação)
+        e a data alinhada ao período atual, usada nos agrupamentos por data.
+        """
+        condition = self._window_condition(compare)
+        clause = sql.SQL(
+            " CROSS JOIN LATERAL (SELECT p.period,"
+            " {col} + CASE WHEN p.period = 1 THEN %s::interval ELSE INTERVAL '0' END AS aligned_at"
+            " FROM (SELECT CASE WHEN {current} THEN 0 WHEN {previous} THEN 1 END AS period) AS p) AS {cmp}"
+        ).format(
+            col=self._column_sql('created_at'),
+            current=condition,
+            previous=condition,
+            cmp=sql.Identifier(self.COMPARE_ALIAS)
+        )
+        params = [compare['shift'], *compare['current'], *compare['previous']]
+        return clause, params
+
+    def _build_compare_where(self, compare: dict) -> tuple:
+        """Predicado indexável que restringe o scan às duas janelas."""
+        condition = self._window_condition(compare)
+        clause = sql.SQL("(({current}) OR ({previous}))").format(current=condition, previous=condition)
+        return clause, [*compare['current'], *compare['previous']]
+
     def _build_where_clause(self, filters: List[Dict[str, Any]]) -> tuple:
         """Constrói a cláusula WHERE (com aliases)."""
         where_conditions = []
@@ -348,15 +1085,10 @@ class QueryBuilder:
                 if operator != 'PERIODO_DIA':
                     raise ValueError(f"Operador não permitido: {operator}")
             
-            alias = self._get_table_alias(column_name)
-            
-            column = sql.SQL("{alias}.{col}").format(
-                alias=sql.Identifier(alias),
-                col=sql.Identifier(column_name)
-            )
+            column = self._column_sql(column_name)
             
             if operator == 'PERIODO_DIA':
-                if column_name != 'created_at':
+                if self._resolve_column(column_name)[1] != 'created_at':
                     raise ValueError("Operador 'PERIODO_DIA' só pode ser usado na coluna 'created_at'.")
                 if not isinstance(value, (list, tuple)) or len(value) != 2:
                     raise ValueError(f"Operador 'PERIODO_DIA' requer uma lista de 2 valores. Recebido: {value}")
@@ -378,6 +1110,10 @@ class QueryBuilder:
             elif operator in ["IN", "NOT IN"]:
                 if not isinstance(value, (list, tuple)):
                     raise ValueError(f"{operator} requer uma lista de valores. Recebido: {value}")
+                if not value:
+                    # Lista vazia (ex.: atributo de dimensão sem nenhuma loja): 'IN ()' não é SQL válido.
+                    where_conditions.append(sql.SQL("FALSE" if operator == "IN" else "TRUE"))
+                    continue
                 placeholders = sql.SQL(", ").join([sql.SQL("%s")] * len(value))
                 where_conditions.append(sql.SQL("{col} {op} ({placeholders})").format(
                     col=column, op=sql.SQL(operator), placeholders=placeholders
@@ -399,7 +1135,10 @@ class QueryBuilder:
     def _build_order_by_clause(
         self, 
         order_by: Optional[str], 
-        group_by: List[Dict[str, Any]]
+        group_by: List[Dict[str, Any]],
+        has_compare: bool = False,
+        has_grouping_sets: bool = False,
+        has_histogram: bool = False
     ) -> sql.SQL:
         """Constrói a cláusula ORDER BY de forma segura."""
         
@@ -408,7 +1147,10 @@ class QueryBuilder:
         has_date_grouping = any(item.get('granularity') for item in group_by)
         
         if not order_by:
-            if has_date_grouping:
+            if has_histogram:
+                order_by_col = self.HISTOGRAM_BUCKET_ALIAS
+                order_by_dir = "ASC"
+            elif has_date_grouping:
                 order_by_col = self.DATE_GROUP_ALIAS
                 order_by_dir = "ASC"
         else:
@@ -419,6 +1161,12 @@ class QueryBuilder:
             column_name = parts[0]
             
             allowed_cols = [self.DATE_GROUP_ALIAS, "metric_result"]
+            if has_compare:
+                allowed_cols += self.COMPARE_COLUMNS
+            if has_grouping_sets:
+                allowed_cols.append(self.GROUPING_ID_ALIAS)
+            if has_histogram:
+                allowed_cols.append(self.HISTOGRAM_BUCKET_ALIAS)
             for item in group_by:
                 if not item.get('granularity'):
                     allowed_cols.append(item.get('column'))
@@ -447,13 +1195,17 @@ class QueryBuilder:
         if func not in self.ALLOWED_FUNCTIONS:
             raise ValueError(f"Função de agregação não permitida: {func}")
         
-        is_allowed = False
-        for table_cols in self.ALLOWED_METRIC_COLUMNS.values():
-            if column in table_cols:
-                is_allowed = True
-                break
+        self.get_percentile(metric)
+        self.get_histogram_spec(metric)
+        
+        if not column:
+            raise ValueError("Coluna de métrica não informada.")
         
-        if not is_allowed:
+        try:
+            table, col = self._resolve_column(column)
+        except ValueError:
+            raise ValueError(f"Coluna de métrica não permitida: {column}")
+        if col not in self.ALLOWED_METRIC_COLUMNS.get(table, []):
             raise ValueError(f"Coluna de métrica não permitida: {column}")
 
     def _validate_columns(self, items: List[Dict], allowed_map: Dict, col_type: str):
@@ -462,11 +1214,9 @@ class QueryBuilder:
             col = item.get("column")
             if not col: continue
             
-            is_allowed = False
-            for table_cols in allowed_map.values():
-                if col in table_cols:
-                    is_allowed = True
-                    break
-            
-            if not is_allowed:
+            try:
+                table, table_col = self._resolve_column(col)
+            except ValueError:
+                raise ValueError(f"Coluna de {col_type} não permitida: {col}")
+            if table_col not in allowed_map.get(table, []):
                 raise ValueError(f"Coluna de {col_type} não permitida: {col}")
\ No newline at end of file
@@ -0,0 +1,133 @@
+"""
+Refresh agendado dos rollups e das métricas de clientes.
+
+Um worker por host (lock de arquivo, como o warmer) roda refresh_all_rollups
+e refresh_customer_metrics no primário a cada ROLLUP_REFRESH_SECONDS e depois
+poda sales_changes até o menor horizonte dos consumidores. Vários hosts podem
+rodar o agendador: os refreshes se serializam pelo FOR UPDATE em
+rollup_watermarks. Um refresh que recalculou algum dia ou cliente descarta o
+cache de analytics, como o POST /api/v1/rollups/refresh. Uso fora da API:
+    python rollup_scheduler.py           # loop
+    python rollup_scheduler.py --once    # uma rodada
+"""
+import argparse
+import fcntl
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from cache import CACHE_DIR, result_cache
+from changes import prune_changes
+from customer_metrics import CUSTOMER_METRICS_ROLLUP, refresh_customer_metrics
+from database import primary_connection
+from rollups import ROLLUP_NAMES, refresh_all_rollups
+
+ROLLUP_SCHEDULER_ENABLED = os.getenv("ROLLUP_SCHEDULER_ENABLED", "1") == "1"
+ROLLUP_REFRESH_SECONDS = float(os.getenv("ROLLUP_REFRESH_SECONDS", "60"))
+ROLLUP_SCHEDULER_LOCK_FILE = os.getenv(
+    "ROLLUP_SCHEDULER_LOCK_FILE", os.path.join(CACHE_DIR, ".rollup_scheduler.lock")
+)
+
+# Consumidores de sales_changes com horizonte em rollup_watermarks (limitam a poda).
+CHANGE_CONSUMERS = ROLLUP_NAMES + [CUSTOMER_METRICS_ROLLUP]
+
+
+def refresh_rollups_and_metrics(conn) -> list:
+    """
+    Refresh incremental dos rollups e das métricas de clientes. Se algum dia ou
+    cliente foi recalculado, as respostas montadas a partir deles mudaram:
+    descarta o cache de analytics.
+    """
+    refreshed = refresh_all_rollups(conn) + [refresh_customer_metrics(conn)]
+    if any(value for result in refreshed for key, value in result.items() if key.startswith("processed_")):
+        result_cache.clear("analytics:")
+    return refreshed
+
+
+class RollupScheduler:
+    """Loop de refresh dos rollups (um worker por host) e o resultado da última rodada."""
+
+    def __init__(self, interval: float = ROLLUP_REFRESH_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_handle = None
+        self.last_run = None
+        self.last_error = None
+
+    def refresh_once(self) -> dict:
+        started = time.monotonic()
+        with primary_connection() as conn:
+            refreshed = refresh_rollups_and_metrics(conn)
+            cursor = conn.cursor()
+            pruned = prune_changes(cursor, CHANGE_CONSUMERS)
+            conn.commit()
+        self.last_run = {
+            "finished_at": datetime.now().isoformat(),
+            "seconds": round(time.monotonic() - started, 3),
+            "rollups": refreshed,
+            "pruned_changes": pruned
+        }
+        return self.last_run
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh_once()
+                self.last_error = None
+            except Exception as error:
+                self.last_error = str(error)
+                print(f"Erro no refresh agendado dos rollups: {error}")
+            self._stop.wait(self.interval)
+
+    def start(self) -> bool:
+        """Inicia o loop em uma thread, se nenhum outro worker do host já o tiver iniciado."""
+        os.makedirs(os.path.dirname(ROLLUP_SCHEDULER_LOCK_FILE), exist_ok=True)
+        self._lock_handle = open(ROLLUP_SCHEDULER_LOCK_FILE, "w")
+        try:
+            fcntl.flock(self._lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_handle.close()
+            self._lock_handle = None
+            return False
+        self._thread = threading.Thread(target=self.run_forever, name="rollup-scheduler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
+
+    def status(self) -> dict:
+        return {
+            "worker_pid": os.getpid(),
+            "enabled": ROLLUP_SCHEDULER_ENABLED,
+            "running_here": self._thread is not None and self._thread.is_alive(),
+            "interval_seconds": self.interval,
+            "last_run": self.last_run,
+            "last_error": self.last_error
+        }
+
+
+rollup_scheduler = RollupScheduler()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh agendado dos rollups e das métricas de clientes.")
+    parser.add_argument("--once", action="store_true", help="Executa uma rodada e sai")
+    args = parser.parse_args()
+
+    if args.once:
+        print(json.dumps(rollup_scheduler.refresh_once(), indent=2, ensure_ascii=False, default=str))
+        return
+    rollup_scheduler.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Coalescência de chamadas idênticas concorrentes (single-flight).
+
+Quando várias requisições com a mesma chave chegam ao mesmo tempo, só a
+primeira (líder) executa; as demais esperam o resultado dela. Funciona entre
+as threads de um worker; entre workers, quem chega depois encontra o resultado
+no cache compartilhado.
+
+Um seguidor que espera mais que SINGLEFLIGHT_TIMEOUT recebe
+SingleFlightTimeout (503 na API) em vez de executar por conta própria: com a
+consulta do líder lenta, reexecutar só somaria mais carga ao banco.
+"""
+import math
+import os
+import threading
+
+SINGLEFLIGHT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_TIMEOUT", "30"))
+
+
+class SingleFlightTimeout(Exception):
+    """A chamada em voo não terminou dentro do timeout do seguidor."""
+
+    def __init__(self, key: str, timeout: float):
+        super().__init__(f"Consulta idêntica em andamento há mais de {timeout:g}s, tente novamente.")
+        self.key = key
+        self.retry_after = max(1, math.ceil(timeout))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Agrupa execuções por chave; contadores expostos em stats()."""
+
+    def __init__(self, timeout: float = SINGLEFLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def do(self, key: str, fn) -> tuple:
+        """
+        Executa fn() uma vez por chave em voo e devolve (resultado, coalescido)
+        a todos; coalescido é True para quem recebeu o resultado do líder.
+
+        Um seguidor que espera mais que `timeout` recebe SingleFlightTimeout.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                finished = call.done.wait(self.timeout)
+            finally:
+                with self._lock:
+                    call.waiters -= 1
+            if not finished:
+                with self._lock:
+                    self.timeouts += 1
+                raise SingleFlightTimeout(key, self.timeout)
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as error:
+            call.error = error
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "worker_pid": os.getpid(),
+                "in_flight": len(self._calls),
+                "waiting": sum(call.waiters for call in self._calls.values()),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+                "errors": self.errors
+            }
+
+
+query_flight = SingleFlight()
@@ -0,0 +1,96 @@
+"""
+Aquecimento do worker no startup e estado de prontidão (/healthz e /readyz).
+
+O lifespan de main.py dispara warm_up em uma thread: abre o pool, usa cada
+conexão mínima uma vez (sessão e catálogo já quentes) e, com
+STARTUP_PRELOAD=1, carrega o dicionário de dimensões e as referências no
+cache compartilhado. Enquanto isso /readyz responde 503; com o Postgres fora
+do ar a tentativa se repete a cada STARTUP_RETRY_SECONDS, sem derrubar o
+processo. O tempo de cada fase e o total desde o import ficam em status().
+"""
+import os
+import threading
+import time
+
+from analytics import REFERENCE_QUERIES, reference_key, fetch_reference
+from cache import result_cache, serialize, REFERENCE_CACHE_TTL
+from database import open_pool, prewarm_pool, read_connection
+from dimensions import DIMENSIONS, dimension_cache
+
+STARTUP_PRELOAD = os.getenv("STARTUP_PRELOAD", "1") == "1"
+STARTUP_RETRY_SECONDS = float(os.getenv("STARTUP_RETRY_SECONDS", "2"))
+# Tabelas cujo catálogo é carregado em cada conexão do pool no aquecimento.
+PREWARM_TABLES = ["sales", "product_sales", "item_product_sales", "stores", "channels", "products"]
+
+PROCESS_STARTED_AT = time.monotonic()
+
+
+class StartupState:
+    """Fases do aquecimento e prontidão deste worker."""
+
+    def __init__(self):
+        self.ready = False
+        self.attempts = 0
+        self.last_error = None
+        self.phases_ms = {}
+        self.ready_after_seconds = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _phase(self, name: str, function):
+        started = time.perf_counter()
+        result = function()
+        self.phases_ms[name] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+    def _preload(self):
+        with read_connection() as conn:
+            for name, config in DIMENSIONS.items():
+                if config["preload"]:
+                    dimension_cache.table(conn, name)
+            for name in REFERENCE_QUERIES:
+                key = reference_key(name)
+                if result_cache.get(key) is None:
+                    result_cache.set(key, serialize(fetch_reference(conn, name)), REFERENCE_CACHE_TTL)
+
+    def warm_up(self):
+        """Tenta até conseguir (ou até stop): pool, aquecimento e pré-carga."""
+        while not self._stop.is_set():
+            self.attempts += 1
+            try:
+                self._phase("open_pool", open_pool)
+                self._phase("prewarm_connections", lambda: prewarm_pool(PREWARM_TABLES))
+                if STARTUP_PRELOAD:
+                    self._phase("preload_caches", self._preload)
+            except Exception as error:
+                self.last_error = str(error)
+                print(f"Aquecimento falhou (tentativa {self.attempts}): {error}")
+                self._stop.wait(STARTUP_RETRY_SECONDS)
+                continue
+
+            self.ready_after_seconds = round(time.monotonic() - PROCESS_STARTED_AT, 3)
+            self.ready = True
+            print(f"Worker pronto em {self.ready_after_seconds}s (fases em ms: {self.phases_ms}).")
+            return
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.warm_up, name="startup-warmup", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> dict:
+        return {
+            "worker_pid": os.getpid(),
+            "ready": self.ready,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "phases_ms": self.phases_ms,
+            "ready_after_seconds": self.ready_after_seconds,
+            "uptime_seconds": round(time.monotonic() - PROCESS_STARTED_AT, 3)
+        }
+
+
+startup_state = StartupState()
@@ -0,0 +1,128 @@
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from columnar import (COLUMNS, POSTGRES_EPOCH_OFFSET_US, ColumnarCache, _record_dtype, _to_us, decode_binary_copy,
+                      plan_columnar_query)
+from querybuilder import QueryBuilder
+
+STATUSES = ["COMPLETED", "CANCELLED"]
+
+SALES = [
+    # id, loja, canal, cliente, status, created_at, total_amount
+    (1, 1, 1, 10, "COMPLETED", datetime(2024, 1, 1, 12), "10.50"),
+    (2, 1, 2, None, "COMPLETED", datetime(2024, 1, 1, 20), "20.25"),
+    (3, 2, 1, 11, "CANCELLED", datetime(2024, 1, 2, 9), "5.00"),
+    (4, 2, 1, 10, "COMPLETED", datetime(2024, 1, 2, 13), "7.00"),
+]
+
+
+def records(sales):
+    """Registros como o COPY binário de _copy_sql os entrega."""
+    data = np.zeros(len(sales), dtype=_record_dtype())
+    for index, (sale_id, store, channel, customer, status, created_at, amount) in enumerate(sales):
+        row = data[index]
+        row["field_count"] = len(COLUMNS) + sum(1 for column in COLUMNS.values() if column[3])
+        values = {
+            "id": sale_id, "store_id": store, "channel_id": channel, "customer_id": customer or 0,
+            "sale_status_desc": STATUSES.index(status),
+            "created_at": _to_us(created_at) - POSTGRES_EPOCH_OFFSET_US,
+            "total_amount": int(Decimal(amount) * 100)
+        }
+        for name, (_, wire_type, _, nullable, _) in COLUMNS.items():
+            row[f"{name}__len"] = np.dtype(wire_type).itemsize
+            row[name] = values.get(name, 0)
+            if nullable:
+                row[f"{name}__valid_len"] = 1
+                row[f"{name}__valid"] = name != "customer_id" or customer is not None
+    return data
+
+
+def copy_payload(data):
+    header = b"PGCOPY\n\xff\r\n\x00" + (0).to_bytes(4, "big") + (4).to_bytes(4, "big") + b"\x00" * 4
+    return header + data.tobytes() + b"\xff\xff"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ColumnarCache(str(tmp_path))
+    meta = cache._new_meta(None)
+    meta["dictionary"] = STATUSES
+    cache._append(meta, records(SALES))
+    meta.update(horizon=1, refreshed_at=time.time(), complete=True, watermark=4)
+    cache._write_meta(meta)
+    return cache
+
+
+def run(cache, request, order_by=None, limit=100):
+    plan = plan_columnar_query(QueryBuilder(), request)
+    assert plan is not None
+    return cache.query(plan, order_by, limit)
+
+
+def test_decode_binary_copy_skips_header_extension():
+    data = records(SALES)
+    decoded = decode_binary_copy(copy_payload(data))
+    assert decoded.dtype.itemsize == _record_dtype().itemsize
+    assert decoded["id"].tolist() == [1, 2, 3, 4]
+    assert decoded["total_amount"].tolist() == [1050, 2025, 500, 700]
+    assert decoded["customer_id__valid"].tolist() == [True, False, True, True]
+
+
+def test_sum_grouped_by_store_in_cents(cache):
+    rows = run(cache, {"metric": {"func": "SUM", "column": "total_amount"}, "group_by": ["store_id"]},
+               order_by="store_id ASC")
+    assert rows == [
+        {"store_id": 1, "metric_result": Decimal("30.75")},
+        {"store_id": 2, "metric_result": Decimal("12.00")},
+    ]
+
+
+def test_avg_is_decimal_and_filters_apply(cache):
+    rows = run(cache, {
+        "metric": {"func": "AVG", "column": "total_amount"},
+        "filters": [{"column": "sale_status_desc", "op": "=", "value": "COMPLETED"}]
+    })
+    assert rows == [{"metric_result": (Decimal(1050 + 2025 + 700) / 3).scaleb(-2)}]
+    assert isinstance(rows[0]["metric_result"], Decimal)
+
+
+def test_null_customer_is_its_own_group(cache):
+    rows = run(cache, {"metric": {"func": "COUNT", "column": "total_amount"}, "group_by": ["customer_id"]},
+               order_by="customer_id ASC")
+    assert rows == [
+        {"customer_id": 10, "metric_result": 2},
+        {"customer_id": 11, "metric_result": 1},
+        {"customer_id": None, "metric_result": 1},
+    ]
+
+
+def test_day_grouping_and_created_at_window(cache):
+    rows = run(cache, {
+        "metric": {"func": "MAX", "column": "total_amount"},
+        "group_by": [{"column": "created_at", "granularity": "day"}],
+        "filters": [{"column": "created_at", "op": ">=", "value": "2024-01-01T13:00:00"}]
+    })
+    alias = QueryBuilder.DATE_GROUP_ALIAS
+    assert rows == [
+        {alias: datetime(2024, 1, 1), "metric_result": Decimal("20.25")},
+        {alias: datetime(2024, 1, 2), "metric_result": Decimal("7.00")},
+    ]
+
+
+def test_retire_and_reappend_replaces_old_version(cache):
+    meta = cache._read_meta()
+    assert cache._retire(meta, [2, 99]) == 1
+    changed = list(SALES[1])
+    changed[6] = "1.00"
+    cache._append(meta, records([tuple(changed)]))
+    meta["refreshed_at"] = time.time()
+    cache._write_meta(meta)
+
+    rows = run(cache, {"metric": {"func": "SUM", "column": "total_amount"}, "group_by": ["store_id"]},
+               order_by="store_id ASC")
+    assert rows[0] == {"store_id": 1, "metric_result": Decimal("11.50")}
+    assert (meta["rows"], meta["dead"], meta["live_file"]) == (5, 1, "live.1.bin")
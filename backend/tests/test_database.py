@@ -0,0 +1,148 @@
+import psycopg2
+import pytest
+from psycopg2 import pool
+
+import database
+from database import Replica
+
+
+class FakeConn:
+    closed = 0
+
+    def __init__(self, lag):
+        self.lag = lag
+        self.lag_queries = 0
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.lag_queries += 1
+        if isinstance(self.lag, Exception):
+            raise self.lag
+
+    def fetchone(self):
+        return (self.lag,)
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    """Pool de uma réplica: devolve a conexão dada ou levanta o erro dado."""
+
+    def __init__(self, result):
+        self.result = result
+        self.returned = []
+
+    def getconn(self):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+    def putconn(self, conn, close=False):
+        self.returned.append((conn, close))
+
+
+PRIMARY = object()
+
+
+def replica(name, result):
+    replica = Replica(f"postgresql://user@{name}/db")
+    replica.pools[None] = FakePool(result)
+    return replica
+
+
+@pytest.fixture
+def route(monkeypatch):
+    def configure(*configured):
+        monkeypatch.setattr(database, "replicas", list(configured))
+        monkeypatch.setattr(database, "_replica_cursor", 0)
+        monkeypatch.setattr(database, "get_db_connection", lambda: PRIMARY)
+        return database._route_read
+    return configure
+
+
+def test_healthy_replica_serves_and_gets_the_connection_back(route):
+    healthy = replica("r1", FakeConn(lag=0.5))
+    conn = route(healthy)()
+    assert conn is healthy.pools[None].result
+    assert healthy.in_use == 1
+    database.release_db_connection(conn)
+    assert healthy.in_use == 0
+    assert healthy.pools[None].returned == [(conn, False)]
+
+
+def test_lagging_replica_falls_back_to_primary_without_marking_down(route):
+    lagging = replica("r1", FakeConn(lag=database.DB_REPLICA_MAX_LAG_SECONDS + 1))
+    assert route(lagging)() is PRIMARY
+    assert lagging.pools[None].returned == [(lagging.pools[None].result, False)]
+    assert lagging.is_available() and lagging.lag_seconds > database.DB_REPLICA_MAX_LAG_SECONDS
+
+
+def test_replica_that_never_replayed_counts_as_lagging(route):
+    fresh = replica("r1", FakeConn(lag=None))
+    assert route(fresh)() is PRIMARY
+    assert fresh.lag_seconds is None
+
+
+def test_lag_is_checked_at_most_once_per_interval(route):
+    conn = FakeConn(lag=0.0)
+    healthy = replica("r1", conn)
+    read = route(healthy)
+    for _ in range(3):
+        database.release_db_connection(read())
+    assert conn.lag_queries == 1
+
+
+def test_down_replica_is_marked_and_skipped_until_retry(route, monkeypatch):
+    down = replica("r1", psycopg2.OperationalError("connection refused"))
+    healthy = replica("r2", FakeConn(lag=0.0))
+    read = route(down, healthy)
+    conn = read()
+    assert conn is healthy.pools[None].result
+    assert not down.is_available() and "connection refused" in down.last_error
+    database.release_db_connection(conn)
+
+    down.pools[None].result = AssertionError("réplica fora do ar não deve ser tentada")
+    database.release_db_connection(read())
+    database.release_db_connection(read())
+
+    monkeypatch.setattr(database.time, "monotonic", lambda: down.down_until + 1)
+    assert down.is_available()
+
+
+def test_error_during_lag_check_closes_the_connection_and_marks_down(route):
+    broken = FakeConn(lag=psycopg2.OperationalError("server closed the connection"))
+    failing = replica("r1", broken)
+    assert route(failing)() is PRIMARY
+    assert failing.pools[None].returned == [(broken, True)]
+    assert not failing.is_available()
+
+
+def test_exhausted_pool_keeps_the_replica_healthy(route):
+    busy = replica("r1", pool.PoolError("connection pool exhausted"))
+    healthy = replica("r2", FakeConn(lag=0.0))
+    conn = route(busy, healthy)()
+    assert conn is healthy.pools[None].result
+    assert busy.is_available() and busy.last_error is None
+    database.release_db_connection(conn)
+
+    # Todas sem conexão livre: vai para o primário, e nenhuma sai da rotação.
+    assert route(busy)() is PRIMARY
+    assert busy.is_available()
+
+
+def test_mark_down_sets_retry_window(monkeypatch):
+    monkeypatch.setattr(database.time, "monotonic", lambda: 100.0)
+    down = Replica("postgresql://user@r1/db")
+    down.mark_down(RuntimeError("boom"))
+    assert down.down_until == 100.0 + database.DB_REPLICA_RETRY_SECONDS
+    assert not down.is_available()
+    assert down.status()["last_error"] == "boom" and down.status()["host"] == "r1/db"
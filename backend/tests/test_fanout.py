@@ -0,0 +1,98 @@
+from datetime import datetime
+from decimal import Decimal
+
+import fanout
+from fanout import FanoutExecutor, _month_boundaries
+from query_helpers import created_at_window
+from querybuilder import QueryBuilder
+from sketches import HyperLogLog
+from workload import WorkloadClass, WorkloadTicket, _current_ticket
+
+
+def merge(func, partials, fields=("store_id",)):
+    rows = FanoutExecutor()._merge({"func": func, "fields": list(fields)}, partials, 11)
+    return sorted(rows, key=lambda row: row["store_id"])
+
+
+def test_merge_sum_and_min_by_group():
+    partials = [
+        [{"store_id": 1, "metric_result": Decimal("10.00")}, {"store_id": 2, "metric_result": None}],
+        [{"store_id": 1, "metric_result": Decimal("2.50")}, {"store_id": 2, "metric_result": Decimal("1.00")}],
+    ]
+    assert merge("SUM", partials) == [
+        {"store_id": 1, "metric_result": Decimal("12.50")},
+        {"store_id": 2, "metric_result": Decimal("1.00")},
+    ]
+    assert merge("MIN", partials)[0]["metric_result"] == Decimal("2.50")
+
+
+def test_merge_avg_weights_by_count():
+    partials = [
+        [{"store_id": 1, "metric_sum": Decimal("30"), "metric_count": 3}],
+        [{"store_id": 1, "metric_sum": Decimal("10"), "metric_count": 1}],
+        [{"store_id": 1, "metric_sum": None, "metric_count": 0}],
+    ]
+    assert merge("AVG", partials) == [{"store_id": 1, "metric_result": Decimal("10")}]
+    assert merge("AVG", [[{"store_id": 1, "metric_sum": None, "metric_count": 0}]])[0]["metric_result"] is None
+
+
+def test_merge_count_distinct_unions_registers():
+    partials = [
+        [{"store_id": 1, "hll_registers": [0, 1], "hll_ranks": [3, 1]}],
+        [{"store_id": 1, "hll_registers": [1, 2, None], "hll_ranks": [2, 1, None]}],
+    ]
+    expected = HyperLogLog(11)
+    for register, rank in [(0, 3), (1, 2), (2, 1)]:
+        expected.add_register(register, rank)
+    assert merge("COUNT DISTINCT", partials) == [{"store_id": 1, "metric_result": expected.count()}]
+
+
+def test_month_boundaries_are_strictly_inside():
+    assert _month_boundaries(datetime(2024, 1, 15), datetime(2024, 4, 1)) == [
+        datetime(2024, 2, 1), datetime(2024, 3, 1)
+    ]
+    assert _month_boundaries(datetime(2024, 12, 1), datetime(2025, 1, 1)) == []
+
+
+def test_created_at_window_from_filters():
+    builder = QueryBuilder()
+    assert created_at_window(builder, [
+        {"column": "created_at", "op": "BETWEEN", "value": ["2024-01-01", "2024-03-01"]},
+        {"column": "store_id", "op": "=", "value": 1},
+    ]) == (datetime(2024, 1, 1), datetime(2024, 3, 1))
+    assert created_at_window(builder, [{"column": "created_at", "op": ">=", "value": "2024-01-01"}]) == (
+        datetime(2024, 1, 1), None
+    )
+
+
+def test_fanout_leaves_free_slots_in_the_request_class(monkeypatch):
+    workload_class = WorkloadClass("adhoc", 4, 0, 0.1, "normal", 5, "", None)
+    workload_class.admit(WorkloadTicket(workload_class))  # conexão da própria requisição
+    token = _current_ticket.set(WorkloadTicket(workload_class))
+    monkeypatch.setattr(fanout, "try_get_read_connection",
+                        lambda: object() if workload_class.try_admit() else None)
+    monkeypatch.setattr(fanout, "release_db_connection", lambda conn: workload_class.release())
+    seen = {}
+
+    def run(queries, conns):
+        seen["connections"] = len(conns)
+        # Outra requisição da mesma classe ainda é admitida durante o fan-out.
+        seen["other_admitted"] = workload_class.try_admit()
+        workload_class.release()
+        return [[] for _ in queries]
+
+    executor = FanoutExecutor()
+    monkeypatch.setattr(executor, "_run", run)
+    builder = QueryBuilder()
+    request = {
+        "metric": {"func": "SUM", "column": "total_amount"},
+        "filters": [{"column": "created_at", "op": "BETWEEN", "value": ["2023-01-01", "2024-01-01"]}]
+    }
+    try:
+        plan = executor.plan(builder, request)
+        assert len(plan["chunks"]) == 12
+        executor.execute(None, builder, request, plan, None, 100)
+    finally:
+        _current_ticket.reset(token)
+    assert seen == {"connections": 2, "other_admitted": True}
+    assert workload_class.status()["active"] == 1
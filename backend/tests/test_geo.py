@@ -0,0 +1,26 @@
+import pytest
+
+from geo import MAX_LATITUDE, tile_bounds, tile_xy
+
+
+def test_tile_xy_quadrants():
+    assert tile_xy(-90.0, 45.0, 1) == (0, 0)
+    assert tile_xy(90.0, -45.0, 1) == (1, 1)
+    assert tile_xy(0.0, 0.0, 0) == (0, 0)
+
+
+def test_tile_xy_clamps_to_the_grid():
+    assert tile_xy(180.0, 90.0, 3) == (7, 0)
+    assert tile_xy(-180.0, -90.0, 3) == (0, 7)
+
+
+@pytest.mark.parametrize("lon,lat,zoom", [(-46.63, -23.55, 12), (-43.2, -22.9, 15), (0.001, 0.001, 8)])
+def test_point_falls_inside_its_tile_bounds(lon, lat, zoom):
+    south, west, north, east = tile_bounds(*tile_xy(lon, lat, zoom), zoom)
+    assert south <= lat <= north and west <= lon <= east
+
+
+def test_tile_bounds_cover_web_mercator_range():
+    south, west, north, east = tile_bounds(0, 0, 0)
+    assert (west, east) == (-180.0, 180.0)
+    assert north == pytest.approx(MAX_LATITUDE) and south == pytest.approx(-MAX_LATITUDE)
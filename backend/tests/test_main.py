@@ -0,0 +1,50 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import main
+from singleflight import SingleFlight
+from workload import WorkloadClass, WorkloadRejected
+
+
+class EmptyCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+
+def test_followers_of_a_rejected_leader_get_503(monkeypatch):
+    flight = SingleFlight(timeout=5)
+    workload_class = WorkloadClass("dashboard", 1, 0, 0.1, "normal", 2, "", None)
+    monkeypatch.setattr(main, "query_flight", flight)
+    monkeypatch.setattr(main, "result_cache", EmptyCache())
+
+    @contextmanager
+    def rejected_connection():
+        # O líder só é recusado depois que o seguidor entrou na espera.
+        deadline = time.monotonic() + 2
+        while flight.stats()["waiting"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        raise WorkloadRejected(workload_class, "queue_full")
+        yield
+
+    monkeypatch.setattr(main, "read_connection", rejected_connection)
+    responses = {}
+
+    def call(name):
+        responses[name] = main.cached_json_response("analytics:key", 60, lambda conn: {"data": []})
+
+    leader = threading.Thread(target=call, args=("leader",))
+    leader.start()
+    while flight.stats()["in_flight"] == 0:
+        time.sleep(0.005)
+    call("follower")
+    leader.join(2)
+
+    for response in responses.values():
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "2"
+        assert response.headers["X-Workload-Class"] == "dashboard"
+    assert flight.stats()["coalesced"] == 1
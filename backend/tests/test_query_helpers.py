@@ -0,0 +1,26 @@
+import pytest
+
+from query_helpers import order_rows
+from querybuilder import QueryBuilder
+
+
+def test_order_rows_sql_defaults_and_nulls_first_desc():
+    rows = [{"store_id": 1, "metric_result": 5}, {"store_id": 2, "metric_result": None},
+            {"store_id": 3, "metric_result": 9}]
+    assert [row["store_id"] for row in order_rows(list(rows), None, ["store_id"], False, None)] == [2, 3, 1]
+    assert [row["store_id"] for row in order_rows(list(rows), "metric_result ASC", ["store_id"], False, 2)] == [1, 3]
+
+
+def test_order_rows_by_date_alias():
+    alias = QueryBuilder.DATE_GROUP_ALIAS
+    rows = [{alias: 2, "metric_result": 1}, {alias: 1, "metric_result": 2}]
+    assert [row[alias] for row in order_rows(list(rows), None, [], True, None)] == [1, 2]
+    # Sem agrupamento por data o alias não está no SELECT: quem chamou segue para o SQL.
+    assert order_rows(list(rows), alias, [], False, None) is None
+
+
+def test_order_rows_rejects_columns_outside_the_select():
+    with pytest.raises(ValueError):
+        order_rows([], "channel_id", ["store_id"], False, None)
+    with pytest.raises(ValueError):
+        order_rows([], "metric_result SIDEWAYS", ["store_id"], False, None)
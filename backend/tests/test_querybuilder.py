@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+from psycopg2 import sql
+
+from querybuilder import QueryBuilder, render_duckdb
+
+
+def test_render_duckdb_identifiers_literals_and_placeholders():
+    query = sql.SQL("SELECT {} FROM {} WHERE a = %s AND b LIKE 'x%%' AND c IN ({})").format(
+        sql.Identifier("sales", "total_amount"), sql.Identifier('we"ird'),
+        sql.SQL(", ").join([sql.Literal(None), sql.Literal(True), sql.Literal(1.5), sql.Literal("O'Hara")])
+    )
+    assert render_duckdb(query) == (
+        'SELECT "sales"."total_amount" FROM "we""ird" WHERE a = ? AND b LIKE \'x%\' '
+        "AND c IN (NULL, TRUE, 1.5, 'O''Hara')"
+    )
+
+
+def test_render_duckdb_rejects_placeholder_objects():
+    with pytest.raises(ValueError):
+        render_duckdb(sql.Placeholder("name"))
+
+
+def test_build_duckdb_query_uses_question_marks():
+    query, params = QueryBuilder().build_duckdb_query(
+        metric={"func": "SUM", "column": "total_amount"}, group_by=["store_id"],
+        filters=[{"column": "created_at", "op": ">=", "value": "2024-01-01"}], limit=10
+    )
+    assert "%s" not in query and "?" in query
+    assert query.count("?") == len(params)
+
+
+def test_build_duckdb_query_rejects_compare_to():
+    with pytest.raises(ValueError):
+        QueryBuilder().build_duckdb_query(metric={"func": "SUM", "column": "total_amount"}, compare_to="previous_period")
+
+
+def compare_windows(filters, compare_to):
+    return QueryBuilder()._resolve_compare_windows(filters, compare_to)
+
+
+def test_previous_period_of_half_open_window_ends_where_it_starts():
+    filters = [{"column": "created_at", "op": ">=", "value": "2024-02-01"},
+               {"column": "created_at", "op": "<", "value": "2024-03-01"}]
+    windows = compare_windows(filters, "previous_period")
+    assert windows["previous"] == (datetime(2024, 1, 3), datetime(2024, 2, 1))
+    query, params = QueryBuilder().build_analytics_query(
+        metric={"func": "SUM", "column": "total_amount"}, filters=filters, compare_to="previous_period"
+    )
+    assert query is not None and params
+
+
+def test_previous_period_of_closed_window_stops_one_second_before():
+    filters = [{"column": "created_at", "op": "BETWEEN", "value": ["2024-02-01", "2024-02-29 23:59:59"]}]
+    windows = compare_windows(filters, "previous_period")
+    assert windows["previous"][1] == datetime(2024, 1, 31, 23, 59, 59)
+
+
+def test_custom_offset_equal_to_window_length():
+    half_open = [{"column": "created_at", "op": ">=", "value": "2024-02-01"},
+                 {"column": "created_at", "op": "<", "value": "2024-02-08"}]
+    assert compare_windows(half_open, {"days": 7})["previous"] == (datetime(2024, 1, 25), datetime(2024, 2, 1))
+    closed = [{"column": "created_at", "op": ">=", "value": "2024-02-01"},
+              {"column": "created_at", "op": "<=", "value": "2024-02-08"}]
+    with pytest.raises(ValueError):
+        compare_windows(closed, {"days": 7})
+    with pytest.raises(ValueError):
+        compare_windows(half_open, {"days": 6})
@@ -0,0 +1,45 @@
+import pytest
+
+import rollup_scheduler
+
+
+class RecordingCache:
+    def __init__(self):
+        self.cleared = []
+
+    def clear(self, prefix=""):
+        self.cleared.append(prefix)
+
+
+@pytest.fixture
+def refresh(monkeypatch):
+    cache = RecordingCache()
+    monkeypatch.setattr(rollup_scheduler, "result_cache", cache)
+
+    def configure(rollups, customers):
+        monkeypatch.setattr(rollup_scheduler, "refresh_all_rollups", lambda conn: rollups)
+        monkeypatch.setattr(rollup_scheduler, "refresh_customer_metrics", lambda conn: customers)
+        return rollup_scheduler.refresh_rollups_and_metrics(None), cache.cleared
+    return configure
+
+
+def test_refresh_with_recomputed_days_clears_analytics_cache(refresh):
+    refreshed, cleared = refresh(
+        [{"rollup": "product_sales_daily", "mode": "incremental", "processed_days": 2}],
+        {"rollup": "customer_metrics", "mode": "incremental", "processed_customers": 0}
+    )
+    assert len(refreshed) == 2
+    assert cleared == ["analytics:"]
+
+
+def test_refresh_with_recomputed_customers_clears_analytics_cache(refresh):
+    _, cleared = refresh([], {"rollup": "customer_metrics", "mode": "incremental", "processed_customers": 5})
+    assert cleared == ["analytics:"]
+
+
+def test_refresh_without_changes_keeps_the_cache(refresh):
+    _, cleared = refresh(
+        [{"rollup": "product_sales_daily", "mode": "incremental", "processed_days": 0}],
+        {"rollup": "customer_metrics", "mode": "incremental", "processed_customers": 0}
+    )
+    assert cleared == []
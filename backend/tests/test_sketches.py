@@ -0,0 +1,112 @@
+import hashlib
+import random
+
+import pytest
+
+from sketches import DDSketch, HyperLogLog, SpaceSaving
+
+
+def hll_of(values, precision=11):
+    """HyperLogLog com o mesmo register/rank que o SQL do QueryBuilder calcula."""
+    sketch = HyperLogLog(precision)
+    bits = 63 - precision
+    for value in values:
+        hashed = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+        register = hashed & ((1 << precision) - 1)
+        rest = (hashed >> precision) & ((1 << bits) - 1)
+        sketch.add_register(register, bits + 1 - rest.bit_length())
+    return sketch
+
+
+@pytest.mark.parametrize("cardinality", [10, 1000, 50000])
+def test_hyperloglog_count_within_expected_error(cardinality):
+    estimate = hll_of(range(cardinality)).count()
+    # Erro padrão ~2,3% com precisão 11; 4 desvios de folga.
+    assert abs(estimate - cardinality) <= max(1, 0.1 * cardinality)
+
+
+def test_hyperloglog_merge_is_union():
+    left, right = hll_of(range(0, 30000)), hll_of(range(20000, 50000))
+    left.merge(right)
+    assert left.registers == hll_of(range(50000)).registers
+
+
+def test_hyperloglog_merge_rejects_other_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(11).merge(HyperLogLog(12))
+
+
+def test_hyperloglog_round_trip():
+    sketch = hll_of(range(500))
+    assert HyperLogLog.from_dict(sketch.to_dict()).registers == sketch.registers
+
+
+def test_ddsketch_quantiles_within_relative_accuracy():
+    rng = random.Random(7)
+    values = sorted(rng.lognormvariate(6, 1) for _ in range(20000))
+    sketch = DDSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+    for q in (0.5, 0.9, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= 0.01 * exact
+
+
+def test_ddsketch_merge_matches_single_sketch():
+    values = [float(v) for v in range(1, 1001)] + [0.0] * 10
+    whole, first, second = DDSketch(), DDSketch(), DDSketch()
+    for index, value in enumerate(values):
+        whole.add(value)
+        (first if index % 2 else second).add(value)
+    first.merge(second)
+    assert first.bins == whole.bins
+    assert first.zero_count == whole.zero_count == 10
+    assert first.count == whole.count
+    assert first.quantile(0.5) == whole.quantile(0.5)
+
+
+def test_ddsketch_empty_and_zero_values():
+    sketch = DDSketch()
+    assert sketch.quantile(0.5) is None
+    sketch.add(0)
+    sketch.add(0)
+    sketch.add(10)
+    assert sketch.quantile(0.1) == 0.0
+
+
+def test_ddsketch_round_trip_keeps_count():
+    sketch = DDSketch()
+    for value in (0, 1, 5, 5, 100):
+        sketch.add(value)
+    restored = DDSketch.from_dict(sketch.to_dict())
+    assert (restored.bins, restored.zero_count, restored.count) == (sketch.bins, sketch.zero_count, sketch.count)
+
+
+def test_ddsketch_merge_rejects_other_accuracy():
+    with pytest.raises(ValueError):
+        DDSketch(0.01).merge(DDSketch(0.02))
+
+
+def test_space_saving_exact_below_capacity():
+    sketch = SpaceSaving(capacity=10)
+    for key, weight in [("a", 3), ("b", 1), ("a", 2), ("c", 4)]:
+        sketch.update(key, weight)
+    assert sketch.top(2) == [("a", 5, 0.0), ("c", 4, 0.0)]
+
+
+def test_space_saving_bounds_hold_over_capacity():
+    rng = random.Random(3)
+    stream = [rng.choice("abcdefghij") if rng.random() < 0.3 else f"heavy{rng.randint(0, 2)}" for _ in range(5000)]
+    sketch = SpaceSaving(capacity=5)
+    for key in stream:
+        sketch.update(key)
+    for key, count, error in sketch.top(5):
+        assert count - error <= stream.count(key) <= count
+    assert {key for key, _, _ in sketch.top(3)} == {"heavy0", "heavy1", "heavy2"}
+
+
+def test_space_saving_round_trip():
+    sketch = SpaceSaving(capacity=3)
+    for key in "aabbbcd":
+        sketch.update(key)
+    assert SpaceSaving.from_dict(sketch.to_dict()).counters == sketch.counters
@@ -0,0 +1,41 @@
+import json
+from contextlib import contextmanager
+
+import warmer
+from singleflight import SingleFlight
+
+
+class MemoryCache:
+    def __init__(self):
+        self.entries = {}
+
+    def set(self, key, value, ttl):
+        self.entries[key] = value
+
+
+def test_warm_once_runs_each_query_on_a_single_connection(tmp_path, monkeypatch):
+    registry = tmp_path / "queries.json"
+    registry.write_text(json.dumps({"queries": [{"request": {
+        "metric": {"func": "SUM", "column": "total_amount"},
+        "filters": [{"column": "created_at", "op": "BETWEEN", "value": ["2023-01-01", "2024-01-01"]}]
+    }}]}))
+    calls, borrowed = [], []
+
+    @contextmanager
+    def connection():
+        borrowed.append(object())
+        yield borrowed[-1]
+
+    def execute(conn, request, **options):
+        calls.append(options)
+        return {"data": [], "status": "ok"}
+
+    monkeypatch.setattr(warmer, "read_connection", connection)
+    monkeypatch.setattr(warmer, "execute_flexible_query", execute)
+    monkeypatch.setattr(warmer, "result_cache", MemoryCache())
+    monkeypatch.setattr(warmer, "query_flight", SingleFlight())
+
+    result = warmer.CacheWarmer(registry_path=str(registry), max_connections=2).warm_once()
+    assert result["warmed"] == 1
+    assert calls == [{"fanout": False}]
+    assert len(borrowed) == 1
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from workload import (PRIORITIES, WorkloadClass, WorkloadRejected, WorkloadTicket, assign_class, close_ticket,
+                      current_ticket, open_ticket)
+
+
+def workload(max_connections=1, queue_size=4, queue_timeout=2.0):
+    return WorkloadClass("test", max_connections, queue_size, queue_timeout, "normal", 3, "", None)
+
+
+def admit_in_thread(workload_class, priority, admitted_order):
+    ticket = WorkloadTicket(workload_class, PRIORITIES[priority])
+
+    def run():
+        workload_class.admit(ticket)
+        admitted_order.append(priority)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_for_queue(workload_class, size):
+    deadline = time.monotonic() + 2
+    while workload_class.status()["queued_now"] < size:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_admits_up_to_max_connections():
+    workload_class = workload(max_connections=2)
+    for _ in range(2):
+        workload_class.admit(WorkloadTicket(workload_class))
+    assert workload_class.status()["active"] == 2
+    assert workload_class.free_slots() == 0
+    assert not workload_class.try_admit()
+    workload_class.release()
+    assert workload_class.free_slots() == 1
+
+
+def test_queued_requests_are_admitted_by_priority_then_arrival():
+    workload_class = workload()
+    workload_class.admit(WorkloadTicket(workload_class))
+    admitted = []
+    threads = []
+    for priority in ("low", "normal", "high"):
+        threads.append(admit_in_thread(workload_class, priority, admitted))
+        wait_for_queue(workload_class, len(threads))
+    # Com alguém na fila, a vaga é dele: o fan-out não passa na frente.
+    assert workload_class.free_slots() == 0 and not workload_class.try_admit()
+
+    for _ in threads:
+        workload_class.release()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join(2)
+    assert admitted == ["high", "normal", "low"]
+    status = workload_class.status()
+    assert (status["active"], status["queued"], status["admitted"]) == (1, 3, 4)
+
+
+def test_wait_timeout_rejects_and_leaves_the_queue():
+    workload_class = workload(queue_timeout=0.05)
+    workload_class.admit(WorkloadTicket(workload_class))
+    ticket = WorkloadTicket(workload_class)
+    with pytest.raises(WorkloadRejected) as rejected:
+        workload_class.admit(ticket)
+    assert rejected.value.reason == "timeout"
+    assert ticket.rejected is rejected.value
+    assert rejected.value.retry_after == 3
+    status = workload_class.status()
+    assert (status["queued_now"], status["rejected_timeout"]) == (0, 1)
+    workload_class.release()
+    assert workload_class.status()["active"] == 0
+
+
+def test_full_queue_rejects_immediately():
+    workload_class = workload(queue_size=0, queue_timeout=10)
+    workload_class.admit(WorkloadTicket(workload_class))
+    started = time.monotonic()
+    with pytest.raises(WorkloadRejected) as rejected:
+        workload_class.admit(WorkloadTicket(workload_class))
+    assert rejected.value.reason == "queue_full"
+    assert time.monotonic() - started < 1
+    assert workload_class.status()["rejected_queue_full"] == 1
+
+
+def test_assign_class_sets_server_side_priority():
+    ticket, token = open_ticket("dashboard")
+    try:
+        assert ticket.priority == ticket.workload_class.priority
+        assign_class("dashboard", "high")
+        assert current_ticket().priority == PRIORITIES["high"]
+        assign_class("adhoc")
+        assert (ticket.workload_class.name, ticket.priority) == ("adhoc", ticket.workload_class.priority)
+    finally:
+        close_ticket(token)
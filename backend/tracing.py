@@ -0,0 +1,181 @@
+"""
+Tracing leve por requisição: spans, header Server-Timing e exportação amostrada.
+
+O middleware de main.py abre um Trace por requisição em uma contextvar; os
+trechos instrumentados (validate, build, acquire, execute, fetch, serialize,
+cache) usam `with span(nome):`, que sem Trace ativo não faz nada. Cada span
+custa duas leituras de perf_counter e um append: o header Server-Timing sai
+em toda resposta, mas o log estruturado e a exportação só acontecem para as
+requisições sorteadas (TRACE_SAMPLE_RATE) ou lentas (TRACE_SLOW_MS).
+
+Exportadores (TRACE_EXPORTER):
+- "log" (padrão): uma linha JSON por trace no logger "tracing" (stderr).
+- "otlp_file": uma linha OTLP/JSON (resourceSpans) por trace em
+  TRACE_EXPORT_FILE, no formato lido pelo receiver otlpjsonfile do
+  OpenTelemetry Collector.
+- "none": só o Server-Timing.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") == "1"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "log")
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "traces.jsonl")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "godlevel-api")
+
+logger = logging.getLogger("tracing")
+if TRACE_EXPORTER == "log" and not logger.handlers:
+    # Só o logger de tracing ganha handler; a configuração global fica com quem roda o app.
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[int]] = ContextVar("current_span", default=None)
+_export_lock = threading.Lock()
+
+
+class Trace:
+    """Spans de uma requisição: [nome, índice do pai, início, fim, atributos]."""
+
+    __slots__ = ("name", "sampled", "started", "started_ns", "finished", "spans", "attributes")
+
+    def __init__(self, name: str, sampled: bool):
+        self.name = name
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.started_ns = time.time_ns()
+        self.finished = None
+        self.spans = []
+        self.attributes = {}
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.finished or time.perf_counter()) - self.started) * 1000
+
+    def server_timing(self) -> str:
+        """Header Server-Timing: duração somada por nome de span + total."""
+        totals = {}
+        for name, _, started, finished, _ in self.spans:
+            if finished is not None:
+                totals[name] = totals.get(name, 0.0) + (finished - started) * 1000
+        parts = [f"{name};dur={duration:.2f}" for name, duration in totals.items()]
+        parts.append(f"total;dur={self.duration_ms:.2f}")
+        return ", ".join(parts)
+
+    def should_export(self) -> bool:
+        if TRACE_EXPORTER == "none":
+            return False
+        return self.sampled or (TRACE_SLOW_MS > 0 and self.duration_ms >= TRACE_SLOW_MS)
+
+
+def start_trace(name: str):
+    """Abre um Trace na contextvar; devolve (trace, token) para finish_trace."""
+    trace = Trace(name, TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE)
+    return trace, _current_trace.set(trace)
+
+
+def finish_trace(trace: Trace, token):
+    trace.finished = time.perf_counter()
+    _current_trace.reset(token)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Mede um trecho dentro do Trace atual (sem Trace, não faz nada)."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    record = [name, _current_span.get(), time.perf_counter(), None, attributes]
+    trace.spans.append(record)
+    token = _current_span.set(len(trace.spans) - 1)
+    try:
+        yield
+    finally:
+        record[3] = time.perf_counter()
+        _current_span.reset(token)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def to_otlp(trace: Trace) -> dict:
+    """Trace no formato OTLP/JSON (um resourceSpans com o span raiz e os filhos)."""
+    trace_id = os.urandom(16).hex()
+    span_ids = [os.urandom(8).hex() for _ in range(len(trace.spans) + 1)]
+
+    def unix_ns(perf_value: float) -> str:
+        return str(trace.started_ns + int((perf_value - trace.started) * 1e9))
+
+    spans = [{
+        "traceId": trace_id,
+        "spanId": span_ids[0],
+        "name": trace.name,
+        "kind": 2,
+        "startTimeUnixNano": unix_ns(trace.started),
+        "endTimeUnixNano": unix_ns(trace.finished or time.perf_counter()),
+        "attributes": _otlp_attributes(trace.attributes)
+    }]
+    for index, (name, parent, started, finished, attributes) in enumerate(trace.spans):
+        spans.append({
+            "traceId": trace_id,
+            "spanId": span_ids[index + 1],
+            "parentSpanId": span_ids[0 if parent is None else parent + 1],
+            "name": name,
+            "kind": 1,
+            "startTimeUnixNano": unix_ns(started),
+            "endTimeUnixNano": unix_ns(finished if finished is not None else started),
+            "attributes": _otlp_attributes(attributes)
+        })
+
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({
+            "service.name": TRACE_SERVICE_NAME, "process.pid": os.getpid()
+        })},
+        "scopeSpans": [{"scope": {"name": "godlevel.tracing"}, "spans": spans}]
+    }]}
+
+
+def export_trace(trace: Trace):
+    """Grava o trace no exportador configurado (chamar só se should_export)."""
+    if TRACE_EXPORTER == "otlp_file":
+        line = json.dumps(to_otlp(trace), separators=(",", ":"))
+        with _export_lock, open(TRACE_EXPORT_FILE, "a", encoding="utf-8") as handle:
+            handle.write(line + "\n")
+    elif TRACE_EXPORTER == "log":
+        logger.info(json.dumps({
+            "trace": trace.name,
+            "duration_ms": round(trace.duration_ms, 2),
+            **trace.attributes,
+            "spans": [
+                {"name": name, "ms": round(((finished or started) - started) * 1000, 2), **attributes}
+                for name, _, started, finished, attributes in trace.spans
+            ]
+        }, default=str, ensure_ascii=False))
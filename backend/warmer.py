@@ -0,0 +1,192 @@
+"""
+Aquecimento do cache com as consultas dos dashboards.
+
+As consultas ficam registradas em dashboard_queries.json, com os mesmos corpos
+que os widgets do frontend enviam. Filtros de período usam marcadores
+({"$period_start": "este_mes"}) resolvidos por periods.py exatamente como o
+frontend, para que a chave gerada seja a mesma da requisição real.
+
+O aquecimento roda a cada WARMER_INTERVAL segundos e também quando chegam
+vendas novas (max(sales.id) mudou), usando no máximo WARMER_MAX_CONNECTIONS
+conexões ao mesmo tempo: cada tarefa usa uma conexão só, sem fan-out. Uso:
+    python warmer.py           # loop (worker separado)
+    python warmer.py --once    # uma rodada
+"""
+import argparse
+import fcntl
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+
+from analytics import flexible_query_key, flexible_query_shape, execute_flexible_query, reference_key, fetch_reference
+from cache import result_cache, serialize, CACHE_DIR, ANALYTICS_CACHE_TTL, REFERENCE_CACHE_TTL
+from database import read_connection
+from periods import resolve_request
+from singleflight import query_flight
+
+WARMER_REGISTRY = os.getenv(
+    "WARMER_REGISTRY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dashboard_queries.json")
+)
+WARMER_INTERVAL = float(os.getenv("WARMER_INTERVAL", "300"))
+WARMER_POLL_SECONDS = float(os.getenv("WARMER_POLL_SECONDS", "15"))
+WARMER_MAX_CONNECTIONS = int(os.getenv("WARMER_MAX_CONNECTIONS", "2"))
+# Um warmer por host: os workers disputam este lock e só um roda o loop.
+WARMER_LOCK_FILE = os.getenv("WARMER_LOCK_FILE", os.path.join(CACHE_DIR, ".warmer.lock"))
+
+
+def load_registry(path: str = WARMER_REGISTRY) -> dict:
+    with open(path, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+_shapes_cache = {"mtime": None, "shapes": frozenset()}
+_shapes_lock = threading.Lock()
+
+
+def dashboard_query_shapes(path: str = WARMER_REGISTRY) -> frozenset:
+    """Formatos (flexible_query_shape) dos widgets registrados; relido quando o arquivo muda."""
+    mtime = os.path.getmtime(path)
+    with _shapes_lock:
+        if _shapes_cache["mtime"] != mtime:
+            registry = load_registry(path)
+            _shapes_cache["shapes"] = frozenset(
+                flexible_query_shape(entry["request"]) for entry in registry.get("queries", [])
+            )
+            _shapes_cache["mtime"] = mtime
+        return _shapes_cache["shapes"]
+
+
+class CacheWarmer:
+    """Reexecuta as consultas registradas e grava os resultados no cache compartilhado."""
+
+    def __init__(self, registry_path: str = WARMER_REGISTRY, max_connections: int = WARMER_MAX_CONNECTIONS,
+                 interval: float = WARMER_INTERVAL, poll_seconds: float = WARMER_POLL_SECONDS):
+        self.registry_path = registry_path
+        self.max_connections = max_connections
+        self.interval = interval
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_handle = None
+        self.last_sale_id = None
+        self.last_run = None
+
+    def _warm_entry(self, key: str, ttl: float, compute) -> dict:
+        started = time.monotonic()
+
+        def load() -> bytes:
+            with read_connection() as conn:
+                body = serialize(compute(conn))
+            result_cache.set(key, body, int(ttl))
+            return body
+
+        try:
+            query_flight.do(key, load)
+            return {"key": key, "status": "ok", "seconds": round(time.monotonic() - started, 3)}
+        except Exception as error:
+            print(f"Erro ao aquecer {key}: {error}")
+            return {"key": key, "status": "error", "error": str(error)}
+
+    def warm_once(self) -> dict:
+        """Uma rodada: todas as consultas e referências, com concorrência limitada."""
+        registry = load_registry(self.registry_path)
+        # O TTL cobre o intervalo até a próxima rodada, para não esfriar entre elas.
+        analytics_ttl = max(ANALYTICS_CACHE_TTL, self.interval + self.poll_seconds)
+        reference_ttl = max(REFERENCE_CACHE_TTL, self.interval + self.poll_seconds)
+
+        jobs = []
+        for entry in registry.get("queries", []):
+            request = resolve_request(entry["request"])
+            jobs.append((
+                flexible_query_key(request), analytics_ttl,
+                lambda conn, request=request: execute_flexible_query(conn, request, fanout=False)
+            ))
+        for name in registry.get("references", []):
+            jobs.append((reference_key(name), reference_ttl, lambda conn, name=name: fetch_reference(conn, name)))
+
+        started = time.monotonic()
+        # Cada tarefa segura uma conexão: max_workers limita as conexões usadas.
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            results = list(executor.map(lambda job: self._warm_entry(*job), jobs))
+
+        self.last_run = {
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "seconds": round(time.monotonic() - started, 3),
+            "warmed": sum(1 for result in results if result["status"] == "ok"),
+            "errors": sum(1 for result in results if result["status"] == "error")
+        }
+        return {**self.last_run, "entries": results}
+
+    def _latest_sale_id(self) -> Optional[int]:
+        with read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT max(id) FROM sales;")
+            latest = cursor.fetchone()[0]
+            conn.rollback()
+        return latest
+
+    def run_forever(self):
+        next_full_run = 0.0
+        while not self._stop.is_set():
+            try:
+                latest = self._latest_sale_id()
+                new_sales = self.last_sale_id is not None and latest != self.last_sale_id
+                if new_sales or time.monotonic() >= next_full_run:
+                    self.warm_once()
+                    next_full_run = time.monotonic() + self.interval
+                self.last_sale_id = latest
+            except Exception as error:
+                print(f"Erro no aquecimento do cache: {error}")
+            self._stop.wait(self.poll_seconds)
+
+    def start(self) -> bool:
+        """Inicia o loop em uma thread, se nenhum outro worker do host já o tiver iniciado."""
+        os.makedirs(os.path.dirname(WARMER_LOCK_FILE), exist_ok=True)
+        self._lock_handle = open(WARMER_LOCK_FILE, "w")
+        try:
+            fcntl.flock(self._lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_handle.close()
+            self._lock_handle = None
+            return False
+        self._thread = threading.Thread(target=self.run_forever, name="cache-warmer", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_seconds)
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
+
+    def status(self) -> dict:
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "last_sale_id": self.last_sale_id,
+            "last_run": self.last_run,
+            "max_connections": self.max_connections
+        }
+
+
+cache_warmer = CacheWarmer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aquece o cache com as consultas dos dashboards.")
+    parser.add_argument("--once", action="store_true", help="Executa uma rodada e sai")
+    args = parser.parse_args()
+
+    if args.once:
+        print(json.dumps(cache_warmer.warm_once(), indent=2, ensure_ascii=False))
+        return
+    cache_warmer.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Isolamento de carga: dashboards x consultas ad-hoc.
+
+A classe de cada requisição é decidida no servidor, nunca por header do
+cliente: o middleware de main.py abre um WorkloadTicket na contextvar com
+WORKLOAD_DEFAULT_CLASS e o endpoint de consulta flexível reclassifica
+(assign_class) como "adhoc" tudo o que não tem o formato de um widget de
+dashboard_queries.json. A prioridade também vem do servidor: a da classe,
+ou a que o endpoint atribuir (os widgets registrados entram como "high").
+
+Com ticket ativo, database.get_read_connection passa pela admissão da classe:
+no máximo max_connections consultas ao mesmo tempo, cada uma na partição da
+classe dentro do pool do servidor escolhido pelo roteamento de réplicas (ou
+do primário), com os parâmetros de sessão da classe (work_mem,
+max_parallel_workers_per_gather, statement_timeout). Sem vaga, a requisição
+espera numa fila por prioridade (e ordem de chegada) de até queue_size
+lugares, por até queue_timeout segundos. Fila cheia ou espera esgotada viram
+503 com Retry-After. A fila é curta de propósito: cada espera prende uma
+thread do threadpool. Threads de fundo (warmer, colunar, ingestão) e
+escritas no primário não têm ticket e seguem no pool comum.
+
+As partições saem do orçamento DB_POOL_MAX de cada servidor: o pool comum fica
+com DB_POOL_MAX menos reserved_connections().
+
+Cada classe pode ser ajustada por variáveis WORKLOAD_<CLASSE>_<CHAVE>, ex.
+WORKLOAD_ADHOC_MAX_CONNECTIONS=2 ou WORKLOAD_ADHOC_DSN apontando para um
+servidor fixo (sem roteamento entre réplicas).
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from tracing import span
+
+WORKLOAD_ISOLATION = os.getenv("WORKLOAD_ISOLATION", "1") == "1"
+WORKLOAD_DEFAULT_CLASS = os.getenv("WORKLOAD_DEFAULT_CLASS", "dashboard")
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+# Widgets fixos: muitas consultas curtas e previsíveis, sem paralelismo por
+# consulta (muitas ao mesmo tempo) e timeout curto. Ad-hoc: poucas consultas
+# grandes, com memória e workers paralelos, mas presas a uma partição pequena.
+WORKLOAD_DEFAULTS = {
+    "dashboard": {
+        "max_connections": 8,
+        "queue_size": 16,
+        "queue_timeout": 5.0,
+        "priority": "normal",
+        "retry_after": 1,
+        "session_settings": (
+            "application_name=godlevel-dashboard;statement_timeout=15s;"
+            "work_mem=32MB;max_parallel_workers_per_gather=0"
+        ),
+        "dsn": None
+    },
+    "adhoc": {
+        "max_connections": 4,
+        "queue_size": 4,
+        "queue_timeout": 30.0,
+        "priority": "normal",
+        "retry_after": 5,
+        "session_settings": (
+            "application_name=godlevel-adhoc;statement_timeout=120s;"
+            "work_mem=256MB;max_parallel_workers_per_gather=4"
+        ),
+        "dsn": None
+    },
+}
+
+
+def _class_config(name: str, defaults: dict) -> dict:
+    """Padrões da classe sobrescritos por WORKLOAD_<CLASSE>_<CHAVE>."""
+    config = {}
+    for key, default in defaults.items():
+        value = os.getenv(f"WORKLOAD_{name.upper()}_{key.upper()}")
+        if value is None:
+            config[key] = default
+        elif isinstance(default, int):
+            config[key] = int(value)
+        elif isinstance(default, float):
+            config[key] = float(value)
+        else:
+            config[key] = value
+    return config
+
+
+class WorkloadRejected(Exception):
+    """Requisição recusada na admissão (fila cheia ou espera esgotada)."""
+
+    def __init__(self, workload_class: "WorkloadClass", reason: str):
+        super().__init__(f"Carga '{workload_class.name}' saturada ({reason}), tente novamente.")
+        self.workload_class = workload_class
+        self.reason = reason
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, self.workload_class.retry_after)
+
+
+class WorkloadClass:
+    """Limite de concorrência e fila por prioridade de uma classe de carga."""
+
+    def __init__(self, name: str, max_connections: int, queue_size: int, queue_timeout: float,
+                 priority: str, retry_after: int, session_settings: str, dsn: Optional[str]):
+        self.name = name
+        self.max_connections = max_connections
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.priority = PRIORITIES.get(priority, PRIORITIES["normal"])
+        self.retry_after = retry_after
+        self.session_settings = session_settings
+        self.dsn = dsn
+        self.active = 0
+        # heap de [prioridade, ordem de chegada, Event]
+        self._waiters = []
+        self._arrivals = itertools.count()
+        self._lock = threading.Lock()
+        self.counters = {
+            "admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0,
+            "wait_seconds_total": 0.0, "wait_seconds_max": 0.0
+        }
+
+    def free_slots(self) -> int:
+        """Vagas livres agora (zero com alguém na fila: a vaga é dele)."""
+        with self._lock:
+            return 0 if self._waiters else self.max_connections - self.active
+
+    def try_admit(self) -> bool:
+        """Ocupa uma vaga, se houver uma livre agora e ninguém na fila."""
+        with self._lock:
+            if self.active < self.max_connections and not self._waiters:
+                self.active += 1
+                self.counters["admitted"] += 1
+                return True
+            return False
+
+    def admit(self, ticket: "WorkloadTicket"):
+        """
+        Ocupa uma vaga, esperando na fila por até queue_timeout. Recusa
+        (WorkloadRejected, também guardada no ticket) com a fila cheia ou
+        depois da espera.
+        """
+        with self._lock:
+            if self.active < self.max_connections and not self._waiters:
+                self.active += 1
+                self.counters["admitted"] += 1
+                return
+            if len(self._waiters) >= self.queue_size:
+                self.counters["rejected_queue_full"] += 1
+                ticket.rejected = WorkloadRejected(self, "queue_full")
+                raise ticket.rejected
+            waiter = [ticket.priority, next(self._arrivals), threading.Event()]
+            heapq.heappush(self._waiters, waiter)
+            self.counters["queued"] += 1
+
+        started = time.perf_counter()
+        with span("admission", workload=self.name):
+            admitted = waiter[2].wait(self.queue_timeout)
+        waited = time.perf_counter() - started
+        with self._lock:
+            # A vaga pode ter chegado entre o timeout e o lock.
+            if not admitted and not waiter[2].is_set():
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self.counters["rejected_timeout"] += 1
+                ticket.rejected = WorkloadRejected(self, "timeout")
+                raise ticket.rejected
+            self.counters["admitted"] += 1
+            self.counters["wait_seconds_total"] += waited
+            self.counters["wait_seconds_max"] = max(self.counters["wait_seconds_max"], waited)
+
+    def release(self):
+        """Devolve a vaga: passa direto para o primeiro da fila, se houver."""
+        with self._lock:
+            if self._waiters:
+                heapq.heappop(self._waiters)[2].set()
+            else:
+                self.active -= 1
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "max_connections": self.max_connections,
+                "active": self.active,
+                "queued_now": len(self._waiters),
+                "queue_size": self.queue_size,
+                "queue_timeout_seconds": self.queue_timeout,
+                "retry_after_seconds": self.retry_after,
+                "session_settings": self.session_settings,
+                **self.counters
+            }
+
+
+workload_classes = {
+    name: WorkloadClass(name, **_class_config(name, defaults))
+    for name, defaults in WORKLOAD_DEFAULTS.items()
+}
+
+
+def reserved_connections() -> int:
+    """Conexões de cada servidor reservadas às partições das classes (fora do pool comum)."""
+    if not WORKLOAD_ISOLATION:
+        return 0
+    return sum(workload_class.max_connections for workload_class in workload_classes.values())
+
+
+class WorkloadTicket:
+    """Classe e prioridade da requisição atual (e a recusa, se houve)."""
+
+    __slots__ = ("workload_class", "priority", "rejected")
+
+    def __init__(self, workload_class: WorkloadClass, priority: Optional[int] = None):
+        self.workload_class = workload_class
+        self.priority = workload_class.priority if priority is None else priority
+        self.rejected = None
+
+
+_current_ticket: ContextVar[Optional[WorkloadTicket]] = ContextVar("current_workload_ticket", default=None)
+
+
+def open_ticket(class_name: str = WORKLOAD_DEFAULT_CLASS):
+    """Abre o ticket da requisição com a classe padrão (o endpoint pode reclassificar)."""
+    ticket = WorkloadTicket(workload_classes[class_name])
+    return ticket, _current_ticket.set(ticket)
+
+
+def close_ticket(token):
+    _current_ticket.reset(token)
+
+
+def current_ticket() -> Optional[WorkloadTicket]:
+    return _current_ticket.get()
+
+
+def assign_class(class_name: str, priority_name: Optional[str] = None):
+    """
+    Reclassifica a requisição atual antes de ela pedir conexão; sem
+    priority_name, fica a prioridade padrão da classe. O endpoint roda no
+    threadpool com uma cópia do contexto, mas o ticket é o mesmo objeto.
+    """
+    ticket = _current_ticket.get()
+    if ticket is not None:
+        ticket.workload_class = workload_classes[class_name]
+        ticket.priority = PRIORITIES[priority_name] if priority_name else ticket.workload_class.priority
+
+
+def workload_stats() -> dict:
+    """Vagas, fila e recusas de cada classe neste worker."""
+    return {
+        "worker_pid": os.getpid(),
+        "enabled": WORKLOAD_ISOLATION,
+        "default_class": WORKLOAD_DEFAULT_CLASS,
+        "reserved_connections": reserved_connections(),
+        "classes": {name: workload_class.status() for name, workload_class in workload_classes.items()}
+    }
@@ -181,6 +181,27 @@ CREATE TABLE delivery_sales (
     mode VARCHAR(100)
 );
 
+-- Célula da grade do mapa (tile Web Mercator x/y no zoom dado) de uma coordenada,
+-- codificada como x * 2^zoom + y. Ver backend/geo.py.
+CREATE OR REPLACE FUNCTION geo_tile_cell(lon DOUBLE PRECISION, lat DOUBLE PRECISION, zoom INTEGER)
+RETURNS BIGINT AS $$
+    SELECT LEAST(GREATEST(floor((lon + 180.0) / 360.0 * 2 ^ zoom), 0), 2 ^ zoom - 1)::BIGINT * (2 ^ zoom)::BIGINT
+        + LEAST(GREATEST(floor(
+            (1.0 - ln(tan(radians(c.lat)) + 1.0 / cos(radians(c.lat))) / pi()) / 2.0 * 2 ^ zoom
+        ), 0), 2 ^ zoom - 1)::BIGINT
+    FROM (SELECT LEAST(GREATEST(lat, -85.05112878), 85.05112878) AS lat) AS c
+$$ LANGUAGE SQL IMMUTABLE STRICT PARALLEL SAFE;
+
+-- Distância em linha reta (haversine), em km
+CREATE OR REPLACE FUNCTION geo_distance_km(
+    lat1 DOUBLE PRECISION, lon1 DOUBLE PRECISION, lat2 DOUBLE PRECISION, lon2 DOUBLE PRECISION
+) RETURNS DOUBLE PRECISION AS $$
+    SELECT 2 * 6371.0088 * asin(sqrt(
+        power(sin(radians(lat2 - lat1) / 2), 2)
+        + cos(radians(lat1)) * cos(radians(lat2)) * power(sin(radians(lon2 - lon1) / 2), 2)
+    ))
+$$ LANGUAGE SQL IMMUTABLE STRICT PARALLEL SAFE;
+
 CREATE TABLE delivery_addresses (
     id SERIAL PRIMARY KEY,
     sale_id INTEGER NOT NULL REFERENCES sales(id) ON DELETE CASCADE,
@@ -196,9 +217,38 @@ CREATE TABLE delivery_addresses (
     postal_code VARCHAR(20),
     reference VARCHAR(300),
     latitude FLOAT,
-    longitude FLOAT
+    longitude FLOAT,
+    
+    -- Células do heatmap, calculadas na escrita (zooms de GEO_CELL_ZOOMS em backend/geo.py)
+    geo_cell_z8 BIGINT GENERATED ALWAYS AS (geo_tile_cell(longitude, latitude, 8)) STORED,
+    geo_cell_z11 BIGINT GENERATED ALWAYS AS (geo_tile_cell(longitude, latitude, 11)) STORED,
+    geo_cell_z14 BIGINT GENERATED ALWAYS AS (geo_tile_cell(longitude, latitude, 14)) STORED,
+    geo_cell_z17 BIGINT GENERATED ALWAYS AS (geo_tile_cell(longitude, latitude, 17)) STORED,
+    -- Distância da loja da venda até o endereço (trigger trg_delivery_addresses_distance)
+    distance_km DOUBLE PRECISION
 );
 
+CREATE INDEX idx_delivery_addresses_cell_z8 ON delivery_addresses(geo_cell_z8, sale_id);
+CREATE INDEX idx_delivery_addresses_cell_z11 ON delivery_addresses(geo_cell_z11, sale_id);
+CREATE INDEX idx_delivery_addresses_cell_z14 ON delivery_addresses(geo_cell_z14, sale_id);
+CREATE INDEX idx_delivery_addresses_cell_z17 ON delivery_addresses(geo_cell_z17, sale_id);
+
+CREATE OR REPLACE FUNCTION set_delivery_distance() RETURNS trigger AS $$
+BEGIN
+    SELECT geo_distance_km(st.latitude, st.longitude, NEW.latitude, NEW.longitude)
+    INTO NEW.distance_km
+    FROM sales s
+    JOIN stores st ON st.id = s.store_id
+    WHERE s.id = NEW.sale_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_delivery_addresses_distance
+    BEFORE INSERT OR UPDATE OF latitude, longitude, sale_id ON delivery_addresses
+    FOR EACH ROW
+    EXECUTE FUNCTION set_delivery_distance();
+
 CREATE TABLE payment_types (
     id SERIAL PRIMARY KEY,
     brand_id INTEGER REFERENCES brands(id),
@@ -233,4 +283,277 @@ CREATE TABLE coupon_sales (
     value FLOAT,
     target VARCHAR(100),
     sponsorship VARCHAR(100)
-);
\ No newline at end of file
+);
+
+-- ============================================================
+-- Rollups mantidos incrementalmente (ver backend/rollups.py)
+-- ============================================================
+
+-- Horizonte de transação (xmin do snapshot) do último refresh de cada rollup
+-- (ver backend/changes.py). updated_at marca o último refresh completo.
+CREATE TABLE rollup_watermarks (
+    name VARCHAR(100) PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Vendas inseridas, alteradas ou removidas (ou com itens alterados), por
+-- transação. Gravado pelos triggers trg_*_changes no fim do arquivo.
+CREATE TABLE sales_changes (
+    txid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    sale_id INTEGER NOT NULL,
+    sale_date DATE,
+    customer_id INTEGER,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_sales_changes_txid ON sales_changes(txid);
+
+-- Última transação que alterou cada tabela de dimensão lida pelo snapshot
+-- DuckDB (trigger trg_*_dimension_changes no fim do arquivo).
+CREATE TABLE dimension_changes (
+    table_name VARCHAR(100) PRIMARY KEY,
+    txid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Sketches serializados (heavy hitters, etc.)
+CREATE TABLE rollup_sketches (
+    name VARCHAR(100) PRIMARY KEY,
+    payload JSONB NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- product_sales agregado por dia/produto/loja/canal (apenas vendas COMPLETED)
+CREATE TABLE product_sales_daily (
+    sale_date DATE NOT NULL,
+    product_id INTEGER NOT NULL REFERENCES products(id),
+    store_id INTEGER NOT NULL REFERENCES stores(id),
+    channel_id INTEGER NOT NULL REFERENCES channels(id),
+    total_quantity FLOAT NOT NULL DEFAULT 0,
+    total_revenue FLOAT NOT NULL DEFAULT 0,
+    line_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_date, product_id, store_id, channel_id)
+);
+
+CREATE INDEX idx_product_sales_daily_product ON product_sales_daily(product_id, sale_date);
+
+-- Customizações (item_product_sales + item_item_product_sales) por dia/item/produto/loja/canal
+-- attach_count = linhas de product_sales que levaram o item
+CREATE TABLE item_product_sales_daily (
+    sale_date DATE NOT NULL,
+    item_id INTEGER NOT NULL REFERENCES items(id),
+    product_id INTEGER NOT NULL REFERENCES products(id),
+    store_id INTEGER NOT NULL REFERENCES stores(id),
+    channel_id INTEGER NOT NULL REFERENCES channels(id),
+    attach_count INTEGER NOT NULL DEFAULT 0,
+    item_quantity FLOAT NOT NULL DEFAULT 0,
+    item_revenue FLOAT NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_date, item_id, product_id, store_id, channel_id)
+);
+
+CREATE INDEX idx_item_product_sales_daily_product ON item_product_sales_daily(product_id, sale_date);
+
+-- Bins de DDSketch (precisão relativa de 1%) de delivery_seconds/production_seconds
+-- por dia/loja/canal. Somar value_count por bin em qualquer recorte dá o sketch mergeado.
+CREATE TABLE sales_timing_daily (
+    metric VARCHAR(50) NOT NULL,
+    sale_date DATE NOT NULL,
+    store_id INTEGER NOT NULL REFERENCES stores(id),
+    channel_id INTEGER NOT NULL REFERENCES channels(id),
+    bin INTEGER NOT NULL,
+    value_count BIGINT NOT NULL DEFAULT 0,
+    value_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric, sale_date, store_id, channel_id, bin)
+);
+
+-- Agregado por cliente (vendas COMPLETED), recalculado por cliente alterado em backend/customer_metrics.py.
+-- Loja/canal favoritos = mais pedidos em customer_store_channel_orders.
+CREATE TABLE customer_metrics (
+    customer_id INTEGER PRIMARY KEY REFERENCES customers(id),
+    first_purchase_at TIMESTAMP NOT NULL,
+    last_purchase_at TIMESTAMP NOT NULL,
+    order_count INTEGER NOT NULL DEFAULT 0,
+    total_spent NUMERIC(14,2) NOT NULL DEFAULT 0,
+    favorite_store_id INTEGER REFERENCES stores(id),
+    favorite_channel_id INTEGER REFERENCES channels(id),
+    cohort_month DATE GENERATED ALWAYS AS (DATE_TRUNC('month', first_purchase_at)::DATE) STORED,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_customer_metrics_cohort ON customer_metrics(cohort_month);
+
+-- Recálculo das métricas dos clientes alterados (customer_metrics.py)
+CREATE INDEX idx_sales_customer ON sales(customer_id) WHERE customer_id IS NOT NULL;
+
+-- Pedidos por cliente/loja/canal (base da loja e do canal favoritos)
+CREATE TABLE customer_store_channel_orders (
+    customer_id INTEGER NOT NULL REFERENCES customers(id),
+    store_id INTEGER NOT NULL REFERENCES stores(id),
+    channel_id INTEGER NOT NULL REFERENCES channels(id),
+    order_count INTEGER NOT NULL DEFAULT 0,
+    total_spent NUMERIC(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (customer_id, store_id, channel_id)
+);
+
+-- Pedidos por cliente/mês (matriz de coortes)
+CREATE TABLE customer_monthly_activity (
+    customer_id INTEGER NOT NULL REFERENCES customers(id),
+    activity_month DATE NOT NULL,
+    order_count INTEGER NOT NULL DEFAULT 0,
+    total_spent NUMERIC(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (customer_id, activity_month)
+);
+
+-- ============================================================================
+-- Notificação de vendas novas (dashboards ao vivo)
+-- ============================================================================
+
+-- Um NOTIFY por comando INSERT (não por linha), com o intervalo de ids e de
+-- created_at inserido. Entregue no COMMIT, quando product_sales etc. da mesma
+-- transação já estão visíveis.
+CREATE OR REPLACE FUNCTION notify_sales_inserted() RETURNS trigger AS $$
+DECLARE
+    payload JSON;
+BEGIN
+    SELECT json_build_object(
+        'min_id', MIN(id),
+        'max_id', MAX(id),
+        'min_created_at', MIN(created_at),
+        'max_created_at', MAX(created_at),
+        'count', COUNT(*)
+    )
+    INTO payload
+    FROM new_sales;
+
+    IF (payload->>'count')::INTEGER > 0 THEN
+        PERFORM pg_notify('sales_inserted', payload::TEXT);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_sales_inserted_notify
+    AFTER INSERT ON sales
+    REFERENCING NEW TABLE AS new_sales
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_sales_inserted();
+
+-- ============================================================================
+-- Log de alterações de vendas (rollups, métricas de clientes, cópias analíticas)
+-- ============================================================================
+
+-- Uma linha em sales_changes por venda tocada no comando, com dia e cliente
+-- (antes e depois, num UPDATE). Mudanças em itens viram a venda dona do item;
+-- se a venda já foi removida (CASCADE), o DELETE dela já foi registrado.
+-- Um trigger com tabela de transição só aceita um evento, daí três por tabela.
+CREATE OR REPLACE FUNCTION log_sales_changes() RETURNS trigger AS $$
+DECLARE
+    source TEXT;
+    rows_table TEXT;
+BEGIN
+    source := CASE
+        WHEN TG_TABLE_NAME = 'sales' THEN
+            'SELECT r.id, r.created_at::DATE, r.customer_id FROM %I r'
+        WHEN TG_TABLE_NAME IN ('product_sales', 'delivery_addresses') THEN
+            'SELECT DISTINCT s.id, s.created_at::DATE, s.customer_id
+             FROM %I r JOIN sales s ON s.id = r.sale_id'
+        WHEN TG_TABLE_NAME = 'item_product_sales' THEN
+            'SELECT DISTINCT s.id, s.created_at::DATE, s.customer_id
+             FROM %I r
+             JOIN product_sales ps ON ps.id = r.product_sale_id
+             JOIN sales s ON s.id = ps.sale_id'
+        ELSE
+            'SELECT DISTINCT s.id, s.created_at::DATE, s.customer_id
+             FROM %I r
+             JOIN item_product_sales ips ON ips.id = r.item_product_sale_id
+             JOIN product_sales ps ON ps.id = ips.product_sale_id
+             JOIN sales s ON s.id = ps.sale_id'
+    END;
+
+    FOREACH rows_table IN ARRAY (CASE TG_OP
+        WHEN 'INSERT' THEN ARRAY['new_rows']
+        WHEN 'DELETE' THEN ARRAY['old_rows']
+        ELSE ARRAY['old_rows', 'new_rows']
+    END) LOOP
+        EXECUTE 'INSERT INTO sales_changes (sale_id, sale_date, customer_id) '
+            || format(source, rows_table);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_sales_insert_changes AFTER INSERT ON sales
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+CREATE TRIGGER trg_sales_update_changes AFTER UPDATE ON sales
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+CREATE TRIGGER trg_sales_delete_changes AFTER DELETE ON sales
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+
+CREATE TRIGGER trg_product_sales_insert_changes AFTER INSERT ON product_sales
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+CREATE TRIGGER trg_product_sales_update_changes AFTER UPDATE ON product_sales
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+CREATE TRIGGER trg_product_sales_delete_changes AFTER DELETE ON product_sales
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+
+CREATE TRIGGER trg_item_product_sales_insert_changes AFTER INSERT ON item_product_sales
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+CREATE TRIGGER trg_item_product_sales_update_changes AFTER UPDATE ON item_product_sales
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+CREATE TRIGGER trg_item_product_sales_delete_changes AFTER DELETE ON item_product_sales
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+
+CREATE TRIGGER trg_item_item_product_sales_insert_changes AFTER INSERT ON item_item_product_sales
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+CREATE TRIGGER trg_item_item_product_sales_update_changes AFTER UPDATE ON item_item_product_sales
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+CREATE TRIGGER trg_item_item_product_sales_delete_changes AFTER DELETE ON item_item_product_sales
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+
+CREATE TRIGGER trg_delivery_addresses_insert_changes AFTER INSERT ON delivery_addresses
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+CREATE TRIGGER trg_delivery_addresses_update_changes AFTER UPDATE ON delivery_addresses
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+CREATE TRIGGER trg_delivery_addresses_delete_changes AFTER DELETE ON delivery_addresses
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION log_sales_changes();
+
+-- Dimensões: só a última transação por tabela (o snapshot DuckDB inteiro deixa de valer).
+CREATE OR REPLACE FUNCTION log_dimension_changes() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO dimension_changes (table_name) VALUES (TG_TABLE_NAME)
+    ON CONFLICT (table_name) DO UPDATE
+    SET txid = pg_current_xact_id(), changed_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_products_dimension_changes AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON products
+    FOR EACH STATEMENT EXECUTE FUNCTION log_dimension_changes();
+CREATE TRIGGER trg_items_dimension_changes AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON items
+    FOR EACH STATEMENT EXECUTE FUNCTION log_dimension_changes();
+CREATE TRIGGER trg_option_groups_dimension_changes AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON option_groups
+    FOR EACH STATEMENT EXECUTE FUNCTION log_dimension_changes();
+CREATE TRIGGER trg_customers_dimension_changes AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON customers
+    FOR EACH STATEMENT EXECUTE FUNCTION log_dimension_changes();
+
+-- ============================================================================
+-- Checkpoints do gerador de dados (generate_data.py --append / --resume)
+-- ============================================================================
+
+-- Uma linha por execução; last_completed_day é gravado no mesmo COMMIT das vendas do dia.
+CREATE TABLE IF NOT EXISTS generator_runs (
+    id SERIAL PRIMARY KEY,
+    mode VARCHAR(20) NOT NULL,
+    start_at TIMESTAMP NOT NULL,
+    end_at TIMESTAMP NOT NULL,
+    daily_sales INTEGER NOT NULL,
+    seed INTEGER,
+    anomaly_week TIMESTAMP,
+    promo_day TIMESTAMP,
+    last_completed_day DATE,
+    total_sales BIGINT NOT NULL DEFAULT 0,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
@@ -59,23 +59,18 @@ const FaturamentoPorLoja = ({ queueIndex }) => {
           value: 'COMPLETED'
         }],
         order_by: "metric_result DESC",
-        limit: 10 
+        limit: 10,
+        enrich: true
       };
 
       try {
-        const [responseSales, responseStores] = await Promise.all([
-          axios.post('http://127.0.0.1:8000/api/v1/analytics/query', salesRequest),
-          axios.get('http://127.0.0.1:8000/api/v1/reference/stores')
-        ]);
+        const responseSales = await axios.post('http://127.0.0.1:8000/api/v1/analytics/query', salesRequest);
 
         const salesData = responseSales.data.data;
-        const storesData = responseStores.data.data;
-
-        const storeMap = new Map(storesData.map(s => [s.id, s.name]));
 
         const dadosCombinados = salesData.map(item => {
           return {
-            name: storeMap.get(item.store_id) || `Loja ID ${item.store_id}`,
+            name: item.store?.name || `Loja ID ${item.store_id}`,
             value: parseFloat(item.metric_result) 
           };
         });
@@ -98,7 +98,8 @@ const Faturamentosimples = () => {
           ...filtrosDeData 
         ],
         order_by: "date_group_field ASC", 
-        limit: 100
+        limit: 100,
+        compare_to: 'previous_period'
       };
       try {
         const response = await axios.post('http://127.0.0.1:8000/api/v1/analytics/query', requestBody );
@@ -160,6 +161,13 @@ const Faturamentosimples = () => {
                 stroke="#8884d8" 
                 strokeWidth={2}
               />
+              <Line 
+                type="monotone" 
+                dataKey="metric_previous" 
+                name="Período Anterior" 
+                stroke="#bbbbbb" 
+                strokeDasharray="5 5"
+              />
             </LineChart>
           </ResponsiveContainer>
         )}
@@ -5,6 +5,7 @@ const QueryBuilder = () => {
     const [metric, setMetric] = useState('SUM');
     const [column, setColumn] = useState('total_amount');
     const [groupBy, setGroupBy] = useState('channel_id');
+    const [channelType, setChannelType] = useState('');
     const [results, setResults] = useState(null);
     const [error, setError] = useState(null);
     const handleSubmit = async (e) => {
@@ -22,14 +23,25 @@ const QueryBuilder = () => {
                     column: 'sale_status_desc',
                     op: '=',
                     value: 'COMPLETED'
-                }
+                },
+                ...(channelType ? [{
+                    column: 'channels.type',
+                    op: '=',
+                    value: channelType
+                }] : [])
             ],
             limit: 10
         };
         try {
+            // O backend classifica consultas livres como "adhoc" (partição própria, sem disputar com os dashboards).
             const response = await axios.post('http://127.0.0.1:8000/api/v1/analytics/query', requestBody);
             setResults(response.data.data);
         } catch (err) {
+            if (err.response?.status === 503) {
+                const retryAfter = err.response.headers['retry-after'];
+                setError(`Muitas consultas em andamento. Tente novamente em ${retryAfter || 'alguns'} segundos.`);
+                return;
+            }
             setError('Ocorreu um erro ao buscar os dados. Verifique o console para mais detalhes.');
             console.error(err);
         }
@@ -53,6 +65,12 @@ const QueryBuilder = () => {
                         <option value="channel_id">Canal</option>
                         <option value="store_id">Loja</option>
                     </select>
+                    <label>Tipo de canal:</label>
+                    <select value={channelType} onChange={(e) => setChannelType(e.target.value)}>
+                        <option value="">Todos</option>
+                        <option value="P">Presencial</option>
+                        <option value="D">Delivery</option>
+                    </select>
                 </div>
                     <button type="submit">Executar Query</button>
             </form>
@@ -30,26 +30,22 @@ const Vendascanais = ({ queueIndex }) => {
           value: 'COMPLETED'
         }],
         order_by: "metric_result DESC",
-        limit: 10
+        limit: 10,
+        enrich: true
       };
       try {
-        const [responseSales, responseChannels] = await Promise.all([
-          axios.post('http://127.0.0.1:8000/api/v1/analytics/query', salesRequest),
-          axios.get('http://127.0.0.1:8000/api/v1/reference/channels')
-        ]);
+        const responseSales = await axios.post('http://127.0.0.1:8000/api/v1/analytics/query', salesRequest);
         const salesData = responseSales.data.data;
-        const channelsData = responseChannels.data.data;
-        const channelMap = new Map(channelsData.map(c => [c.id, c.name]));
         const dadosCombinados = salesData.map(item => {
           const stringValor = String(item.metric_result);
           const valorLimpo = stringValor.replace(/[^0-9]/g, '');
           const valorNumerico = parseFloat(valorLimpo);
           return {
-            name: channelMap.get(item.channel_id) || `Canal ID ${item.channel_id}`,
+            name: item.channel?.name || `Canal ID ${item.channel_id}`,
             value: isNaN(valorNumerico) ? 0 : valorNumerico 
           };
         });
-        if (salesData.length === 0 && channelsData.length > 0) {
+        if (salesData.length === 0) {
             console.warn("Vendas por Canal: A tabela 'sales' pode estar vazia.");
         }
         setDadosGrafico(dadosCombinados);
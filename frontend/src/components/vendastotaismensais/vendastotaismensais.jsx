@@ -37,6 +37,26 @@ const Vendastotaismensais = ({ queueIndex }) => {
   const [dadosGrafico, setDadosGrafico] = useState([]);
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState(null);
+  const requestBody = {
+    metric: {
+      func: 'COUNT',
+      column: 'id' 
+    },
+    group_by: [
+      { 
+        column: 'created_at', 
+        granularity: 'month'
+      }
+    ],
+    filters: [
+      {
+        column: 'sale_status_desc', 
+        op: '=',
+        value: 'COMPLETED'
+      }
+    ],
+    order_by: "date_group_field ASC" 
+  };
   useEffect(() => {
     if (!isMyTurnToLoad) {
       return; 
@@ -44,26 +64,6 @@ const Vendastotaismensais = ({ queueIndex }) => {
     const buscarDadosVendas = async () => {
       setIsLoading(true);
       setError(null);
-      const requestBody = {
-        metric: {
-          func: 'COUNT',
-          column: 'id' 
-        },
-        group_by: [
-          { 
-            column: 'created_at', 
-            granularity: 'month'
-          }
-        ],
-        filters: [
-          {
-            column: 'sale_status_desc', 
-            op: '=',
-            value: 'COMPLETED'
-          }
-        ],
-        order_by: "date_group_field ASC" 
-      };
       try {
         const response = await axios.post('http://127.0.0.1:8000/api/v1/analytics/query', requestBody);
         setDadosGrafico(response.data.data);
@@ -80,6 +80,28 @@ const Vendastotaismensais = ({ queueIndex }) => {
     };
     buscarDadosVendas();
   }, [isMyTurnToLoad, loadCompleted, hasLoadedOnce]);
+  useEffect(() => {
+    if (!hasLoadedOnce) {
+      return;
+    }
+    // Atualizações ao vivo: o servidor recalcula só os meses com vendas novas.
+    const url = 'http://127.0.0.1:8000/api/v1/analytics/live?query=' + encodeURIComponent(JSON.stringify(requestBody));
+    const source = new EventSource(url);
+    source.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type === 'snapshot') {
+        setDadosGrafico(message.data);
+        return;
+      }
+      setDadosGrafico((atuais) => {
+        const porMes = new Map(atuais.map(item => [item.date_group_field, item]));
+        message.upserts.forEach(item => porMes.set(item.date_group_field, item));
+        message.removed.forEach(item => porMes.delete(item.date_group_field));
+        return [...porMes.values()].sort((a, b) => a.date_group_field.localeCompare(b.date_group_field));
+      });
+    };
+    return () => source.close();
+  }, [hasLoadedOnce]);
   const dataKeyGrafico = 'date_group_field';
   return (
     <div className="dashboard-widget">
@@ -4,6 +4,10 @@ God Level Coder Challenge - Data Generator
 Generates realistic restaurant data based on Arcca's actual models
 """
 
+import csv
+import gzip
+import json
+import os
 import random
 import argparse
 from datetime import datetime, timedelta
@@ -14,10 +18,17 @@ from faker import Faker
 
 fake = Faker('pt_BR')
 
+# Data de referência ("agora") dos dados gerados; fixada com --end-date para
+# que a mesma --seed gere exatamente o mesmo dataset em qualquer dia.
+REFERENCE_NOW = datetime.now()
+
 # Configurations
 BRAND_ID = 1
 SALES_STATUS = ['COMPLETED', 'CANCELLED']
 STATUS_WEIGHTS = [0.95, 0.05]  # 95% completed
+# Linhas mais recentes de product_sales/item_product_sales lidas em --append/--resume
+# para estimar preço, popularidade e customização (sem varrer o histórico inteiro).
+HISTORY_SAMPLE_ROWS = 200_000
 CATEGORIES_PRODUCTS = ['Burgers', 'Pizzas', 'Pratos', 'Combos', 'Sobremesas', 'Bebidas']
 CATEGORIES_ITEMS = ['Complementos', 'Molhos', 'Adicionais']
 
@@ -82,32 +93,193 @@ def get_hour_weight(hour):
     return 0.01
 
 
-def setup_base_data(conn):
+class DatabaseSink:
+    """Destino padrão: grava direto no Postgres."""
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.payment_types = {}
+    
+    def insert(self, table, columns, values, returning=True):
+        """INSERT de uma linha; devolve o id gerado (com returning)."""
+        self.cursor.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+            + (" RETURNING id" if returning else ""),
+            values
+        )
+        return self.cursor.fetchone()[0] if returning else None
+    
+    def insert_many(self, table, columns, rows, page_size=1000):
+        """INSERT em lotes; devolve os ids das linhas inseridas, em ordem."""
+        execute_batch(
+            self.cursor,
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+            rows, page_size=page_size
+        )
+        self.cursor.execute(f"SELECT id FROM {table} ORDER BY id DESC LIMIT %s", (len(rows),))
+        ids = [row[0] for row in self.cursor.fetchall()]
+        ids.reverse()
+        return ids
+    
+    def payment_type_id(self, description):
+        if description not in self.payment_types:
+            self.cursor.execute(
+                "SELECT id FROM payment_types WHERE description = %s LIMIT 1",
+                (description,)
+            )
+            result = self.cursor.fetchone()
+            self.payment_types[description] = result[0] if result else None
+        return self.payment_types[description]
+    
+    def commit(self):
+        self.conn.commit()
+    
+    def save_run(self, run, mode, seed):
+        self.cursor.execute(f"""
+            INSERT INTO generator_runs (mode, start_at, end_at, daily_sales, seed, anomaly_week, promo_day)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            RETURNING {', '.join(RUN_COLUMNS)}
+        """, (mode, run['start_at'], run['end_at'], run['daily_sales'], seed,
+              run['anomaly_week'], run['promo_day']))
+        run.update(zip(RUN_COLUMNS, self.cursor.fetchone()))
+        self.conn.commit()
+    
+    def checkpoint(self, run, day, total_sales):
+        """Checkpoint do dia no mesmo COMMIT das vendas do dia."""
+        self.cursor.execute("""
+            UPDATE generator_runs
+            SET last_completed_day = %s, total_sales = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """, (day, total_sales, run['id']))
+        self.conn.commit()
+    
+    def finish_run(self, run):
+        self.cursor.execute(
+            "UPDATE generator_runs SET finished_at = CURRENT_TIMESTAMP WHERE id = %s",
+            (run['id'],)
+        )
+        self.conn.commit()
+    
+    def count(self, table):
+        self.cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return self.cursor.fetchone()[0]
+
+
+class FileSink:
+    """
+    Destino --output-dir: cada tabela vira <tabela>.csv (ou .csv.gz) no
+    formato CSV do COPY, com cabeçalho, e os ids são atribuídos aqui.
+    manifest.json lista arquivos, colunas, linhas e a ordem de criação;
+    load_dataset.py restaura o diretório com COPY.
+    """
+    
+    def __init__(self, directory, compress=False):
+        self.directory = directory
+        self.compress = compress
+        self.files = {}
+        self.next_ids = {}
+        self.rows = {}
+        self.payment_types = {}
+        self.run = None
+        self.run_info = {}
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, 'manifest.json')):
+            raise RuntimeError(f"{directory} já tem um dataset (manifest.json); use outro diretório.")
+    
+    def _writer(self, table, columns):
+        entry = self.files.get(table)
+        if entry is None:
+            file_name = f"{table}.csv.gz" if self.compress else f"{table}.csv"
+            path = os.path.join(self.directory, file_name)
+            if self.compress:
+                handle = gzip.open(path, 'wt', newline='', encoding='utf-8', compresslevel=1)
+            else:
+                handle = open(path, 'w', newline='', encoding='utf-8')
+            entry = {
+                'handle': handle,
+                'writer': csv.writer(handle),
+                'file': file_name,
+                'columns': ['id'] + list(columns)
+            }
+            entry['writer'].writerow(entry['columns'])
+            self.files[table] = entry
+        return entry['writer']
+    
+    def insert(self, table, columns, values, returning=True):
+        new_id = self.next_ids.get(table, 0) + 1
+        self.next_ids[table] = new_id
+        self._writer(table, columns).writerow((new_id, *values))
+        self.rows[table] = self.rows.get(table, 0) + 1
+        if table == 'payment_types':
+            self.payment_types[values[columns.index('description')]] = new_id
+        return new_id
+    
+    def insert_many(self, table, columns, rows, page_size=None):
+        return [self.insert(table, columns, row) for row in rows]
+    
+    def payment_type_id(self, description):
+        return self.payment_types.get(description)
+    
+    def commit(self):
+        pass
+    
+    def save_run(self, run, mode, seed):
+        self.run = run
+        self.run_info = {'mode': mode, 'seed': seed}
+    
+    def checkpoint(self, run, day, total_sales):
+        run['last_completed_day'] = day
+        run['total_sales'] = total_sales
+    
+    def finish_run(self, run):
+        pass
+    
+    def count(self, table):
+        return self.rows.get(table, 0)
+    
+    def close(self, generator_args=None):
+        """Fecha os arquivos e grava o manifest.json (por último: sem ele o diretório está incompleto)."""
+        for entry in self.files.values():
+            entry['handle'].close()
+        manifest = {
+            'version': 1,
+            'format': 'csv',
+            'compression': 'gzip' if self.compress else None,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'generator': generator_args or {},
+            'run': {**self.run_info, **{key: value for key, value in (self.run or {}).items() if key != 'id'}},
+            'tables': [{
+                'name': table,
+                'file': entry['file'],
+                'columns': entry['columns'],
+                'rows': self.rows.get(table, 0)
+            } for table, entry in self.files.items()]
+        }
+        with open(os.path.join(self.directory, 'manifest.json'), 'w', encoding='utf-8') as handle:
+            json.dump(manifest, handle, indent=2, default=str)
+
+
+def setup_base_data(sink):
     """Create brands, channels, payment types"""
     print("Setting up base data...")
-    cursor = conn.cursor()
     
     # Sub-brands
     sub_brands = ['Challenge Burger', 'Challenge Pizza', 'Challenge Sushi']
     sub_brand_ids = []
 
-    cursor.execute("INSERT INTO brands (name) VALUES ('Nola God Level Brand')");
+    sink.insert('brands', ['name'], ('Nola God Level Brand',), returning=False)
     for sb in sub_brands:
-        cursor.execute(
-            "INSERT INTO sub_brands (brand_id, name) VALUES (%s, %s) RETURNING id",
-            (BRAND_ID, sb)
-        )
-        sub_brand_ids.append(cursor.fetchone()[0])
+        sub_brand_ids.append(sink.insert('sub_brands', ['brand_id', 'name'], (BRAND_ID, sb)))
     
     # Channels
     channel_ids = []
     for name, ch_type, weight, commission in CHANNELS:
-        cursor.execute("""
-            INSERT INTO channels (brand_id, name, description, type)
-            VALUES (%s, %s, %s, %s) RETURNING id
-        """, (BRAND_ID, name, f'Canal {name}', ch_type))
         channel_ids.append({
-            'id': cursor.fetchone()[0], 
+            'id': sink.insert(
+                'channels', ['brand_id', 'name', 'description', 'type'],
+                (BRAND_ID, name, f'Canal {name}', ch_type)
+            ),
             'name': name, 
             'type': ch_type, 
             'weight': weight
@@ -115,20 +287,24 @@ def setup_base_data(conn):
     
     # Payment types
     for pt in PAYMENT_TYPES_LIST:
-        cursor.execute(
-            "INSERT INTO payment_types (brand_id, description) VALUES (%s, %s)",
-            (BRAND_ID, pt)
-        )
+        sink.insert('payment_types', ['brand_id', 'description'], (BRAND_ID, pt), returning=False)
     
-    conn.commit()
+    sink.commit()
     print(f"✓ Base data: {len(sub_brand_ids)} sub-brands, {len(channel_ids)} channels")
     return sub_brand_ids, channel_ids
 
 
-def generate_stores(conn, sub_brand_ids, num_stores=50):
+STORE_COLUMNS = [
+    'brand_id', 'sub_brand_id', 'name', 'city', 'state',
+    'district', 'address_street', 'address_number',
+    'latitude', 'longitude', 'is_active', 'is_own',
+    'creation_date', 'created_at'
+]
+
+
+def generate_stores(sink, sub_brand_ids, num_stores=50):
     """Generate realistic stores"""
     print(f"Generating {num_stores} stores...")
-    cursor = conn.cursor()
     stores = []
     
     cities = [fake.city() for _ in range(20)]
@@ -144,15 +320,7 @@ def generate_stores(conn, sub_brand_ids, num_stores=50):
         base_lat = -23.5 + random.uniform(-2, 2)  # -25.5 to -21.5
         base_long = -46.6 + random.uniform(-3, 3)  # -49.6 to -43.6
         
-        cursor.execute("""
-            INSERT INTO stores (
-                brand_id, sub_brand_id, name, city, state, 
-                district, address_street, address_number,
-                latitude, longitude, is_active, is_own,
-                creation_date, created_at
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (
+        stores.append(sink.insert('stores', STORE_COLUMNS, (
             BRAND_ID, sub_brand_id,
             f"{fake.company()} - {city}",
             city, fake.estado_sigla(), fake.bairro(),
@@ -161,19 +329,20 @@ def generate_stores(conn, sub_brand_ids, num_stores=50):
             Decimal(str(round(base_long, 6))),
             is_active, is_own,
             fake.date_between(start_date='-2y', end_date='-6m'),
-            datetime.now() - timedelta(days=random.randint(180, 720))
-        ))
-        stores.append(cursor.fetchone()[0])
+            REFERENCE_NOW - timedelta(days=random.randint(180, 720))
+        )))
     
-    conn.commit()
+    sink.commit()
     print(f"✓ {len(stores)} stores created")
     return stores
 
 
-def generate_products_and_items(conn, sub_brand_ids, num_products=500, num_items=200):
+CATALOG_COLUMNS = ['brand_id', 'sub_brand_id', 'category_id', 'name', 'pos_uuid']
+
+
+def generate_products_and_items(sink, sub_brand_ids, num_products=500, num_items=200):
     """Generate products, items, and option groups"""
     print(f"Generating {num_products} products and {num_items} items...")
-    cursor = conn.cursor()
     
     products = []
     items = []
@@ -181,11 +350,7 @@ def generate_products_and_items(conn, sub_brand_ids, num_products=500, num_items
     
     # Product categories
     for cat_name in CATEGORIES_PRODUCTS:
-        cursor.execute("""
-            INSERT INTO categories (brand_id, name, type)
-            VALUES (%s, %s, 'P') RETURNING id
-        """, (BRAND_ID, cat_name))
-        cat_id = cursor.fetchone()[0]
+        cat_id = sink.insert('categories', ['brand_id', 'name', 'type'], (BRAND_ID, cat_name, 'P'))
         
         # Products in category
         prefixes = PRODUCT_PREFIXES.get(cat_name, [cat_name])
@@ -203,13 +368,13 @@ def generate_products_and_items(conn, sub_brand_ids, num_products=500, num_items
             else:
                 name = f"{prefix} G #{i+1:03d}"
             
-            cursor.execute("""
-                INSERT INTO products (brand_id, sub_brand_id, category_id, name, pos_uuid)
-                VALUES (%s, %s, %s, %s, %s) RETURNING id
-            """, (BRAND_ID, sub_brand_id, cat_id, name, f"prod_{cat_id}_{i}"))
+            product_id = sink.insert(
+                'products', CATALOG_COLUMNS,
+                (BRAND_ID, sub_brand_id, cat_id, name, f"prod_{cat_id}_{i}")
+            )
             
             products.append({
-                'id': cursor.fetchone()[0],
+                'id': product_id,
                 'name': name,
                 'category': cat_name,
                 'base_price': round(random.uniform(15, 120), 2),
@@ -219,11 +384,7 @@ def generate_products_and_items(conn, sub_brand_ids, num_products=500, num_items
     
     # Item categories (for complements/additions)
     for cat_name in CATEGORIES_ITEMS:
-        cursor.execute("""
-            INSERT INTO categories (brand_id, name, type)
-            VALUES (%s, %s, 'I') RETURNING id
-        """, (BRAND_ID, cat_name))
-        cat_id = cursor.fetchone()[0]
+        cat_id = sink.insert('categories', ['brand_id', 'name', 'type'], (BRAND_ID, cat_name, 'I'))
         
         # Items in category - use realistic names
         item_names_list = ITEM_NAMES.get(cat_name, [])
@@ -233,13 +394,13 @@ def generate_products_and_items(conn, sub_brand_ids, num_products=500, num_items
             for item_name in item_names_list:
                 sub_brand_id = random.choice(sub_brand_ids)
                 
-                cursor.execute("""
-                    INSERT INTO items (brand_id, sub_brand_id, category_id, name, pos_uuid)
-                    VALUES (%s, %s, %s, %s, %s) RETURNING id
-                """, (BRAND_ID, sub_brand_id, cat_id, item_name, f"item_{cat_id}_{item_name[:10]}"))
+                item_id = sink.insert(
+                    'items', CATALOG_COLUMNS,
+                    (BRAND_ID, sub_brand_id, cat_id, item_name, f"item_{cat_id}_{item_name[:10]}")
+                )
                 
                 items.append({
-                    'id': cursor.fetchone()[0],
+                    'id': item_id,
                     'name': item_name,
                     'price': round(random.uniform(2, 15), 2)
                 })
@@ -249,13 +410,13 @@ def generate_products_and_items(conn, sub_brand_ids, num_products=500, num_items
                 sub_brand_id = random.choice(sub_brand_ids)
                 name = f"{cat_name[:-1]} #{i+1:02d}"
                 
-                cursor.execute("""
-                    INSERT INTO items (brand_id, sub_brand_id, category_id, name, pos_uuid)
-                    VALUES (%s, %s, %s, %s, %s) RETURNING id
-                """, (BRAND_ID, sub_brand_id, cat_id, name, f"item_{cat_id}_{i}"))
+                item_id = sink.insert(
+                    'items', CATALOG_COLUMNS,
+                    (BRAND_ID, sub_brand_id, cat_id, name, f"item_{cat_id}_{i}")
+                )
                 
                 items.append({
-                    'id': cursor.fetchone()[0],
+                    'id': item_id,
                     'name': name,
                     'price': round(random.uniform(2, 15), 2)
                 })
@@ -263,21 +424,16 @@ def generate_products_and_items(conn, sub_brand_ids, num_products=500, num_items
     # Option groups
     option_group_names = ['Adicionais', 'Remover', 'Ponto da Carne', 'Tamanho']
     for og_name in option_group_names:
-        cursor.execute("""
-            INSERT INTO option_groups (brand_id, name)
-            VALUES (%s, %s) RETURNING id
-        """, (BRAND_ID, og_name))
-        option_groups.append(cursor.fetchone()[0])
+        option_groups.append(sink.insert('option_groups', ['brand_id', 'name'], (BRAND_ID, og_name)))
     
-    conn.commit()
+    sink.commit()
     print(f"✓ {len(products)} products, {len(items)} items, {len(option_groups)} option groups")
     return products, items, option_groups
 
 
-def generate_customers(conn, num_customers=10000):
+def generate_customers(sink, num_customers=10000):
     """Generate customers"""
     print(f"Generating {num_customers} customers...")
-    cursor = conn.cursor()
     
     batch = []
     for _ in range(num_customers):
@@ -288,38 +444,185 @@ def generate_customers(conn, num_customers=10000):
             random.choice([True, False]),
             random.choice([True, False, False]),  # 33% accept email
             random.choice(['qr_code', 'link', 'balcony', 'pos']),
-            datetime.now() - timedelta(days=random.randint(0, 720))
+            REFERENCE_NOW - timedelta(days=random.randint(0, 720))
         ))
     
-    execute_batch(cursor, """
-        INSERT INTO customers (
-            customer_name, email, phone_number, cpf, birth_date, gender,
-            agree_terms, receive_promotions_email, registration_origin, created_at
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """, batch, page_size=1000)
+    customer_ids = sink.insert_many('customers', [
+        'customer_name', 'email', 'phone_number', 'cpf', 'birth_date', 'gender',
+        'agree_terms', 'receive_promotions_email', 'registration_origin', 'created_at'
+    ], batch, page_size=1000)
     
-    cursor.execute("SELECT id FROM customers")
-    customer_ids = [row[0] for row in cursor.fetchall()]
-    
-    conn.commit()
+    sink.commit()
     print(f"✓ {len(customer_ids)} customers created")
     return customer_ids
 
 
-def generate_sales(conn, stores, channels, products, items, option_groups, customers, months=6):
-    """Generate sales with realistic patterns"""
-    print(f"Generating sales for {months} months...")
-    
+def ensure_checkpoint_table(conn):
+    """Tabela de checkpoints do gerador (também em database-schema.sql)."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS generator_runs (
+            id SERIAL PRIMARY KEY,
+            mode VARCHAR(20) NOT NULL,
+            start_at TIMESTAMP NOT NULL,
+            end_at TIMESTAMP NOT NULL,
+            daily_sales INTEGER NOT NULL,
+            seed INTEGER,
+            anomaly_week TIMESTAMP,
+            promo_day TIMESTAMP,
+            last_completed_day DATE,
+            total_sales BIGINT NOT NULL DEFAULT 0,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+
+RUN_COLUMNS = ['id', 'start_at', 'end_at', 'daily_sales', 'anomaly_week', 'promo_day',
+               'last_completed_day', 'total_sales']
+
+
+def create_run(sink, mode, start_date, end_date, daily_sales, seed=None):
+    """Registra uma execução nova; as anomalias ficam salvas para o --resume."""
+    run = {
+        'id': None,
+        'start_at': start_date,
+        'end_at': end_date,
+        'daily_sales': daily_sales,
+        'anomaly_week': start_date + timedelta(days=random.randint(30, 60)),
+        'promo_day': start_date + timedelta(days=random.randint(90, 120)),
+        'last_completed_day': None,
+        'total_sales': 0
+    }
+    sink.save_run(run, mode, seed)
+    return run
+
+
+def load_unfinished_run(conn):
+    """Última execução não concluída (para o --resume), ou None."""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT {', '.join(RUN_COLUMNS)} FROM generator_runs
+        WHERE finished_at IS NULL
+        ORDER BY id DESC
+        LIMIT 1
+    """)
+    row = cursor.fetchone()
+    return dict(zip(RUN_COLUMNS, row)) if row else None
+
+
+def load_existing_data(conn):
+    """
+    Lê sub-marcas, canais, lojas, produtos, itens, option groups e clientes já
+    cadastrados (modos --append/--resume). Preço base, popularidade e
+    customização dos produtos e preço dos itens vêm das HISTORY_SAMPLE_ROWS
+    linhas de venda mais recentes (varredura pela PK, de trás para frente)
+    quando existem.
+    """
+    print("Loading existing base data...")
     cursor = conn.cursor()
-    start_date = datetime.now() - timedelta(days=30 * months)
-    end_date = datetime.now()
     
-    # Anomalies
-    anomaly_week = start_date + timedelta(days=random.randint(30, 60))
-    promo_day = start_date + timedelta(days=random.randint(90, 120))
+    cursor.execute("SELECT id FROM sub_brands ORDER BY id")
+    sub_brand_ids = [row[0] for row in cursor.fetchall()]
+    
+    channel_weights = {name: weight for name, _, weight, _ in CHANNELS}
+    cursor.execute("SELECT id, name, type FROM channels ORDER BY id")
+    channels = [{
+        'id': channel_id, 'name': name, 'type': ch_type,
+        'weight': channel_weights.get(name, 0.01)
+    } for channel_id, name, ch_type in cursor.fetchall()]
+    
+    cursor.execute("SELECT id FROM stores ORDER BY id")
+    stores = [row[0] for row in cursor.fetchall()]
+    
+    cursor.execute("""
+        WITH ps AS (
+            SELECT id, product_id, base_price, quantity FROM product_sales ORDER BY id DESC LIMIT %(sample)s
+        ), ips AS (
+            SELECT product_sale_id FROM item_product_sales ORDER BY id DESC LIMIT %(sample)s
+        )
+        SELECT p.id, p.name, c.name, h.base_price, h.quantity, h.customized
+        FROM products p
+        LEFT JOIN categories c ON c.id = p.category_id
+        LEFT JOIN (
+            SELECT ps.product_id,
+                   AVG(ps.base_price) AS base_price,
+                   SUM(ps.quantity) AS quantity,
+                   -- Só as vendas cobertas pela amostra de itens; sem nenhuma, NULL (sorteado abaixo).
+                   bool_or(ps.id IN (SELECT product_sale_id FROM ips))
+                       FILTER (WHERE ps.id >= (SELECT MIN(product_sale_id) FROM ips)) AS customized
+            FROM ps
+            GROUP BY ps.product_id
+        ) h ON h.product_id = p.id
+        WHERE p.deleted_at IS NULL
+        ORDER BY p.id
+    """, {"sample": HISTORY_SAMPLE_ROWS})
+    rows = cursor.fetchall()
+    max_quantity = max([float(row[4]) for row in rows if row[4]] or [1.0])
+    products = [{
+        'id': product_id,
+        'name': name,
+        'category': category,
+        'base_price': round(float(base_price), 2) if base_price is not None else round(random.uniform(15, 120), 2),
+        'popularity': float(quantity) / max_quantity if quantity else random.betavariate(2, 5),
+        'has_customization': customized if customized is not None else random.random() > 0.4
+    } for product_id, name, category, base_price, quantity, customized in rows]
+    
+    cursor.execute("""
+        WITH ips AS (
+            SELECT item_id, price FROM item_product_sales ORDER BY id DESC LIMIT %s
+        )
+        SELECT i.id, i.name, AVG(ips.price)
+        FROM items i
+        LEFT JOIN ips ON ips.item_id = i.id
+        WHERE i.deleted_at IS NULL
+        GROUP BY i.id, i.name
+        ORDER BY i.id
+    """, (HISTORY_SAMPLE_ROWS,))
+    items = [{
+        'id': item_id,
+        'name': name,
+        'price': round(float(price), 2) if price is not None else round(random.uniform(2, 15), 2)
+    } for item_id, name, price in cursor.fetchall()]
+    
+    cursor.execute("SELECT id FROM option_groups ORDER BY id")
+    option_groups = [row[0] for row in cursor.fetchall()]
+    
+    cursor.execute("SELECT id FROM customers")
+    customers = [row[0] for row in cursor.fetchall()]
+    
+    conn.commit()
+    if not (sub_brand_ids and channels and stores and products and items):
+        raise RuntimeError("Banco sem dados base: rode o gerador sem --append primeiro.")
+    print(f"✓ {len(stores)} stores, {len(channels)} channels, {len(products)} products, "
+          f"{len(items)} items, {len(customers)} customers")
+    return sub_brand_ids, channels, stores, products, items, option_groups, customers
+
+
+def generate_sales(sink, stores, channels, products, items, option_groups, customers, run):
+    """
+    Generate sales with realistic patterns.
+    
+    Cada dia é uma transação: as vendas do dia e o checkpoint em generator_runs
+    são gravados no mesmo COMMIT, então --resume continua do dia seguinte ao
+    último dia completo sem duplicar nem perder vendas.
+    """
+    start_date = run['start_at']
+    end_date = run['end_at']
+    anomaly_week = run['anomaly_week']
+    promo_day = run['promo_day']
+    daily_sales = run['daily_sales']
     
     current_date = start_date
-    total_sales = 0
+    if run['last_completed_day'] is not None:
+        current_date = start_date + timedelta(days=(run['last_completed_day'] - start_date.date()).days + 1)
+        print(f"Resuming sales from {current_date.strftime('%Y-%m-%d')}...")
+    else:
+        print(f"Generating sales from {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}...")
+    
+    total_sales = run['total_sales']
     batch_size = 500
     
     while current_date <= end_date:
@@ -334,11 +637,11 @@ def generate_sales(conn, stores, channels, products, items, option_groups, custo
         if current_date.date() == promo_day.date():
             day_mult *= 3.0
         
-        daily_sales = int(random.gauss(2700, 400) * day_mult)
+        day_sales = int(random.gauss(daily_sales, daily_sales * 400 / 2700) * day_mult)
         
         sales_batch = []
         
-        for _ in range(daily_sales):
+        for _ in range(day_sales):
             # Hour distribution
             hour_weights = [get_hour_weight(h) * 100 for h in range(24)]
             hour = random.choices(range(24), weights=hour_weights)[0]
@@ -352,7 +655,7 @@ def generate_sales(conn, stores, channels, products, items, option_groups, custo
             # Select entities
             store_id = random.choice(stores)
             channel = random.choices(channels, weights=[c['weight'] for c in channels])[0]
-            customer_id = random.choice(customers) if random.random() > 0.3 else None
+            customer_id = random.choice(customers) if customers and random.random() > 0.3 else None
             
             # Generate sale
             sale_data = generate_single_sale(
@@ -363,22 +666,23 @@ def generate_sales(conn, stores, channels, products, items, option_groups, custo
             sales_batch.append(sale_data)
             
             if len(sales_batch) >= batch_size:
-                insert_sales_batch(cursor, sales_batch, items, option_groups)
+                insert_sales_batch(sink, sales_batch, items, option_groups)
                 total_sales += len(sales_batch)
                 sales_batch = []
-                conn.commit()
         
         # Insert remaining
         if sales_batch:
-            insert_sales_batch(cursor, sales_batch, items, option_groups)
+            insert_sales_batch(sink, sales_batch, items, option_groups)
             total_sales += len(sales_batch)
-            conn.commit()
+        
+        sink.checkpoint(run, current_date.date(), total_sales)
         
         current_date += timedelta(days=1)
         
         if current_date.day == 1:
             print(f"  → {current_date.strftime('%B %Y')}: {total_sales:,} sales")
     
+    sink.finish_run(run)
     print(f"✓ {total_sales:,} total sales generated")
     return total_sales
 
@@ -530,7 +834,31 @@ def generate_single_sale(sale_time, store_id, channel, customer_id, products, it
     }
 
 
-def insert_sales_batch(cursor, sales_batch, items, option_groups):
+SALE_COLUMNS = [
+    'store_id', 'customer_id', 'channel_id', 'customer_name',
+    'created_at', 'sale_status_desc',
+    'total_amount_items', 'total_discount', 'total_increase',
+    'delivery_fee', 'service_tax_fee', 'total_amount', 'value_paid',
+    'production_seconds', 'delivery_seconds',
+    'discount_reason', 'people_quantity', 'origin'
+]
+PRODUCT_SALE_COLUMNS = ['sale_id', 'product_id', 'quantity', 'base_price', 'total_price']
+ITEM_PRODUCT_SALE_COLUMNS = [
+    'product_sale_id', 'item_id', 'option_group_id',
+    'quantity', 'additional_price', 'price', 'amount'
+]
+DELIVERY_SALE_COLUMNS = [
+    'sale_id', 'courier_name', 'courier_phone', 'courier_type',
+    'delivery_type', 'status', 'delivery_fee', 'courier_fee'
+]
+DELIVERY_ADDRESS_COLUMNS = [
+    'sale_id', 'delivery_sale_id', 'street', 'number', 'complement',
+    'neighborhood', 'city', 'state', 'postal_code', 'latitude', 'longitude'
+]
+PAYMENT_COLUMNS = ['sale_id', 'payment_type_id', 'value']
+
+
+def insert_sales_batch(sink, sales_batch, items, option_groups):
     """Insert batch of sales with all related data"""
     
     # Insert sales
@@ -548,97 +876,53 @@ def insert_sales_batch(cursor, sales_batch, items, option_groups):
         s['discount_reason'], s['people_qty'], 'POS'
     ) for s in sales_batch]
     
-    execute_batch(cursor, """
-        INSERT INTO sales (
-            store_id, customer_id, channel_id, customer_name,
-            created_at, sale_status_desc,
-            total_amount_items, total_discount, total_increase,
-            delivery_fee, service_tax_fee, total_amount, value_paid,
-            production_seconds, delivery_seconds,
-            discount_reason, people_quantity, origin
-        ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-    """, sales_data, page_size=500)
-    
-    # Get inserted sale IDs
-    cursor.execute("""
-        SELECT id FROM sales 
-        ORDER BY id DESC 
-        LIMIT %s
-    """, (len(sales_batch),))
-    sale_ids = [row[0] for row in cursor.fetchall()]
-    sale_ids.reverse()
+    sale_ids = sink.insert_many('sales', SALE_COLUMNS, sales_data, page_size=500)
     
     # Insert product_sales and related data
     for sale_id, sale in zip(sale_ids, sales_batch):
         for prod_data in sale['products']:
-            cursor.execute("""
-                INSERT INTO product_sales (
-                    sale_id, product_id, quantity, base_price, total_price
-                ) VALUES (%s,%s,%s,%s,%s) RETURNING id
-            """, (
+            product_sale_id = sink.insert('product_sales', PRODUCT_SALE_COLUMNS, (
                 sale_id, prod_data['product_id'],
                 prod_data['quantity'], prod_data['base_price'],
                 prod_data['total_price']
             ))
-            product_sale_id = cursor.fetchone()[0]
             
             # Insert items for this product
             for item_data in prod_data['items']:
-                cursor.execute("""
-                    INSERT INTO item_product_sales (
-                        product_sale_id, item_id, option_group_id,
-                        quantity, additional_price, price, amount
-                    ) VALUES (%s,%s,%s,%s,%s,%s,%s)
-                """, (
+                sink.insert('item_product_sales', ITEM_PRODUCT_SALE_COLUMNS, (
                     product_sale_id, item_data['item_id'],
                     item_data['option_group_id'],
                     item_data['quantity'], item_data['additional_price'],
                     item_data['price'], 1
-                ))
+                ), returning=False)
         
         # Insert delivery data
         if sale['delivery']:
             d = sale['delivery']
-            cursor.execute("""
-                INSERT INTO delivery_sales (
-                    sale_id, courier_name, courier_phone, courier_type,
-                    delivery_type, status, delivery_fee, courier_fee
-                ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s) RETURNING id
-            """, (
+            delivery_sale_id = sink.insert('delivery_sales', DELIVERY_SALE_COLUMNS, (
                 sale_id, d['courier_name'], d['courier_phone'],
                 d['courier_type'], d['delivery_type'], d['status'],
                 d['delivery_fee'], d['courier_fee']
             ))
-            delivery_sale_id = cursor.fetchone()[0]
             
             addr = d['address']
             # Ensure coordinates are within valid range for Brazil
             lat = max(-33.0, min(-5.0, addr['latitude']))
             long = max(-74.0, min(-34.0, addr['longitude']))
             
-            cursor.execute("""
-                INSERT INTO delivery_addresses (
-                    sale_id, delivery_sale_id, street, number, complement,
-                    neighborhood, city, state, postal_code, latitude, longitude
-                ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-            """, (
+            sink.insert('delivery_addresses', DELIVERY_ADDRESS_COLUMNS, (
                 sale_id, delivery_sale_id, addr['street'], addr['number'],
                 addr['complement'], addr['neighborhood'], addr['city'],
                 addr['state'], addr['postal_code'], lat, long
-            ))
+            ), returning=False)
         
         # Insert payments
         for payment in sale['payments']:
-            cursor.execute(
-                "SELECT id FROM payment_types WHERE description = %s LIMIT 1",
-                (payment['type'],)
-            )
-            result = cursor.fetchone()
-            if result:
-                cursor.execute("""
-                    INSERT INTO payments (sale_id, payment_type_id, value)
-                    VALUES (%s,%s,%s)
-                """, (sale_id, result[0], Decimal(str(payment['value']))))
+            payment_type_id = sink.payment_type_id(payment['type'])
+            if payment_type_id:
+                sink.insert('payments', PAYMENT_COLUMNS, (
+                    sale_id, payment_type_id, Decimal(str(payment['value']))
+                ), returning=False)
 
 
 def create_indexes(conn):
@@ -672,8 +956,30 @@ def main():
     parser.add_argument('--items', type=int, default=200, help='Number of items/complements')
     parser.add_argument('--customers', type=int, default=10000, help='Number of customers')
     parser.add_argument('--months', type=int, default=6, help='Months of sales data')
+    parser.add_argument('--daily-sales', type=int, default=2700, help='Average sales per day')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed (repeatable dataset)')
+    parser.add_argument('--end-date', default=None,
+                       help='Last day of sales, YYYY-MM-DD (default: today)')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--append', action='store_true',
+                      help='Add --months of sales after the last existing sale, reusing stores/products/customers')
+    mode.add_argument('--resume', action='store_true',
+                      help='Continue the last unfinished run from the day after its last committed day')
+    parser.add_argument('--output-dir', default=None,
+                       help='Write every table as COPY-ready CSV files plus manifest.json into this '
+                            'directory instead of the database (restore with load_dataset.py)')
+    parser.add_argument('--compress', action='store_true', help='gzip the --output-dir files')
     
     args = parser.parse_args()
+    if args.output_dir and (args.append or args.resume):
+        parser.error('--output-dir always writes a new dataset; it cannot be combined with --append/--resume')
+    
+    global REFERENCE_NOW
+    if args.seed is not None:
+        random.seed(args.seed)
+        Faker.seed(args.seed)
+    if args.end_date:
+        REFERENCE_NOW = datetime.strptime(args.end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
     
     print("=" * 70)
     print("God Level Coder Challenge - Data Generator")
@@ -681,33 +987,66 @@ def main():
     print(f"Generating {args.months} months of restaurant operational data...")
     print()
     
-    conn = get_db_connection(args.db_url)
+    if args.output_dir:
+        conn = None
+        sink = FileSink(args.output_dir, compress=args.compress)
+    else:
+        conn = get_db_connection(args.db_url)
+        sink = DatabaseSink(conn)
     
     try:
-        sub_brand_ids, channels = setup_base_data(conn)
-        stores = generate_stores(conn, sub_brand_ids, args.stores)
-        products, items, option_groups = generate_products_and_items(
-            conn, sub_brand_ids, args.products, args.items
-        )
-        customers = generate_customers(conn, args.customers)
+        if conn is not None:
+            ensure_checkpoint_table(conn)
+            cursor = conn.cursor()
+        
+        if args.resume:
+            run = load_unfinished_run(conn)
+            if run is None:
+                raise RuntimeError("Nenhuma execução inacabada em generator_runs para retomar.")
+            (sub_brand_ids, channels, stores, products, items,
+             option_groups, customers) = load_existing_data(conn)
+        elif args.append:
+            (sub_brand_ids, channels, stores, products, items,
+             option_groups, customers) = load_existing_data(conn)
+            cursor.execute("SELECT MAX(created_at) FROM sales")
+            last_sale = cursor.fetchone()[0]
+            start_date = (last_sale + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0) \
+                if last_sale else REFERENCE_NOW.replace(hour=0, minute=0, second=0, microsecond=0)
+            end_date = REFERENCE_NOW if args.end_date else start_date + timedelta(days=30 * args.months - 1)
+            if end_date < start_date:
+                raise RuntimeError(f"--end-date anterior à última venda existente ({last_sale}).")
+            run = create_run(sink, 'append', start_date, end_date, args.daily_sales, args.seed)
+        else:
+            if conn is not None:
+                cursor.execute("SELECT EXISTS (SELECT 1 FROM stores)")
+                if cursor.fetchone()[0]:
+                    raise RuntimeError("O banco já tem dados: use --append para estender ou --resume para retomar.")
+            sub_brand_ids, channels = setup_base_data(sink)
+            stores = generate_stores(sink, sub_brand_ids, args.stores)
+            products, items, option_groups = generate_products_and_items(
+                sink, sub_brand_ids, args.products, args.items
+            )
+            customers = generate_customers(sink, args.customers)
+            run = create_run(
+                sink, 'full', REFERENCE_NOW - timedelta(days=30 * args.months), REFERENCE_NOW,
+                args.daily_sales, args.seed
+            )
         
         total_sales = generate_sales(
-            conn, stores, channels, products, items, 
-            option_groups, customers, args.months
+            sink, stores, channels, products, items, 
+            option_groups, customers, run
         )
         
-        create_indexes(conn)
+        if conn is not None:
+            create_indexes(conn)
+        else:
+            sink.close({key: value for key, value in vars(args).items() if key != 'db_url'})
+            print(f"✓ Files and manifest.json written to {args.output_dir}")
         
         # Final stats
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM sales")
-        sales_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM product_sales")
-        product_sales_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM item_product_sales")
-        item_sales_count = cursor.fetchone()[0]
+        sales_count = sink.count('sales')
+        product_sales_count = sink.count('product_sales')
+        item_sales_count = sink.count('item_product_sales')
         
         print()
         print("=" * 70)
@@ -724,10 +1063,12 @@ def main():
         
     except Exception as e:
         print(f"Error: {e}")
-        conn.rollback()
+        if conn is not None:
+            conn.rollback()
         raise
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 
 if __name__ == '__main__':